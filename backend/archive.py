@@ -0,0 +1,424 @@
+"""Streaming export and bulk import of card collections as tar or zip archives.
+
+An archive holds ``archive.json`` (format version), then for each batch of
+cards a ``manifest/NNNNN.ndjson`` chunk followed by the images that chunk
+introduces, as ``images/<sha256>.<ext>`` (originals and variants, each blob
+once per archive). Manifests come before their images so both sides work
+one batch at a time: the exporter never holds more than a batch and the
+importer inserts each batch once its images have arrived.
+
+Run from the backend directory with the same environment as the server:
+
+    python archive.py export --user <user id> collection.tar
+    python archive.py export --all cards.zip
+    python archive.py import --user <user id> collection.tar
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import tarfile
+import time
+import uuid
+import zipfile
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pydantic import BaseModel
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from blobstore import BlobStore
+from counters import COLLECTION_SIZE, COLLECTION_VERSION, increment_counters, user_counter
+
+ROOT_DIR = Path(__file__).parent
+logger = logging.getLogger(__name__)
+
+ARCHIVE_VERSION = 1
+FORMATS = {"tar": "application/x-tar", "zip": "application/zip"}
+
+# Larger members are refused on import rather than read into memory
+MAX_MEMBER_BYTES = 64 * 1024 * 1024
+
+EXTENSIONS = {"image/png": "png", "image/webp": "webp", "image/jpeg": "jpg"}
+
+# Stored card fields carried in manifests; everything else is rebuilt or reset on import
+CARD_EXPORT_PROJECTION = {
+    "_id": 0, "id": 1, "prompt": 1, "model": 1, "created_at": 1, "served": 1, "served_at": 1,
+    "image_sha256": 1, "image_content_type": 1, "image_variants": 1, "image_dhash": 1, "image_dhash_bands": 1,
+    "remix_of": 1, "duplicate_of": 1,
+}
+
+
+class InvalidArchive(ValueError):
+    pass
+
+
+class ArchivedCard(BaseModel):
+    id: str
+    prompt: str
+    model: Optional[str] = None
+    created_at: datetime
+    served: bool = True
+    served_at: Optional[datetime] = None
+    image_sha256: str
+    image_content_type: str = "image/png"
+    image_variants: Dict[str, dict] = {}
+    image_dhash: Optional[str] = None
+    image_dhash_bands: List[str] = []
+    remix_of: Optional[str] = None
+    duplicate_of: Optional[str] = None
+    # Set in collection exports
+    liked_at: Optional[datetime] = None
+
+
+def _image_name(key: str, content_type: str) -> str:
+    return f"images/{key}.{EXTENSIONS.get(content_type, 'bin')}"
+
+
+def _card_blobs(card: dict) -> List[Tuple[str, str]]:
+    blobs = [(card["image_sha256"], card.get("image_content_type", "image/png"))]
+    for variant in card.get("image_variants", {}).values():
+        blobs.append((variant["sha256"], variant["content_type"]))
+    return blobs
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+class _TarWriter:
+    """Tar members as bytes, without a file to seek in."""
+
+    def member(self, name: str, data: bytes) -> bytes:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        return info.tobuf(format=tarfile.PAX_FORMAT) + data + b"\0" * (-len(data) % tarfile.BLOCKSIZE)
+
+    def close(self) -> bytes:
+        return b"\0" * (2 * tarfile.BLOCKSIZE)
+
+
+class _ZipWriter:
+    """Stored (uncompressed) zip members; zipfile writes data descriptors when it cannot seek."""
+
+    class _Sink(io.RawIOBase):
+        def __init__(self):
+            self.chunks = []
+
+        def writable(self):
+            return True
+
+        def write(self, data):
+            self.chunks.append(bytes(data))
+            return len(data)
+
+    def __init__(self):
+        self._sink = self._Sink()
+        self._zip = zipfile.ZipFile(self._sink, "w", zipfile.ZIP_STORED, allowZip64=True)
+
+    def _drain(self) -> bytes:
+        data, self._sink.chunks = b"".join(self._sink.chunks), []
+        return data
+
+    def member(self, name: str, data: bytes) -> bytes:
+        self._zip.writestr(zipfile.ZipInfo(name, time.gmtime()[:6]), data)
+        return self._drain()
+
+    def close(self) -> bytes:
+        self._zip.close()
+        return self._drain()
+
+
+async def _export_rows(db, user_id: Optional[str], batch_size: int) -> AsyncIterator[List[dict]]:
+    """Batches of exported cards: a user's likes newest first, or every card oldest first."""
+    if user_id is None:
+        batch = []
+        async for card in db.cards.find({}, CARD_EXPORT_PROJECTION, batch_size=batch_size).sort("created_at", 1):
+            batch.append(card)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        return
+
+    rows = db.likes.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$sort": {"liked_at": -1, "id": -1}},
+        {"$lookup": {"from": "cards", "localField": "card_id", "foreignField": "id", "as": "card"}},
+        {"$unwind": "$card"},
+        {"$project": {
+            "_id": 0, "liked_at": 1, **{f"card.{field}": 1 for field in CARD_EXPORT_PROJECTION if field != "_id"},
+        }},
+    ], batchSize=batch_size)
+    batch = []
+    async for row in rows:
+        batch.append({**row["card"], "liked_at": row["liked_at"]})
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def export_archive(
+    db, image_store: BlobStore, user_id: Optional[str] = None, fmt: str = "tar", batch_size: int = 500
+) -> AsyncIterator[bytes]:
+    """Stream an archive of a user's collection, or of every card when ``user_id`` is None."""
+    writer = _TarWriter() if fmt == "tar" else _ZipWriter()
+    header = {"version": ARCHIVE_VERSION, "exported_at": datetime.now(timezone.utc), "user_id": user_id}
+    yield writer.member("archive.json", json.dumps(header, default=_json_default).encode())
+
+    written = set()
+    chunk = 0
+    async for cards in _export_rows(db, user_id, batch_size):
+        manifest = "".join(json.dumps(card, default=_json_default) + "\n" for card in cards)
+        yield writer.member(f"manifest/{chunk:05d}.ndjson", manifest.encode())
+        chunk += 1
+        for card in cards:
+            for key, content_type in _card_blobs(card):
+                if key in written:
+                    continue
+                try:
+                    data = await image_store.get(key)
+                except FileNotFoundError:
+                    logger.warning(f"Image {key} of card {card['id']} is missing from the blob store")
+                    continue
+                written.add(key)
+                yield writer.member(_image_name(key, content_type), data)
+    yield writer.close()
+
+
+def _read_members(path: Path) -> Iterator[Tuple[str, bytes]]:
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                if info.file_size > MAX_MEMBER_BYTES:
+                    raise InvalidArchive(f"Archive member {info.filename} is too large")
+                yield info.filename, archive.read(info)
+        return
+    try:
+        archive = tarfile.open(path, "r|*")
+    except tarfile.TarError:
+        raise InvalidArchive("Not a tar or zip archive")
+    with archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            if member.size > MAX_MEMBER_BYTES:
+                raise InvalidArchive(f"Archive member {member.name} is too large")
+            yield member.name, archive.extractfile(member).read()
+            # Stream mode still remembers every member; nothing here needs them
+            archive.members = []
+
+
+async def _members(path: Path) -> AsyncIterator[Tuple[str, bytes]]:
+    members = _read_members(path)
+    done = object()
+    while True:
+        try:
+            item = await asyncio.to_thread(next, members, done)
+        except tarfile.TarError as e:
+            raise InvalidArchive(f"Corrupt archive: {str(e)}")
+        if item is done:
+            return
+        yield item
+
+
+class ArchiveImporter:
+    """Imports an archive's cards and images in bulk, deduplicating by content hash.
+
+    Images are verified against the SHA-256 in their name and written to the
+    blob store unless it already has them. Each manifest chunk is inserted
+    with one ``insert_many`` once its images have been read. A card whose id or original image
+    is already stored is not inserted again; the stored card stands in for
+    it. With a ``user_id`` the cards' likes are added to that user's
+    collection (existing likes are kept).
+
+    With ``insert_cards=False`` nothing is added to the shared ``cards``
+    collection or blob store: archived cards are only linked to the stored
+    cards they match and the rest are counted as ``missing_cards``. The API
+    imports this way, since the manifest is whatever the uploader wrote;
+    inserting cards is left to the CLI.
+    """
+
+    def __init__(self, db, image_store: BlobStore, user_id: Optional[str] = None, insert_cards: bool = True):
+        self.db = db
+        self.image_store = image_store
+        self.user_id = user_id
+        self.insert_cards = insert_cards
+        self.report = {
+            "cards": 0, "imported": 0, "duplicates": 0, "missing_cards": 0, "missing_images": 0,
+            "images_stored": 0, "images_deduplicated": 0, "images_invalid": 0, "liked": 0,
+        }
+        self._images = set()
+
+    async def run(self, path: Path) -> dict:
+        pending: List[ArchivedCard] = []
+        async for name, data in _members(path):
+            if name == "archive.json":
+                self._check_header(data)
+            elif name.startswith("manifest/"):
+                # Images for earlier manifests are all in by now
+                await self._flush(pending)
+                pending = self._parse_manifest(name, data)
+            elif name.startswith("images/") and self.insert_cards:
+                await self._store_image(name, data)
+        await self._flush(pending)
+        return self.report
+
+    def _check_header(self, data: bytes):
+        try:
+            version = json.loads(data).get("version")
+        except (ValueError, AttributeError):
+            raise InvalidArchive("Unreadable archive.json")
+        if not isinstance(version, int) or version > ARCHIVE_VERSION:
+            raise InvalidArchive(f"Unsupported archive version {version!r}")
+
+    def _parse_manifest(self, name: str, data: bytes) -> List[ArchivedCard]:
+        cards = []
+        for number, line in enumerate(data.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                cards.append(ArchivedCard(**json.loads(line)))
+            except (ValueError, TypeError) as e:
+                raise InvalidArchive(f"{name} line {number}: {str(e)}")
+        self.report["cards"] += len(cards)
+        return cards
+
+    async def _store_image(self, name: str, data: bytes):
+        key = Path(name).name.split(".", 1)[0]
+        if hashlib.sha256(data).hexdigest() != key:
+            self.report["images_invalid"] += 1
+            return
+        if key in self._images or await self.image_store.exists(key):
+            self.report["images_deduplicated"] += 1
+        else:
+            await self.image_store.put(data)
+            self.report["images_stored"] += 1
+        self._images.add(key)
+
+    async def _has_image(self, key: str) -> bool:
+        return key in self._images or await self.image_store.exists(key)
+
+    async def _flush(self, cards: List[ArchivedCard]):
+        if not cards:
+            return
+        ids = [card.id for card in cards]
+        originals = [card.image_sha256 for card in cards]
+        existing = await self.db.cards.find(
+            {"$or": [{"id": {"$in": ids}}, {"image_sha256": {"$in": originals}}]},
+            {"_id": 0, "id": 1, "image_sha256": 1},
+        ).to_list(length=None)
+        by_id = {card["id"]: card["id"] for card in existing}
+        by_image = {card["image_sha256"]: card["id"] for card in existing}
+
+        documents = []
+        likes = []
+        now = datetime.now(timezone.utc)
+        for card in cards:
+            stored_id = by_id.get(card.id) or by_image.get(card.image_sha256)
+            if stored_id is not None:
+                self.report["duplicates"] += 1
+            elif not self.insert_cards:
+                self.report["missing_cards"] += 1
+                continue
+            elif not await self._has_image(card.image_sha256):
+                self.report["missing_images"] += 1
+                continue
+            else:
+                document = card.dict(exclude={"liked_at"})
+                # Variants that did not make it fall back to the original when served
+                document["image_variants"] = {
+                    name: variant for name, variant in card.image_variants.items()
+                    if isinstance(variant, dict) and variant.get("sha256") and variant.get("content_type")
+                    and await self._has_image(variant["sha256"])
+                }
+                document["reuse_count"] = 0
+                documents.append(document)
+                stored_id = by_id[card.id] = by_image[card.image_sha256] = card.id
+            if self.user_id is not None:
+                likes.append((stored_id, card.liked_at or now))
+
+        if documents:
+            try:
+                result = await self.db.cards.insert_many(documents, ordered=False)
+                self.report["imported"] += len(result.inserted_ids)
+            except BulkWriteError as e:
+                # Cards inserted concurrently under the same id count as duplicates
+                self.report["imported"] += e.details["nInserted"]
+                self.report["duplicates"] += len(documents) - e.details["nInserted"]
+        if likes:
+            await self._like(likes)
+
+    async def _like(self, likes: List[Tuple[str, datetime]]):
+        result = await self.db.likes.bulk_write([
+            UpdateOne(
+                {"user_id": self.user_id, "card_id": card_id},
+                {"$setOnInsert": {"id": str(uuid.uuid4()), "user_id": self.user_id,
+                                  "card_id": card_id, "liked_at": liked_at}},
+                upsert=True,
+            )
+            for card_id, liked_at in likes
+        ], ordered=False)
+        added = result.upserted_count
+        self.report["liked"] += added
+        if added:
+            counters = defaultdict(int)
+            counters[user_counter(COLLECTION_SIZE, self.user_id)] += added
+            counters[user_counter(COLLECTION_VERSION, self.user_id)] += 1
+            await increment_counters(self.db, counters)
+            # Liked cards never go back into the unserved inventory
+            await self.db.cards.update_many(
+                {"id": {"$in": [card_id for card_id, _ in likes]}, "served": False},
+                {"$set": {"served": True, "served_at": datetime.now(timezone.utc)}},
+            )
+
+
+async def main(args):
+    load_dotenv(ROOT_DIR / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    image_store = BlobStore(os.environ.get('IMAGE_STORE_DIR', ROOT_DIR / 'image_store'))
+    try:
+        if args.command == "export":
+            fmt = "zip" if args.archive.suffix == ".zip" else "tar"
+            with open(args.archive, "wb") as f:
+                async for chunk in export_archive(db, image_store, None if args.all else args.user, fmt):
+                    await asyncio.to_thread(f.write, chunk)
+            print(f"export: wrote {args.archive}")
+        else:
+            report = await ArchiveImporter(db, image_store, args.user).run(args.archive)
+            print(f"import: {json.dumps(report)}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Export and import card collections")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Write a collection (or every card) to a .tar or .zip")
+    scope = export_parser.add_mutually_exclusive_group(required=True)
+    scope.add_argument("--user", help="Export this user's liked cards")
+    scope.add_argument("--all", action="store_true", help="Export every stored card, without likes")
+    export_parser.add_argument("archive", type=Path)
+    import_parser = commands.add_parser("import", help="Load a .tar or .zip written by export")
+    import_parser.add_argument("--user", help="Add the archive's cards to this user's collection")
+    import_parser.add_argument("archive", type=Path)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class CollectionAtlas:
+    """Sprite sheets of collection thumbnails, built lazily per page.
+
+    A page of a user's collection, most recently liked first, is packed into
+    one PNG in the blob store plus a coordinate map in the ``atlases``
+    collection, so a gallery page costs two requests instead of one per card.
+    Maps are keyed by user, page and thumbnail size and remember the
+    collection version they were built from; a like or unlike bumps the
+    version, so the next request rebuilds the page and the replaced sheet is
+    deleted. Concurrent requests for the same page share one build.
+
+    Maps older than ``max_age`` are removed by ``expire``, run from the
+    storage sweep, and rebuilt on demand; a TTL index would drop the maps
+    but leave their sheets in the blob store.
+    """
+
+    def __init__(
+        self, db, image_store, derivatives, per_page: int = 48, columns: int = 8,
+        max_age: timedelta = timedelta(days=7),
+    ):
+        self.db = db
+        self.image_store = image_store
+        self.derivatives = derivatives
+        self.per_page = max(1, per_page)
+        self.columns = max(1, columns)
+        self.max_age = max_age
+
+        self.hits_total = 0
+        self.builds_total = 0
+        self.expired_total = 0
+        self._building: Dict[Tuple[str, int], asyncio.Future] = {}
+
+    async def get(self, user_id: str, version: int, page: int, size: int) -> dict:
+        """Coordinate map of one page at ``version``, building it if needed."""
+        key = f"{user_id}:{page}:{size}"
+        atlas = await self.db.atlases.find_one({"_id": key, "version": version})
+        if atlas is not None:
+            self.hits_total += 1
+            return atlas
+
+        build = self._building.get((key, version))
+        if build is None:
+            build = asyncio.ensure_future(self._build(key, user_id, version, page, size))
+            self._building[(key, version)] = build
+            build.add_done_callback(lambda _: self._building.pop((key, version), None))
+        # A client that disconnects must not cancel a build others are waiting on
+        return await asyncio.shield(build)
+
+    async def _build(self, key: str, user_id: str, version: int, page: int, size: int) -> dict:
+        self.builds_total += 1
+        likes = await self.db.likes.find(
+            {"user_id": user_id}, {"_id": 0, "card_id": 1, "liked_at": 1}
+        ).sort([("liked_at", -1), ("id", -1)]).skip(page * self.per_page).limit(self.per_page).to_list(length=None)
+        cards = await self.db.cards.find(
+            {"id": {"$in": [like["card_id"] for like in likes]}},
+            {"_id": 0, "id": 1, "prompt": 1, "created_at": 1, "image_sha256": 1, "image_variants": 1},
+        ).to_list(length=None)
+        cards = {card["id"]: card for card in cards}
+        rows = [(like, cards[like["card_id"]]) for like in likes if like["card_id"] in cards]
+
+        atlas = {
+            "_id": key,
+            "user_id": user_id,
+            "page": page,
+            "size": size,
+            "version": version,
+            "sheet_sha256": None,
+            "width": 0,
+            "height": 0,
+            "cards": [],
+            "created_at": datetime.now(timezone.utc),
+        }
+        if rows:
+            images = await asyncio.gather(*(self._thumbnail(card, size) for _, card in rows))
+            columns = min(self.columns, len(rows))
+            sheet, rects = await self.derivatives.atlas(images, size, columns)
+            atlas["sheet_sha256"] = await self.image_store.put(sheet)
+            atlas["width"] = columns * size
+            atlas["height"] = -(-len(rows) // columns) * size
+            for (like, card), rect in zip(rows, rects):
+                entry = {"id": card["id"], "prompt": card.get("prompt"),
+                         "created_at": card.get("created_at"), "liked_at": like["liked_at"]}
+                if rect is not None:
+                    entry.update(zip(("x", "y", "w", "h"), rect))
+                atlas["cards"].append(entry)
+
+        try:
+            # Never replace a map built from a newer version by another worker
+            previous = await self.db.atlases.find_one_and_replace(
+                {"_id": key, "version": {"$lt": version}},
+                atlas,
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+        except DuplicateKeyError:
+            return atlas
+        if previous and previous.get("sheet_sha256") not in (None, atlas["sheet_sha256"]):
+            await self._release(previous["sheet_sha256"])
+        return atlas
+
+    async def _thumbnail(self, card: dict, size: int) -> Optional[bytes]:
+        variant = card.get("image_variants", {}).get(str(size))
+        key = variant["sha256"] if variant else card.get("image_sha256")
+        if not key:
+            return None
+        try:
+            return await self.image_store.get(key)
+        except FileNotFoundError:
+            return None
+
+    async def expire(self, batch_size: int = 500) -> Tuple[int, int]:
+        """Delete maps built more than ``max_age`` ago; returns (maps deleted, bytes freed)."""
+        if not self.max_age:
+            return 0, 0
+        cutoff = datetime.now(timezone.utc) - self.max_age
+        expired = freed = 0
+        while True:
+            atlases = await self.db.atlases.find(
+                {"created_at": {"$lt": cutoff}}, {"_id": 1, "version": 1, "sheet_sha256": 1}
+            ).limit(batch_size).to_list(length=None)
+            if not atlases:
+                break
+            # A page rebuilt meanwhile has a new version and is kept
+            result = await self.db.atlases.delete_many(
+                {"$or": [{"_id": atlas["_id"], "version": atlas["version"]} for atlas in atlases]}
+            )
+            expired += result.deleted_count
+            for sheet in {atlas["sheet_sha256"] for atlas in atlases if atlas.get("sheet_sha256")}:
+                freed += await self._release(sheet)
+            if result.deleted_count == 0:
+                break
+        self.expired_total += expired
+        return expired, freed
+
+    async def _release(self, sheet_sha256: str) -> int:
+        # Identical pages (e.g. the same likes in the same order) share a sheet
+        if await self.db.atlases.count_documents({"sheet_sha256": sheet_sha256}, limit=1) == 0:
+            return await self.image_store.delete(sheet_sha256)
+        return 0
+
+    def stats(self) -> dict:
+        return {
+            "building": len(self._building),
+            "hits_total": self.hits_total,
+            "builds_total": self.builds_total,
+            "expired_total": self.expired_total,
+        }
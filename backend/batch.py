@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable, List, Optional
+
+from pydantic import BaseModel
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+
+class BatchFailure(BaseModel):
+    index: int
+    prompt: Optional[str] = None
+    error: str
+    attempts: int
+
+
+class BatchResult(BaseModel):
+    requested: int
+    card_ids: List[str] = []
+    failures: List[BatchFailure] = []
+
+
+class BatchGenerator:
+    """Generates many cards concurrently and stores them wave by wave.
+
+    At most ``concurrency`` model calls run at once. Each item gets
+    ``item_timeout`` seconds per attempt and up to ``max_retries`` retries with
+    jittered exponential back-off. Items that still fail are reported rather
+    than aborting the batch, and the successes of every wave are written with a
+    single ``insert_many``; ``on_stored`` is then called with the new cards.
+    """
+
+    def __init__(
+        self,
+        collection,
+        generate: Callable[[Optional[str]], Awaitable[dict]],
+        concurrency: int = 4,
+        item_timeout: float = 120.0,
+        max_retries: int = 2,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+        wave_size: Optional[int] = None,
+        on_stored: Optional[Callable[[List[dict]], None]] = None,
+    ):
+        self.collection = collection
+        self.generate = generate
+        self.concurrency = max(1, concurrency)
+        self.item_timeout = item_timeout
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.wave_size = max(1, wave_size or self.concurrency * 2)
+        self.on_stored = on_stored
+
+    async def run(self, prompts: List[Optional[str]], concurrency: Optional[int] = None) -> BatchResult:
+        """Generate one card per prompt (``None`` picks a random prompt)."""
+        limit = min(self.concurrency, concurrency) if concurrency else self.concurrency
+        semaphore = asyncio.Semaphore(max(1, limit))
+        result = BatchResult(requested=len(prompts))
+
+        for start in range(0, len(prompts), self.wave_size):
+            wave = list(enumerate(prompts[start:start + self.wave_size], start=start))
+            outcomes = await asyncio.gather(
+                *(self._generate_item(semaphore, index, prompt) for index, prompt in wave)
+            )
+
+            cards = []
+            for (index, _), outcome in zip(wave, outcomes):
+                if isinstance(outcome, BatchFailure):
+                    result.failures.append(outcome)
+                else:
+                    cards.append((index, outcome))
+
+            if not cards:
+                continue
+            try:
+                await self.collection.insert_many([card for _, card in cards], ordered=False)
+                failed = {}
+            except BulkWriteError as e:
+                # Unordered: every card without a write error was inserted
+                failed = {error["index"]: error.get("errmsg", "write error") for error in e.details["writeErrors"]}
+                logger.error(f"Error storing {len(failed)} cards of batch wave at item {start}")
+            except Exception as e:
+                logger.error(f"Error storing batch wave at item {start}: {str(e)}")
+                failed = {position: str(e) for position in range(len(cards))}
+
+            stored = [card for position, (_, card) in enumerate(cards) if position not in failed]
+            result.failures.extend(
+                BatchFailure(index=index, prompt=card.get("prompt"), error=f"insert failed: {failed[position]}",
+                             attempts=0)
+                for position, (index, card) in enumerate(cards) if position in failed
+            )
+            if stored:
+                result.card_ids.extend(card["id"] for card in stored)
+                if self.on_stored:
+                    self.on_stored(stored)
+
+        return result
+
+    async def _generate_item(self, semaphore: asyncio.Semaphore, index: int, prompt: Optional[str]):
+        error = ""
+        for attempt in range(1, self.max_retries + 2):
+            try:
+                async with semaphore:
+                    return await asyncio.wait_for(self.generate(prompt), timeout=self.item_timeout)
+            except asyncio.TimeoutError:
+                error = f"timed out after {self.item_timeout}s"
+            except Exception as e:
+                error = str(e) or type(e).__name__
+
+            if attempt <= self.max_retries:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+        logger.warning(f"Batch item {index} failed after {self.max_retries + 1} attempts: {error}")
+        return BatchFailure(index=index, prompt=prompt, error=error, attempts=self.max_retries + 1)
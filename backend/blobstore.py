@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple
+
+
+class BlobStore:
+    """Content-addressed on-disk store for image bytes.
+
+    Blobs are keyed by the SHA-256 of their content and sharded into
+    ``ab/cd/<sha256>`` directories, so identical images are stored once and a
+    key never changes meaning (which makes them safe to cache forever).
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> Path:
+        if len(key) != 64 or any(c not in "0123456789abcdef" for c in key):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return self.root / key[:2] / key[2:4] / key
+
+    async def put(self, data: bytes) -> str:
+        key = hashlib.sha256(data).hexdigest()
+        await asyncio.to_thread(self._write, key, data)
+        return key
+
+    def _write(self, key: str, data: bytes):
+        target = self.path(key)
+        if target.exists():
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file first so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    async def get(self, key: str) -> bytes:
+        return await asyncio.to_thread(self.path(key).read_bytes)
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self.path(key).exists)
+
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            stat = await asyncio.to_thread(self.path(key).stat)
+        except FileNotFoundError:
+            return None
+        return stat.st_size
+
+    async def delete(self, key: str) -> int:
+        """Remove a blob and return the number of bytes freed."""
+        path = self.path(key)
+
+        def _delete():
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                return size
+            except FileNotFoundError:
+                return 0
+
+        return await asyncio.to_thread(_delete)
+
+    async def stream(self, key: str, byte_range: Optional[Tuple[int, int]] = None) -> AsyncIterator[bytes]:
+        """Yield the blob (or the inclusive ``byte_range`` of it) in chunks."""
+        f = await asyncio.to_thread(open, self.path(key), "rb")
+        try:
+            start, end = byte_range if byte_range else (0, None)
+            if start:
+                await asyncio.to_thread(f.seek, start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                size = self.chunk_size if remaining is None else min(self.chunk_size, remaining)
+                chunk = await asyncio.to_thread(f.read, size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            await asyncio.to_thread(f.close)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single ``bytes=`` Range header into an inclusive (start, end).
+
+    Returns ``None`` when there is no usable range (serve the whole body) and
+    raises ``ValueError`` when the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[len("bytes="):].strip().partition("-")
+    try:
+        start = int(start_s) if start_s else None
+        end = int(end_s) if end_s else None
+    except ValueError:
+        # Malformed ranges are ignored, as RFC 9110 allows
+        return None
+
+    if start is None:
+        # Suffix range: the last ``end`` bytes
+        if not end or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, size - end), size - 1
+    if end is None:
+        end = size - 1
+    if start >= size or end < start:
+        raise ValueError("Unsatisfiable range")
+    return start, min(end, size - 1)
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCoalescer:
+    """Shares model calls between concurrent callers that need a fresh card.
+
+    Waiting callers are served in arrival order from a small number of
+    in-flight model calls; each call asks for as many images as there are
+    unserved waiters (up to ``max_images_per_call``), so a spike of N requests
+    costs roughly N / max_images_per_call calls instead of N. Cards nobody is
+    waiting for any more, e.g. because the client disconnected, are stored as
+    unserved inventory rather than thrown away.
+    """
+
+    def __init__(
+        self,
+        collection,
+        generate_many: Callable[[int], Awaitable[List[dict]]],
+        max_in_flight: int = 4,
+        max_images_per_call: int = 4,
+        on_stored: Optional[Callable[[List[dict]], None]] = None,
+    ):
+        self.collection = collection
+        self.generate_many = generate_many
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_images_per_call = max(1, max_images_per_call)
+        self.on_stored = on_stored
+
+        self.calls_total = 0
+        self.coalesced_total = 0
+        self.surplus_total = 0
+        self._waiters = deque()
+        self._in_flight = 0
+        # Images already requested from in-flight calls
+        self._promised = 0
+        self._tasks = set()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def get(self) -> dict:
+        """Wait for a freshly generated card, marked as served."""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._dispatch()
+        try:
+            return await waiter
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+
+    def _live_waiters(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def _dispatch(self):
+        unassigned = self._live_waiters() - self._promised
+        while unassigned > 0 and self._in_flight < self.max_in_flight:
+            count = min(unassigned, self.max_images_per_call)
+            self._in_flight += 1
+            self._promised += count
+            unassigned -= count
+            task = asyncio.create_task(self._call(count))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _next_waiter(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                return waiter
+        return None
+
+    async def _call(self, count: int):
+        self.calls_total += 1
+        try:
+            cards = await self.generate_many(count)
+        except Exception as e:
+            # Fail as many waiters as this call was meant to serve
+            for _ in range(count):
+                waiter = self._next_waiter()
+                if waiter is None:
+                    break
+                waiter.set_exception(e)
+        else:
+            await self._deliver(cards)
+        finally:
+            self._in_flight -= 1
+            self._promised -= count
+            self._dispatch()
+
+    async def _deliver(self, cards: List[dict]):
+        served = []
+        for card in cards:
+            waiter = self._next_waiter()
+            card["served"] = waiter is not None
+            if waiter is None:
+                self.surplus_total += 1
+            served.append((waiter, card))
+
+        try:
+            await self.collection.insert_many([card for _, card in served])
+        except Exception as e:
+            for waiter, _ in served:
+                if waiter is not None and not waiter.done():
+                    waiter.set_exception(e)
+            return
+        if self.on_stored:
+            self.on_stored([card for _, card in served])
+
+        delivered = 0
+        abandoned = []
+        for waiter, card in served:
+            if waiter is None:
+                continue
+            if waiter.done():
+                # The caller went away while the card was being stored
+                abandoned.append(card["id"])
+                continue
+            card.pop("_id", None)
+            waiter.set_result(card)
+            delivered += 1
+        if delivered > 1:
+            self.coalesced_total += delivered - 1
+        if abandoned:
+            self.surplus_total += len(abandoned)
+            await self.collection.update_many({"id": {"$in": abandoned}}, {"$set": {"served": False}})
+
+    def stats(self) -> dict:
+        return {
+            "waiting": self._live_waiters(),
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "calls_total": self.calls_total,
+            "coalesced_total": self.coalesced_total,
+            "surplus_total": self.surplus_total,
+        }
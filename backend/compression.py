@@ -0,0 +1,150 @@
+"""gzip and brotli compression of JSON responses.
+
+The encoding is negotiated from ``Accept-Encoding`` (brotli preferred). Only
+JSON and NDJSON bodies of at least ``minimum_size`` bytes are compressed;
+images are already compressed and event streams must not be buffered.
+Streamed bodies are compressed chunk by chunk and flushed after each chunk,
+so NDJSON lines still reach the client as they are produced. Chunks of
+``offload_size`` bytes or more are compressed in a worker thread to keep
+the event loop responsive.
+"""
+import asyncio
+import zlib
+from typing import Optional
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+GZIP = "gzip"
+BROTLI = "br"
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Preferred encoding the client accepts, or None."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in (BROTLI, GZIP):
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == BROTLI:
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._brotli = None
+            self._gzip = zlib.compressobj(gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes, last: bool) -> bytes:
+        if self._brotli is not None:
+            out = self._brotli.process(data)
+            return out + (self._brotli.finish() if last else self._brotli.flush())
+        out = self._gzip.compress(data)
+        return out + self._gzip.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        offload_size: int = 64 * 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        media_types=COMPRESSIBLE_TYPES,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.media_types = tuple(media_types)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _CompressingResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressingResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.start = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+        self.buffer = bytearray()
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            media_type = headers.get("content-type", "").split(";")[0].strip()
+            self.passthrough = (
+                message["status"] in (204, 304)
+                or "content-encoding" in headers
+                or media_type not in self.middleware.media_types
+            )
+            if self.passthrough:
+                await self._send(message)
+            else:
+                self.start = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        more_body = message.get("more_body", False)
+        body = message.get("body", b"")
+        if self.compressor is None:
+            # Hold back the headers until the body is known to be worth compressing
+            self.buffer += body
+            if not more_body and len(self.buffer) < self.middleware.minimum_size:
+                await self._send(self.start)
+                await self._send({"type": "http.response.body", "body": bytes(self.buffer)})
+                return
+            if more_body and len(self.buffer) < self.middleware.minimum_size:
+                return
+            body, self.buffer = bytes(self.buffer), bytearray()
+            self._start_compressing()
+
+        compressed = await self._compress(body, last=not more_body)
+        if not more_body and self.start is not None:
+            MutableHeaders(raw=self.start["headers"])["content-length"] = str(len(compressed))
+        if self.start is not None:
+            await self._send(self.start)
+            self.start = None
+        await self._send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+    def _start_compressing(self):
+        self.compressor = _Compressor(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+        headers = MutableHeaders(raw=self.start["headers"])
+        headers["content-encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if "content-length" in headers:
+            del headers["content-length"]
+
+    async def _compress(self, data: bytes, last: bool) -> bytes:
+        if len(data) >= self.middleware.offload_size:
+            return await asyncio.to_thread(self.compressor.compress, data, last)
+        return self.compressor.compress(data, last)
@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+# Names of the maintained counters in the ``counters`` collection
+COLLECTION_SIZE = "collection_size"
+# Bumped on every change to a user's likes; keys derived caches such as atlases
+COLLECTION_VERSION = "collection_version"
+# Bumped whenever cards are stored or removed; versions /api/cards
+CARDS_VERSION = "cards_version"
+
+
+def user_counter(name: str, user_id: str) -> str:
+    """Name of a per-user counter, e.g. ``collection_size:<user id>``."""
+    return f"{name}:{user_id}"
+
+
+async def get_counter_state(db, name: str) -> Tuple[int, Optional[datetime]]:
+    """Value of a counter and when it last changed (None if never incremented)."""
+    doc = await db.counters.find_one({"_id": name})
+    if doc is None:
+        return 0, None
+    return doc["value"], doc.get("updated_at")
+
+
+async def increment_counter(db, name: str, amount: int = 1) -> int:
+    doc = await db.counters.find_one_and_update(
+        {"_id": name},
+        {"$inc": {"value": amount}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return doc["value"]
+
+
+async def increment_counters(db, amounts: Dict[str, int]):
+    """Apply several counter increments in one bulk write."""
+    now = datetime.now(timezone.utc)
+    ops = [
+        UpdateOne({"_id": name}, {"$inc": {"value": amount}, "$set": {"updated_at": now}}, upsert=True)
+        for name, amount in amounts.items() if amount
+    ]
+    if ops:
+        await db.counters.bulk_write(ops, ordered=False)
+
+
+async def seed_counter(db, name: str, compute: Callable[[], Awaitable[int]]) -> int:
+    """Initialise a counter from a full count the first time it is needed; returns its value."""
+    doc = await db.counters.find_one({"_id": name})
+    if doc is not None:
+        return doc["value"]
+    value = await compute()
+    doc = await db.counters.find_one_and_update(
+        {"_id": name},
+        {"$setOnInsert": {"value": value}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return doc["value"]
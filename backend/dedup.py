@@ -0,0 +1,73 @@
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# A 64-bit hash split into 4 bands of 16 bits: two hashes within 3 bits of
+# each other must agree exactly on at least one band (pigeonhole), so an
+# indexed $in on the bands finds every candidate.
+DHASH_BANDS = 4
+MAX_INDEXED_DISTANCE = DHASH_BANDS - 1
+
+DROP = "drop"
+LINK = "link"
+OFF = "off"
+
+
+def dhash_bands(dhash: str) -> List[str]:
+    width = len(dhash) // DHASH_BANDS
+    return [f"{band}:{dhash[band * width:(band + 1) * width]}" for band in range(DHASH_BANDS)]
+
+
+def hamming_distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+class NearDuplicateIndex:
+    """Finds stored cards whose image is perceptually close to a new one.
+
+    Cards carry ``image_dhash`` and its ``image_dhash_bands``; the bands are
+    multikey-indexed, so a lookup reads only the cards sharing a band with
+    the new image, however many cards exist. ``mode`` decides what happens to a
+    near-duplicate: ``drop`` it, ``link`` it to the original via
+    ``duplicate_of``, or ``off`` to skip checks entirely.
+    """
+
+    def __init__(self, collection, max_distance: int = MAX_INDEXED_DISTANCE, mode: str = DROP):
+        if mode not in (DROP, LINK, OFF):
+            raise ValueError(f"Unknown dedup mode '{mode}', expected one of: {DROP}, {LINK}, {OFF}")
+        self.collection = collection
+        # Larger distances could miss matches that share no band
+        self.max_distance = max(0, min(max_distance, MAX_INDEXED_DISTANCE))
+        self.mode = mode
+
+        self.checks_total = 0
+        self.duplicates_total = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != OFF
+
+    async def find(self, dhash: str, pending: Optional[List[dict]] = None) -> Optional[str]:
+        """Id of a stored (or ``pending``, not yet stored) card near ``dhash``."""
+        self.checks_total += 1
+        for card in pending or []:
+            if card.get("image_dhash") and hamming_distance(dhash, card["image_dhash"]) <= self.max_distance:
+                self.duplicates_total += 1
+                return card["id"]
+
+        # Every card sharing a band is checked, band by band, until one is close enough:
+        # capping the candidates could skip the only true match in a crowded band
+        for band in dhash_bands(dhash):
+            candidates = self.collection.find({"image_dhash_bands": band}, {"_id": 0, "id": 1, "image_dhash": 1})
+            async for candidate in candidates:
+                if hamming_distance(dhash, candidate["image_dhash"]) <= self.max_distance:
+                    self.duplicates_total += 1
+                    return candidate["id"]
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "checks_total": self.checks_total,
+            "duplicates_total": self.duplicates_total,
+        }
@@ -0,0 +1,247 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageOps, PngImagePlugin
+
+logger = logging.getLogger(__name__)
+
+# Longest edge, in pixels, of each thumbnail variant
+THUMBNAIL_SIZES = (64, 128, 256)
+
+# Colours kept in the palette-quantized variants
+PALETTE_COLORS = 64
+
+ORIGINAL = "original"
+
+# Difference hash grid: (DHASH_SIZE + 1) x DHASH_SIZE pixels give DHASH_SIZE ** 2 bits
+DHASH_SIZE = 8
+
+
+def variant_names(sizes: Sequence[int] = THUMBNAIL_SIZES) -> Tuple[str, ...]:
+    return (ORIGINAL, *(str(size) for size in sizes), "png8", "webp")
+
+
+def render_derivatives(data: bytes, sizes: Sequence[int] = THUMBNAIL_SIZES) -> Dict[str, Tuple[bytes, str]]:
+    """Build every derived variant of one card image.
+
+    Runs in a worker process, so it only deals in bytes. Thumbnails use
+    nearest-neighbour resampling to keep hard pixel edges; ``png8`` and
+    ``webp`` are full-size palette-quantized encodings.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        source.load()
+        image = source.convert("RGBA") if source.mode not in ("RGB", "RGBA") else source.copy()
+
+    variants = {}
+    for size in sizes:
+        variants[str(size)] = (_encode(_fit(image, size), "PNG", optimize=True), "image/png")
+
+    # Fast octree is the only quantizer Pillow supports for RGBA images
+    quantized = image.quantize(colors=PALETTE_COLORS, method=Image.Quantize.FASTOCTREE)
+    variants["png8"] = (_encode(quantized, "PNG", optimize=True), "image/png")
+    variants["webp"] = (_encode(quantized.convert("RGBA"), "WEBP", lossless=True, method=6), "image/webp")
+    return variants
+
+
+def image_dhash(data: bytes) -> str:
+    """64-bit difference hash of an image, as 16 hex digits.
+
+    Each bit says whether a pixel of a tiny greyscale copy is brighter than
+    its right-hand neighbour, so re-encodes and small edits of the same
+    picture land within a few bits of each other.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        source.load()
+        image = _flatten(source)
+    grey = image.convert("L").resize((DHASH_SIZE + 1, DHASH_SIZE), Image.LANCZOS)
+    pixels = list(grey.getdata())
+    value = 0
+    for row in range(DHASH_SIZE):
+        offset = row * (DHASH_SIZE + 1)
+        for col in range(DHASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{value:0{DHASH_SIZE ** 2 // 4}x}"
+
+
+def remix_image(data: bytes, seed: int) -> bytes:
+    """A mirrored, hue-rotated variation of an image, for reusing a prior output."""
+    rng = random.Random(seed)
+    with Image.open(io.BytesIO(data)) as source:
+        source.load()
+        image = source.convert("RGBA")
+
+    shift = rng.randint(40, 215)
+    hue, saturation, value = image.convert("RGB").convert("HSV").split()
+    hue = hue.point(lambda h: (h + shift) % 256)
+    recoloured = Image.merge("HSV", (hue, saturation, value)).convert("RGB")
+    recoloured.putalpha(image.getchannel("A"))
+    return _encode(ImageOps.mirror(recoloured), "PNG", optimize=True)
+
+
+def render_atlas(
+    images: Sequence[Optional[bytes]], cell: int, columns: int
+) -> Tuple[bytes, List[Optional[Tuple[int, int, int, int]]]]:
+    """Pack images into one PNG sprite sheet of ``cell``-pixel squares, row by row.
+
+    Returns the sheet and each image's ``(x, y, width, height)`` in it;
+    images that are missing or cannot be decoded get ``None`` and an empty
+    cell. Images larger than a cell are scaled down like thumbnails.
+    """
+    columns = max(1, columns)
+    rows = max(1, -(-len(images) // columns))
+    sheet = Image.new("RGBA", (columns * cell, rows * cell), (0, 0, 0, 0))
+    rects = []
+    for index, data in enumerate(images):
+        if data is None:
+            rects.append(None)
+            continue
+        try:
+            with Image.open(io.BytesIO(data)) as source:
+                source.load()
+                image = _fit(source.convert("RGBA"), cell)
+        except (OSError, ValueError):
+            rects.append(None)
+            continue
+        x = index % columns * cell + (cell - image.width) // 2
+        y = index // columns * cell + (cell - image.height) // 2
+        sheet.paste(image, (x, y))
+        rects.append((x, y, image.width, image.height))
+
+    # Tagged so a sheet can never share a blob key with a card image
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Comment", "card atlas")
+    return _encode(sheet, "PNG", optimize=True, pnginfo=info), rects
+
+
+def recompress_png(data: bytes) -> Optional[bytes]:
+    """Losslessly re-encode a PNG at maximum compression.
+
+    Transparency, colour profile and text chunks are carried over, and the
+    result is decoded and compared pixel for pixel with the original. Returns
+    ``None`` for non-PNG or animated images, or when nothing is saved.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        if source.format != "PNG" or getattr(source, "is_animated", False):
+            return None
+        source.load()
+        text = dict(source.text)
+        image = source.copy()
+
+    info = PngImagePlugin.PngInfo()
+    for key, value in text.items():
+        info.add_text(key, value)
+    options = {key: image.info[key] for key in ("transparency", "icc_profile", "dpi") if key in image.info}
+    encoded = _encode(image, "PNG", optimize=True, pnginfo=info, **options)
+    if len(encoded) >= len(data):
+        return None
+
+    with Image.open(io.BytesIO(encoded)) as check:
+        check.load()
+        if check.mode != image.mode or check.size != image.size or check.tobytes() != image.tobytes():
+            return None
+    return encoded
+
+
+def _fit(image: Image.Image, size: int) -> Image.Image:
+    """Scale down to fit a ``size`` square, nearest-neighbour to keep pixel edges."""
+    scale = size / max(image.size)
+    if scale >= 1:
+        return image
+    return image.resize(
+        (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+        Image.NEAREST,
+    )
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        return Image.alpha_composite(background, image).convert("RGB")
+    return image.convert("RGB")
+
+
+def _encode(image: Image.Image, fmt: str, **options) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+
+class DerivativePipeline:
+    """Renders card image variants in a process pool and stores them.
+
+    The pool is created on first use and uses the ``spawn`` start method so
+    workers never inherit the event loop or Mongo client threads. A pool
+    broken by a worker dying (OOM kill, crash in a codec) is replaced and
+    the call retried once.
+    """
+
+    def __init__(self, image_store, sizes: Sequence[int] = THUMBNAIL_SIZES, max_workers: int = 2):
+        self.image_store = image_store
+        self.sizes = tuple(sizes)
+        self.max_workers = max(1, max_workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return variant_names(self.sizes)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        try:
+            return await loop.run_in_executor(pool, fn, *args)
+        except BrokenProcessPool as e:
+            logger.error(f"Image pool broken, restarting it: {str(e)}")
+            # Concurrent callers share the broken pool; only the first replaces it
+            if self._pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+            return await loop.run_in_executor(self._get_pool(), fn, *args)
+
+    async def build(self, data: bytes) -> Dict[str, dict]:
+        """Render and store all variants, returning ``{name: {sha256, content_type}}``."""
+        rendered = await self._run(render_derivatives, data, self.sizes)
+
+        variants = {}
+        for name, (variant_bytes, content_type) in rendered.items():
+            variants[name] = {
+                "sha256": await self.image_store.put(variant_bytes),
+                "content_type": content_type,
+            }
+        return variants
+
+    async def fingerprint(self, data: bytes) -> str:
+        """Perceptual hash of an image, computed in the pool."""
+        return await self._run(image_dhash, data)
+
+    async def remix(self, data: bytes, seed: int) -> bytes:
+        return await self._run(remix_image, data, seed)
+
+    async def atlas(
+        self, images: Sequence[Optional[bytes]], cell: int, columns: int
+    ) -> Tuple[bytes, List[Optional[Tuple[int, int, int, int]]]]:
+        """Sprite sheet of images and their rectangles, rendered in the pool."""
+        return await self._run(render_atlas, list(images), cell, columns)
+
+    async def recompress(self, data: bytes) -> Optional[bytes]:
+        """Smaller lossless encoding of a PNG, or None; rendered in the pool."""
+        return await self._run(recompress_png, data)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,319 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Set
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+from tasks import cancel_and_wait
+
+logger = logging.getLogger(__name__)
+
+# Sent to a subscriber that fell behind; it should re-fetch instead of replaying
+RESYNC = "resync"
+
+
+class Event:
+    __slots__ = ("id", "type", "data", "audience")
+
+    def __init__(self, id: int, type: str, data: dict, audience: Optional[str] = None):
+        self.id = id
+        self.type = type
+        self.data = data
+        # Only delivered to this user's subscriptions when set
+        self.audience = audience
+
+    def encode(self, epoch: str) -> str:
+        """Server-Sent Events wire format; ids are only meaningful to the bus of ``epoch``"""
+        return f"id: {epoch}-{self.id}\nevent: {self.type}\ndata: {json.dumps(self.data, default=_json_default)}\n\n"
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class Subscription:
+    def __init__(self, queue_size: int, user_id: Optional[str] = None):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.user_id = user_id
+        self.dropped = 0
+
+    def wants(self, event: Event) -> bool:
+        return event.audience is None or event.audience == self.user_id
+
+    async def get(self) -> Optional[Event]:
+        """Next event, or ``None`` once the bus has been closed."""
+        return await self.queue.get()
+
+
+class EventBus:
+    """In-process pub/sub that fans events out to every subscriber.
+
+    ``publish`` never blocks the publisher: each subscriber has its own
+    bounded queue, and when a slow subscriber's queue is full its backlog is
+    discarded and replaced by a single ``resync`` event, so one stuck client
+    can neither hold up the writers nor grow memory without bound.
+
+    The last ``history`` events are kept so a reconnecting client can resume
+    from its ``Last-Event-ID``. Ids count per bus, so they carry the bus's
+    random ``epoch``: a client reconnecting to another worker, or to a
+    restarted one, gets a ``resync`` instead of a replay of unrelated events.
+    Streams end after ``max_age`` seconds and rely on that reconnect, since
+    servers wait for open responses before shutdown.
+
+    Events published with an ``audience`` (a user id) only reach that user's
+    subscriptions, e.g. likes, which are private to a collection.
+    """
+
+    def __init__(self, queue_size: int = 100, history: int = 256):
+        self.queue_size = max(1, queue_size)
+        self.published_total = 0
+        self.dropped_total = 0
+        self.epoch = uuid.uuid4().hex[:8]
+        self._next_id = 1
+        self._history: Deque[Event] = deque(maxlen=max(0, history))
+        self._subscribers: Set[Subscription] = set()
+
+    def publish(self, type: str, data: dict, audience: Optional[str] = None) -> Event:
+        event = Event(self._next_id, type, data, audience)
+        self._next_id += 1
+        self.published_total += 1
+        self._history.append(event)
+        for subscription in self._subscribers:
+            if subscription.wants(event):
+                self._offer(subscription, event)
+        return event
+
+    def _offer(self, subscription: Subscription, event: Event):
+        try:
+            subscription.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            dropped = subscription.queue.qsize()
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+            subscription.dropped += dropped + 1
+            self.dropped_total += dropped + 1
+            subscription.queue.put_nowait(Event(event.id, RESYNC, {"dropped": subscription.dropped}))
+
+    def subscribe(self, last_event_id: Optional[str] = None, user_id: Optional[str] = None) -> Subscription:
+        subscription = Subscription(self.queue_size, user_id)
+        if last_event_id is not None:
+            epoch, _, sequence = last_event_id.partition("-")
+            missed = int(sequence) if epoch == self.epoch and sequence.isdigit() else None
+            if missed is None:
+                # Issued by another process, or before a restart: resume from the latest event here
+                subscription.queue.put_nowait(Event(self._next_id - 1, RESYNC, {"dropped": None}))
+            elif self._history and self._history[0].id > missed + 1:
+                # Some of the missed events are no longer in the history
+                subscription.queue.put_nowait(Event(missed, RESYNC, {"dropped": None}))
+            else:
+                for event in self._history:
+                    if event.id > missed and subscription.wants(event):
+                        self._offer(subscription, event)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def close(self):
+        """End every open stream, e.g. on shutdown."""
+        for subscription in list(self._subscribers):
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+            subscription.queue.put_nowait(None)
+        self._subscribers.clear()
+
+    async def stream(
+        self,
+        last_event_id: Optional[str] = None,
+        keepalive: float = 15.0,
+        max_age: float = 300.0,
+        user_id: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """Yield SSE frames to one client until the bus closes, the client leaves or max_age passes."""
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + max_age
+        subscription = self.subscribe(last_event_id, user_id)
+        try:
+            yield "retry: 1000\n\n"
+            while True:
+                remaining = expires - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=min(keepalive, remaining))
+                except asyncio.TimeoutError:
+                    # Comment frames keep proxies from timing out idle streams
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield event.encode(self.epoch)
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "published_total": self.published_total,
+            "dropped_total": self.dropped_total,
+        }
+
+
+class EventRelay:
+    """Shares events between the processes serving the API through Mongo.
+
+    Each worker has its own ``EventBus``, but a card generated by the leader
+    or a like written by one worker must reach SSE clients connected to any
+    of them. ``publish`` delivers an event to the local bus at once and
+    queues it for the ``events`` capped collection; every relay tails that
+    collection and republishes what other processes wrote on its own bus.
+
+    ``signal`` relays a named notification between processes instead, e.g.
+    a follower's claim waking the leader's inventory refill; it calls the
+    handlers registered with ``on_signal`` and never reaches event streams.
+
+    Writes are batched and never block the publisher: when Mongo falls
+    behind, the oldest of ``max_pending`` queued events are dropped. Delivery
+    is best effort; clients already re-fetch on ``resync`` and reconnect.
+    """
+
+    def __init__(
+        self,
+        db,
+        bus: EventBus,
+        collection: str = "events",
+        size: int = 16 * 1024 * 1024,
+        max_events: int = 10000,
+        max_pending: int = 1000,
+        retry_interval: float = 1.0,
+        origin: Optional[str] = None,
+    ):
+        self.db = db
+        self.bus = bus
+        self.collection = collection
+        self.size = size
+        self.max_events = max_events
+        self.retry_interval = retry_interval
+        self.origin = origin or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+        self.sent_total = 0
+        self.received_total = 0
+        self.dropped_total = 0
+        self.failures_total = 0
+        self._pending: Deque[dict] = deque(maxlen=max(1, max_pending))
+        self._handlers: Dict[str, List[Callable[[], None]]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def publish(self, type: str, data: dict, audience: Optional[str] = None) -> Event:
+        event = self.bus.publish(type, data, audience)
+        if self._tasks:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped_total += 1
+            self._pending.append({
+                "origin": self.origin, "type": type, "data": data, "audience": audience,
+                "published_at": datetime.now(timezone.utc),
+            })
+            self._wakeup.set()
+        return event
+
+    def signal(self, name: str):
+        """Call ``name``'s handlers in the other processes; repeats not yet sent are merged."""
+        if self._tasks and not any(pending.get("signal") == name for pending in self._pending):
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped_total += 1
+            self._pending.append({"origin": self.origin, "signal": name, "published_at": datetime.now(timezone.utc)})
+            self._wakeup.set()
+
+    def on_signal(self, name: str, handler: Callable[[], None]):
+        self._handlers.setdefault(name, []).append(handler)
+
+    def start(self, receive: bool = True):
+        """Start sending; ``receive=False`` suits processes that serve no event streams."""
+        if not self._tasks:
+            self._wakeup = asyncio.Event()
+            self._tasks = [asyncio.create_task(self._send_loop())]
+            if receive:
+                self._tasks.append(asyncio.create_task(self._receive_loop()))
+
+    async def stop(self):
+        await cancel_and_wait(*self._tasks)
+        self._tasks = []
+        self._pending.clear()
+
+    async def _send_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                batch = list(self._pending)
+                self._pending.clear()
+                try:
+                    await self.db[self.collection].insert_many(batch, ordered=False)
+                    self.sent_total += len(batch)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.failures_total += 1
+                    self.dropped_total += len(batch)
+                    logger.error(f"Error relaying {len(batch)} events: {str(e)}")
+                    await asyncio.sleep(self.retry_interval)
+
+    async def _receive_loop(self):
+        started = False
+        last_id = None
+        while True:
+            try:
+                if not started:
+                    await self._ensure_collection()
+                    # Start from the tail: history before this process started is not replayed
+                    latest = await self.db[self.collection].find({}, {"_id": 1}).sort("_id", -1).to_list(length=1)
+                    last_id = latest[0]["_id"] if latest else None
+                    started = True
+                query = {"origin": {"$ne": self.origin}}
+                if last_id is not None:
+                    query["_id"] = {"$gt": last_id}
+                cursor = self.db[self.collection].find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                async for document in cursor:
+                    last_id = document["_id"]
+                    self.received_total += 1
+                    if "signal" in document:
+                        for handler in self._handlers.get(document["signal"], []):
+                            handler()
+                    else:
+                        self.bus.publish(document["type"], document["data"], document.get("audience"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures_total += 1
+                logger.error(f"Error reading relayed events: {str(e)}")
+            # A tailable cursor dies when the collection is empty or it falls off the cap
+            await asyncio.sleep(self.retry_interval)
+
+    async def _ensure_collection(self):
+        try:
+            await self.db.create_collection(self.collection, capped=True, size=self.size, max=self.max_events)
+        except CollectionInvalid:
+            pass
+        except Exception as e:
+            # Tailing a collection that is not capped fails and is retried, logging each time
+            logger.error(f"Error creating capped {self.collection} collection: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "sent_total": self.sent_total,
+            "received_total": self.received_total,
+            "dropped_total": self.dropped_total,
+            "failures_total": self.failures_total,
+        }
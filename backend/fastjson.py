@@ -0,0 +1,94 @@
+"""orjson-encoded, streamed list responses.
+
+List endpoints encode raw Mongo documents straight to bytes, one card at a
+time as the cursor yields them, instead of building pydantic models and a
+whole response in memory. Two wire formats are supported:
+
+- ``application/json``: ``{"cards": [...], "next_cursor": ..., <extra>}``
+- ``application/x-ndjson``: one card object per line, then a final line
+  with the page metadata ``{"next_cursor": ..., <extra>}``
+"""
+import logging
+from typing import AsyncIterator, Callable, Optional
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+
+# Aware UTC datetimes are written with a "Z" suffix, like pydantic does
+OPTIONS = orjson.OPT_UTC_Z
+
+# JSON pages are flushed in chunks of about this many bytes
+CHUNK_SIZE = 16 * 1024
+
+
+def dumps(value) -> bytes:
+    return orjson.dumps(value, option=OPTIONS)
+
+
+def wants_ndjson(accept: Optional[str], format: Optional[str] = None) -> bool:
+    if format:
+        return format == "ndjson"
+    return NDJSON in (accept or "")
+
+
+async def encode_page(
+    rows: AsyncIterator[dict],
+    to_item: Callable[[dict], Optional[dict]],
+    limit: int,
+    cursor_of: Callable[[dict], str],
+    extra: Optional[dict] = None,
+    ndjson: bool = False,
+) -> AsyncIterator[bytes]:
+    """Encode cursor rows as a page; ``to_item`` may return None to skip a row.
+
+    Every row counts towards ``limit``, so the page gets a ``next_cursor``
+    (built from its last row) whenever the cursor returned a full page.
+    """
+    count = 0
+    last = None
+    buffer = bytearray() if ndjson else bytearray(b'{"cards":[')
+    first = True
+    try:
+        async for row in rows:
+            count += 1
+            last = row
+            item = to_item(row)
+            if item is None:
+                continue
+            if ndjson:
+                yield dumps(item) + b"\n"
+                continue
+            if not first:
+                buffer += b","
+            buffer += dumps(item)
+            first = False
+            if len(buffer) >= CHUNK_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+    except Exception as e:
+        # Headers are already sent, so the client just sees a truncated body
+        logger.error(f"Error streaming page: {str(e)}")
+        raise
+
+    meta = dumps({"next_cursor": cursor_of(last) if count == limit else None, **(extra or {})})
+    if ndjson:
+        yield meta + b"\n"
+    else:
+        buffer += b"]," + meta[1:]
+        yield bytes(buffer)
+
+
+async def start_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Produce the first chunk now, so query errors surface before headers are sent."""
+    first = await chunks.__anext__()
+
+    async def stream():
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return stream()
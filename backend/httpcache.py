@@ -0,0 +1,47 @@
+"""Validators and conditional GETs for version-counted resources.
+
+A list resource such as ``/api/cards`` or a user's collection has a version
+counter that every write bumps, so its ETag can be computed from one counter
+read and an unchanged resource is answered with ``304 Not Modified`` before
+any query runs. ETags are weak because compression changes the bytes, not
+the meaning, of a representation.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Mapping, Optional
+
+
+def version_etag(version: int, *variant) -> str:
+    """Weak ETag of a resource at ``version``; ``variant`` covers what the URL does not (user, media type)."""
+    digest = hashlib.blake2b(repr(variant).encode(), digest_size=8).hexdigest()
+    return f'W/"{version}-{digest}"'
+
+
+def not_modified(headers: Mapping[str, str], etag: str, last_modified: Optional[datetime]) -> bool:
+    """Whether the client's copy is current; If-None-Match wins over If-Modified-Since."""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag.removeprefix("W/") in tags
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # HTTP dates have whole seconds
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime], cache_control: str = "no-cache") -> dict:
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
@@ -0,0 +1,83 @@
+import logging
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Indexes every deployment needs, created idempotently on startup
+INDEXES = {
+    "cards": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Keyset pagination for /api/cards
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        # Inventory and feed claims take the oldest unserved cards
+        IndexModel([("served", ASCENDING), ("created_at", ASCENDING)], name="served_created_at"),
+        IndexModel([("claim_id", ASCENDING)], name="claim_id", sparse=True),
+        # Storage sweeps find cards served before the retention cutoff
+        IndexModel([("served", ASCENDING), ("served_at", ASCENDING)], name="served_served_at"),
+        # Blob references: an original is deleted or recompressed for every card sharing it
+        IndexModel([("image_sha256", ASCENDING)], name="image_sha256"),
+        # ...and a variant blob is only deleted once no card's image_variants.<name>.sha256 uses it
+        IndexModel([("image_variants.$**", ASCENDING)], name="image_variants_wildcard"),
+        # Near-duplicate lookups match any of a new image's perceptual hash bands
+        IndexModel([("image_dhash_bands", ASCENDING)], name="image_dhash_bands", sparse=True),
+        # Generation cache picks the least reused prior output of a prompt
+        IndexModel(
+            [("prompt", ASCENDING), ("model", ASCENDING), ("reuse_count", ASCENDING)],
+            name="prompt_model_reuse_count",
+        ),
+    ],
+    "likes": [
+        # One row per user and liked card; swipe upserts rely on this being unique
+        IndexModel([("user_id", ASCENDING), ("card_id", ASCENDING)], name="user_id_card_id_unique", unique=True),
+        # Keyset pagination for /api/collection within one user's likes
+        IndexModel(
+            [("user_id", ASCENDING), ("liked_at", DESCENDING), ("id", DESCENDING)],
+            name="user_id_liked_at_id",
+        ),
+        # Storage sweeps never evict a card anyone liked
+        IndexModel([("card_id", ASCENDING)], name="card_id"),
+    ],
+    "atlases": [
+        # Replaced sheets are only deleted once no other map points at them
+        IndexModel([("sheet_sha256", ASCENDING)], name="sheet_sha256"),
+        # Storage sweeps expire old maps, releasing their sheets, to be rebuilt on demand
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+    ],
+    "jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "job_items": [
+        # Workers claim the item that became available first, pending or lease-expired
+        IndexModel([("status", ASCENDING), ("available_at", ASCENDING)], name="status_available_at"),
+        IndexModel([("job_id", ASCENDING), ("index", ASCENDING)], name="job_id_index_unique", unique=True),
+    ],
+    "swipe_events": [
+        # Applied swipe ids only need to outlive client retries
+        IndexModel([("received_at", ASCENDING)], name="received_at_ttl", expireAfterSeconds=7 * 24 * 3600),
+    ],
+}
+
+# Indexes earlier releases created that must go before INDEXES can be ensured
+RETIRED_INDEXES = {
+    # Expired maps without deleting their sheets; replaced by CollectionAtlas.expire
+    "atlases": ["created_at_ttl"],
+}
+
+
+async def ensure_indexes(db):
+    for collection_name, names in RETIRED_INDEXES.items():
+        existing = await db[collection_name].index_information()
+        for name in names:
+            if name in existing:
+                await db[collection_name].drop_index(name)
+                logger.info(f"Dropped retired index {name} on {collection_name}")
+    for collection_name, indexes in INDEXES.items():
+        try:
+            names = await db[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            # Usually legacy data violating a new unique index; see migrations.py
+            logger.error(f"Error creating indexes on {collection_name}: {str(e)}")
+            continue
+        logger.info(f"Ensured indexes on {collection_name}: {', '.join(names)}")
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+import uuid
+from typing import Callable, List, Optional
+
+from pymongo import ReturnDocument
+
+from tasks import cancel_and_wait
+
+logger = logging.getLogger(__name__)
+
+# Cards nobody has been shown yet
+UNSERVED = {"served": False}
+
+
+class CardInventory:
+    """Keeps a stock of generated, never-served cards ready in Mongo.
+
+    A background worker tops the stock back up to ``high_watermark`` whenever
+    it drops below ``low_watermark``; ``claim`` hands out one card atomically
+    so concurrent requests never receive the same card.
+
+    Only one process runs the worker (see ``leader.py``), but every process
+    claims: a claim where the worker is not running calls ``on_kick`` so the
+    claim can wake the worker elsewhere, which calls ``wake``.
+    """
+
+    def __init__(
+        self,
+        collection,
+        batch,
+        low_watermark: int = 5,
+        high_watermark: int = 15,
+        refill_concurrency: int = 2,
+        poll_interval: float = 30.0,
+        rate_window: float = 300.0,
+        on_kick: Optional[Callable[[], None]] = None,
+    ):
+        if high_watermark < low_watermark:
+            raise ValueError("high_watermark must be >= low_watermark")
+        self.collection = collection
+        self.batch = batch
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.refill_concurrency = max(1, refill_concurrency)
+        self.poll_interval = poll_interval
+        self.rate_window = rate_window
+        self.on_kick = on_kick
+
+        self.generated_total = 0
+        self.served_total = 0
+        self.misses_total = 0
+        self.failures_total = 0
+        self._generated_at = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        await cancel_and_wait(self._task)
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def kick(self):
+        """Wake the refill worker, wherever it runs, without waiting for the next poll."""
+        self.wake()
+        if not self.running and self.on_kick is not None:
+            self.on_kick()
+
+    def wake(self):
+        """Wake this process's refill worker, if it runs here."""
+        self._wakeup.set()
+
+    async def claim(self) -> Optional[dict]:
+        """Atomically mark the oldest unserved card as served and return it."""
+        card = await self.collection.find_one_and_update(
+            UNSERVED,
+            {"$set": {"served": True, "served_at": datetime.now(timezone.utc)}},
+            sort=[("created_at", 1)],
+            projection={"_id": 0, "image_base64": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        if card is None:
+            self.misses_total += 1
+        else:
+            self.served_total += 1
+        self.kick()
+        return card
+
+    async def claim_many(self, n: int, projection: Optional[dict] = None) -> List[dict]:
+        """Claim up to ``n`` unserved cards, oldest first.
+
+        Candidates are tagged with a per-call claim id in one ``update_many``
+        and read back by that id, so concurrent callers never share a card.
+        """
+        claim_id = str(uuid.uuid4())
+        claimed = 0
+        # A concurrent claimer can win some candidates; retry for the shortfall
+        for _ in range(3):
+            candidates = await self.collection.find(UNSERVED, {"_id": 0, "id": 1}).sort(
+                "created_at", 1
+            ).limit(n - claimed).to_list(length=None)
+            if not candidates:
+                break
+            result = await self.collection.update_many(
+                {"id": {"$in": [card["id"] for card in candidates]}, **UNSERVED},
+                {"$set": {"served": True, "served_at": datetime.now(timezone.utc), "claim_id": claim_id}},
+            )
+            claimed += result.modified_count
+            if claimed >= n:
+                break
+
+        cards = []
+        if claimed:
+            cards = await self.collection.find(
+                {"claim_id": claim_id}, projection or {"_id": 0, "image_base64": 0}
+            ).sort("created_at", 1).to_list(length=None)
+        self.served_total += len(cards)
+        if len(cards) < n:
+            self.misses_total += 1
+        self.kick()
+        return cards
+
+    async def depth(self) -> int:
+        return await self.collection.count_documents(UNSERVED)
+
+    def refill_rate(self) -> float:
+        """Cards added to the inventory per minute over the rate window."""
+        self._trim_rate_window()
+        return len(self._generated_at) * 60.0 / self.rate_window
+
+    async def stats(self) -> dict:
+        return {
+            "depth": await self.depth(),
+            "low_watermark": self.low_watermark,
+            "high_watermark": self.high_watermark,
+            "refill_rate_per_minute": round(self.refill_rate(), 3),
+            "generated_total": self.generated_total,
+            "served_total": self.served_total,
+            "misses_total": self.misses_total,
+            "failures_total": self.failures_total,
+            "worker_running": self.running,
+        }
+
+    def _trim_rate_window(self):
+        cutoff = time.monotonic() - self.rate_window
+        while self._generated_at and self._generated_at[0] < cutoff:
+            self._generated_at.popleft()
+
+    async def _run(self):
+        while True:
+            try:
+                depth = await self.depth()
+                if depth < self.low_watermark:
+                    await self._refill(self.high_watermark - depth)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Inventory refill failed: {str(e)}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _refill(self, missing: int):
+        logger.info(f"Refilling card inventory with {missing} cards")
+        result = await self.batch.run([None] * missing, concurrency=self.refill_concurrency)
+
+        now = time.monotonic()
+        self.generated_total += len(result.card_ids)
+        self.failures_total += len(result.failures)
+        self._generated_at.extend(now for _ in result.card_ids)
+        for failure in result.failures:
+            logger.error(f"Inventory card generation failed: {failure.error}")
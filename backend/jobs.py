@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List, Optional
+
+from pydantic import BaseModel
+from pymongo import ReturnDocument
+
+from tasks import cancel_and_wait
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+# Item states; an item is claimable once its available_at has passed
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+
+MAX_JOB_ITEMS = 10000
+
+
+class JobNotFound(LookupError):
+    pass
+
+
+class Job(BaseModel):
+    id: str
+    status: str
+    requested: int
+    completed: int = 0
+    failed: int = 0
+    cancelled: int = 0
+    card_ids: List[str] = []
+    errors: List[str] = []
+    created_at: datetime
+    updated_at: datetime
+
+
+class JobQueue:
+    """Durable bulk generation queue stored in Mongo.
+
+    A job is one document in ``jobs`` plus one document per card in
+    ``job_items``. Workers, in this process or in ``python -m worker``
+    processes, claim items with a lease: a claim moves the item's
+    ``available_at`` to the lease expiry, so an item whose worker died is
+    picked up again by any worker once the lease runs out. Failed items are
+    retried with exponential back-off up to ``max_attempts`` times. Items
+    are deleted once their job finishes.
+    """
+
+    def __init__(
+        self,
+        db,
+        generate: Callable[[Optional[str]], Awaitable[dict]],
+        concurrency: int = 2,
+        item_timeout: float = 120.0,
+        lease_margin: float = 30.0,
+        max_attempts: int = 3,
+        backoff_base: float = 5.0,
+        poll_interval: float = 2.0,
+        on_stored: Optional[Callable[[List[dict]], None]] = None,
+        worker_id: Optional[str] = None,
+    ):
+        self.db = db
+        self.generate = generate
+        self.concurrency = max(1, concurrency)
+        self.item_timeout = item_timeout
+        self.lease = item_timeout + lease_margin
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.poll_interval = poll_interval
+        self.on_stored = on_stored
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+        self.claimed_total = 0
+        self.completed_total = 0
+        self.failed_total = 0
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def submit(self, prompts: List[Optional[str]]) -> Job:
+        if not 1 <= len(prompts) <= MAX_JOB_ITEMS:
+            raise ValueError(f"A job needs between 1 and {MAX_JOB_ITEMS} items")
+        now = datetime.now(timezone.utc)
+        job = Job(id=str(uuid.uuid4()), status=QUEUED, requested=len(prompts), created_at=now, updated_at=now)
+        # Items first: a job document never exists without its items
+        await self.db.job_items.insert_many([
+            {"job_id": job.id, "index": index, "prompt": prompt, "status": PENDING,
+             "available_at": now, "attempts": 0}
+            for index, prompt in enumerate(prompts)
+        ], ordered=False)
+        await self.db.jobs.insert_one(job.dict())
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Job:
+        job = await self.db.jobs.find_one({"id": job_id}, {"_id": 0})
+        if job is None:
+            raise JobNotFound(job_id)
+        return Job(**job)
+
+    async def cancel(self, job_id: str) -> Job:
+        """Cancel items not yet started; items already generating still finish."""
+        job = await self.get(job_id)
+        if job.status in FINISHED:
+            return job
+        result = await self.db.job_items.update_many(
+            {"job_id": job_id, "status": PENDING}, {"$set": {"status": CANCELLED}}
+        )
+        await self.db.jobs.update_one(
+            {"id": job_id},
+            {"$set": {"status": CANCELLED, "updated_at": datetime.now(timezone.utc)},
+             "$inc": {"cancelled": result.modified_count}},
+        )
+        return await self._finish_if_done(job_id)
+
+    def start(self):
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.concurrency:
+            self._tasks.append(asyncio.create_task(self._run()))
+
+    async def stop(self):
+        # Items left mid-generation are re-run by another worker once their lease expires
+        await cancel_and_wait(*self._tasks)
+        self._tasks = []
+
+    async def claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        item = await self.db.job_items.find_one_and_update(
+            {"status": {"$in": [PENDING, LEASED]}, "available_at": {"$lte": now}},
+            {"$set": {"status": LEASED, "lease_owner": self.worker_id,
+                      "available_at": now + timedelta(seconds=self.lease)},
+             "$inc": {"attempts": 1}},
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if item is not None:
+            self.claimed_total += 1
+            await self.db.jobs.update_one(
+                {"id": item["job_id"], "status": QUEUED},
+                {"$set": {"status": RUNNING, "updated_at": now}},
+            )
+        return item
+
+    async def process(self, item: dict):
+        # A re-leased item may belong to a job cancelled since it was first claimed
+        job = await self.db.jobs.find_one({"id": item["job_id"]}, {"_id": 0, "status": 1})
+        if job is None or job["status"] == CANCELLED:
+            if await self._settle(item, {"status": CANCELLED}):
+                await self._record(item["job_id"], {"$inc": {"cancelled": 1}})
+            return
+
+        if item["attempts"] > self.max_attempts:
+            # Leases keep expiring, e.g. the item crashes its worker
+            await self._fail(item, f"lease expired {item['attempts'] - 1} times")
+            return
+
+        try:
+            card = await asyncio.wait_for(self.generate(item.get("prompt")), timeout=self.item_timeout)
+            await self.db.cards.insert_one(card)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if isinstance(e, asyncio.TimeoutError):
+                error = f"timed out after {self.item_timeout}s"
+            await self._fail(item, error)
+            return
+
+        card.pop("_id", None)
+        if self.on_stored:
+            self.on_stored([card])
+        if await self._settle(item, {"status": DONE, "card_id": card["id"]}):
+            self.completed_total += 1
+            await self._record(item["job_id"], {"$inc": {"completed": 1}, "$push": {"card_ids": card["id"]}})
+
+    async def _fail(self, item: dict, error: str):
+        if item["attempts"] < self.max_attempts:
+            delay = self.backoff_base * 2 ** (item["attempts"] - 1) * random.uniform(0.5, 1.0)
+            retry_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+            await self._settle(item, {"status": PENDING, "available_at": retry_at, "error": error})
+            return
+
+        logger.warning(f"Job {item['job_id']} item {item['index']} failed after {item['attempts']} attempts: {error}")
+        if await self._settle(item, {"status": FAILED, "error": error}):
+            self.failed_total += 1
+            await self._record(item["job_id"], {"$inc": {"failed": 1}, "$push": {"errors": {"$each": [error], "$slice": -20}}})
+
+    async def _settle(self, item: dict, update: dict) -> bool:
+        """Apply an outcome unless the lease was lost to another worker meanwhile."""
+        result = await self.db.job_items.update_one(
+            {"_id": item["_id"], "status": LEASED, "lease_owner": self.worker_id, "attempts": item["attempts"]},
+            {"$set": update, "$unset": {"lease_owner": ""}},
+        )
+        return result.modified_count == 1
+
+    async def _record(self, job_id: str, update: dict):
+        update.setdefault("$set", {})["updated_at"] = datetime.now(timezone.utc)
+        await self.db.jobs.update_one({"id": job_id}, update)
+        await self._finish_if_done(job_id)
+
+    async def _finish_if_done(self, job_id: str) -> Job:
+        job = await self.get(job_id)
+        if job.completed + job.failed + job.cancelled >= job.requested and job.status not in (COMPLETED, FAILED):
+            status = CANCELLED if job.status == CANCELLED else FAILED if job.completed == 0 else COMPLETED
+            finished = await self.db.jobs.find_one_and_update(
+                {"id": job_id, "status": job.status},
+                {"$set": {"status": status, "updated_at": datetime.now(timezone.utc)}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER,
+            )
+            if finished is not None:
+                job = Job(**finished)
+                # The job keeps the counts and card ids; its items are no longer needed
+                await self.db.job_items.delete_many({"job_id": job_id})
+        return job
+
+    async def _run(self):
+        while True:
+            try:
+                item = await self.claim()
+                if item is not None:
+                    await self.process(item)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker error: {str(e)}")
+
+            self._wakeup.clear()
+            try:
+                # Jitter keeps several idle worker processes from polling in lockstep
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval * random.uniform(0.5, 1.5))
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "workers": sum(1 for task in self._tasks if not task.done()),
+            "claimed_total": self.claimed_total,
+            "completed_total": self.completed_total,
+            "failed_total": self.failed_total,
+        }
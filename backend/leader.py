@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from tasks import cancel_and_wait
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElection:
+    """Elects one process, across workers and hosts, to run singleton tasks.
+
+    Candidates compete for a lease document in the ``leases`` collection:
+    the holder renews it every ``renew_interval`` seconds and any candidate
+    may take it once it has gone ``ttl`` seconds without renewal. Taking
+    and renewing are a single conditional upsert, so two candidates never
+    both succeed; the loser of the race hits the unique ``_id``.
+
+    ``on_elected`` starts the singleton tasks and ``on_deposed`` stops them.
+    A leader that cannot reach Mongo steps down before its lease can expire,
+    so the next leader never overlaps with it. ``ttl`` must be more than
+    twice ``renew_interval``, plus any clock skew between hosts.
+    """
+
+    def __init__(
+        self,
+        collection,
+        on_elected: Callable[[], Awaitable[None]],
+        on_deposed: Callable[[], Awaitable[None]],
+        name: str = "background",
+        ttl: float = 30.0,
+        renew_interval: float = 10.0,
+        candidate_id: Optional[str] = None,
+    ):
+        if 2 * renew_interval >= ttl:
+            raise ValueError("ttl must be more than twice renew_interval")
+        self.collection = collection
+        self.on_elected = on_elected
+        self.on_deposed = on_deposed
+        self.name = name
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.candidate_id = candidate_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+        self.is_leader = False
+        self.elections_total = 0
+        self.renewal_failures_total = 0
+        # Monotonic time by which a leader that could not renew must have stepped down
+        self._deadline = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        await cancel_and_wait(self._task)
+        self._task = None
+        if self.is_leader:
+            await self._step_down()
+            try:
+                # Let another candidate take over now rather than after the ttl
+                await self.collection.delete_one({"_id": self.name, "owner": self.candidate_id})
+            except Exception as e:
+                logger.error(f"Error releasing {self.name} lease: {str(e)}")
+
+    async def try_acquire(self) -> bool:
+        """Take or renew the lease; True while this candidate holds it."""
+        attempted = time.monotonic()
+        now = datetime.now(timezone.utc)
+        try:
+            lease = await self.collection.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.candidate_id}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.candidate_id, "expires_at": now + timedelta(seconds=self.ttl),
+                          "renewed_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            return False
+        held = lease is not None and lease["owner"] == self.candidate_id
+        if held:
+            # The next renewal can take until two intervals from now to fail
+            self._deadline = attempted + self.ttl - 2 * self.renew_interval
+        return held
+
+    async def _run(self):
+        while True:
+            try:
+                held = await asyncio.wait_for(self.try_acquire(), timeout=self.renew_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.renewal_failures_total += 1
+                logger.error(f"Error renewing {self.name} lease: {str(e)}")
+                # Keep leading only while the lease we last wrote is certainly still ours
+                held = self.is_leader and time.monotonic() < self._deadline
+
+            if held and not self.is_leader:
+                self.is_leader = True
+                self.elections_total += 1
+                logger.info(f"{self.candidate_id} elected to run {self.name} tasks")
+                await self.on_elected()
+            elif not held and self.is_leader:
+                await self._step_down()
+            await asyncio.sleep(self.renew_interval)
+
+    async def _step_down(self):
+        self.is_leader = False
+        logger.info(f"{self.candidate_id} stepped down from {self.name} tasks")
+        await self.on_deposed()
+
+    def stats(self) -> dict:
+        return {
+            "leader": self.is_leader,
+            "elections_total": self.elections_total,
+            "renewal_failures_total": self.renewal_failures_total,
+        }
@@ -0,0 +1,293 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from inventory import UNSERVED
+from tasks import cancel_and_wait
+
+logger = logging.getLogger(__name__)
+
+
+class StorageLifecycle:
+    """Bounds what the ``cards`` collection and blob store keep.
+
+    Three policies, run by two background workers:
+
+    * cards that were served more than ``retention`` ago and that nobody
+      liked are deleted, with their images;
+    * unserved inventory above ``max_unserved`` cards is trimmed, newest
+      first, so claims keep taking the oldest cards;
+    * a compactor re-encodes original PNGs losslessly at maximum compression,
+      ``compact_batch`` cards every ``compact_interval`` seconds.
+
+    Each sweep also expires the collection ``atlases``' old sprite sheets.
+
+    A Mongo TTL index cannot express "unless liked" or release blobs, hence
+    the sweep. A card liked while it is being evicted is put back. Blobs are
+    content addressed and variants are rendered from the original, so an
+    evicted card's images are only deleted when no remaining card has the
+    same original or uses them as variants; the compactor moves every card
+    sharing an original together, keeping their variants. ``on_removed`` is called with the ids of
+    deleted cards. Zero disables a policy.
+    """
+
+    def __init__(
+        self,
+        db,
+        image_store,
+        derivatives,
+        atlases=None,
+        on_removed: Optional[Callable[[List[str]], None]] = None,
+        retention: timedelta = timedelta(days=7),
+        max_unserved: int = 500,
+        sweep_interval: float = 3600.0,
+        sweep_batch: int = 500,
+        compact_batch: int = 20,
+        compact_interval: float = 60.0,
+    ):
+        self.db = db
+        self.image_store = image_store
+        self.derivatives = derivatives
+        self.atlases = atlases
+        self.on_removed = on_removed
+        self.retention = retention
+        self.max_unserved = max_unserved
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = max(1, sweep_batch)
+        self.compact_batch = compact_batch
+        self.compact_interval = compact_interval
+
+        self.evicted_total = 0
+        self.trimmed_total = 0
+        self.restored_total = 0
+        self.removed_bytes_total = 0
+        self.compacted_total = 0
+        self.compaction_skipped_total = 0
+        self.compaction_failures_total = 0
+        self.compacted_bytes_total = 0
+        self.last_sweep: Optional[dict] = None
+        # Keyset high-water mark of the compactor's pass over the cards, oldest first
+        self._compact_after: Optional[tuple] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._sweep_loop())]
+            if self.compact_batch > 0:
+                self._tasks.append(asyncio.create_task(self._compact_loop()))
+
+    async def stop(self):
+        await cancel_and_wait(*self._tasks)
+        self._tasks = []
+
+    async def sweep(self) -> dict:
+        """Apply the retention and inventory policies once and report what was reclaimed."""
+        started = datetime.now(timezone.utc)
+        report = {"evicted": 0, "trimmed": 0, "restored": 0, "atlases_expired": 0, "bytes_reclaimed": 0}
+
+        if self.retention:
+            cutoff = started - self.retention
+            # Cards served before served_at was recorded age from their creation
+            expired = {"served": True, "$or": [
+                {"served_at": {"$lt": cutoff}},
+                {"served_at": {"$exists": False}, "created_at": {"$lt": cutoff}},
+            ]}
+            # Walk expired cards by id so liked ones, which stay expired, are passed over
+            after = ""
+            while True:
+                cards = await self.db.cards.find({**expired, "id": {"$gt": after}}, {"_id": 0}).sort(
+                    "id", 1
+                ).limit(self.sweep_batch).to_list(length=None)
+                if not cards:
+                    break
+                after = cards[-1]["id"]
+                liked = await self._liked([card["id"] for card in cards])
+                removed, restored, freed = await self._remove(
+                    [card for card in cards if card["id"] not in liked], expired
+                )
+                report["evicted"] += removed
+                report["restored"] += restored
+                report["bytes_reclaimed"] += freed
+
+        if self.max_unserved:
+            excess = await self.db.cards.count_documents(UNSERVED) - self.max_unserved
+            while excess > 0:
+                cards = await self.db.cards.find(UNSERVED, {"_id": 0}).sort("created_at", -1).limit(
+                    min(excess, self.sweep_batch)
+                ).to_list(length=None)
+                if not cards:
+                    break
+                removed, restored, freed = await self._remove(cards, UNSERVED)
+                report["trimmed"] += removed
+                report["restored"] += restored
+                report["bytes_reclaimed"] += freed
+                if removed == 0:
+                    break
+                excess -= removed
+
+        if self.atlases is not None:
+            expired, freed = await self.atlases.expire(self.sweep_batch)
+            report["atlases_expired"] = expired
+            report["bytes_reclaimed"] += freed
+
+        self.evicted_total += report["evicted"]
+        self.trimmed_total += report["trimmed"]
+        self.restored_total += report["restored"]
+        self.removed_bytes_total += report["bytes_reclaimed"]
+        report["finished_at"] = datetime.now(timezone.utc)
+        report["seconds"] = round((report["finished_at"] - started).total_seconds(), 3)
+        self.last_sweep = report
+        if report["evicted"] or report["trimmed"]:
+            logger.info(
+                f"Storage sweep evicted {report['evicted']} and trimmed {report['trimmed']} cards, "
+                f"reclaiming {report['bytes_reclaimed']} bytes"
+            )
+        return report
+
+    async def _liked(self, card_ids: List[str]) -> set:
+        if not card_ids:
+            return set()
+        return set(await self.db.likes.distinct("card_id", {"card_id": {"$in": card_ids}}))
+
+    async def _remove(self, cards: List[dict], still: dict):
+        """Delete cards that still match ``still``; returns (removed, restored, bytes freed)."""
+        if not cards:
+            return 0, 0, 0
+        ids = [card["id"] for card in cards]
+        result = await self.db.cards.delete_many({"id": {"$in": ids}, **still})
+        if result.deleted_count == 0:
+            return 0, 0, 0
+        remaining = set(await self.db.cards.distinct("id", {"id": {"$in": ids}}))
+        removed = [card for card in cards if card["id"] not in remaining]
+
+        # A like that committed between the check and the delete wins
+        liked = await self._liked([card["id"] for card in removed])
+        if liked:
+            await self.db.cards.insert_many([dict(card) for card in removed if card["id"] in liked])
+            removed = [card for card in removed if card["id"] not in liked]
+
+        freed = 0
+        for original in {card["image_sha256"] for card in removed if card.get("image_sha256")}:
+            freed += await self._release(original, cards)
+        if removed and self.on_removed is not None:
+            self.on_removed([card["id"] for card in removed])
+        return len(removed), len(liked), freed
+
+    async def _release(self, original: str, cards: List[dict]) -> int:
+        if await self.db.cards.count_documents({"image_sha256": original}, limit=1):
+            return 0
+        # Compacted cards keep the variants rendered from their former original
+        keys = {original: set()}
+        for card in cards:
+            if card.get("image_sha256") == original:
+                for name, variant in card.get("image_variants", {}).items():
+                    keys.setdefault(variant["sha256"], set()).add(name)
+        names = set().union(*keys.values())
+        freed = 0
+        for key in keys:
+            if not await self._referenced(key, names):
+                freed += await self.image_store.delete(key)
+        return freed
+
+    async def _referenced(self, key: str, names) -> bool:
+        """Whether any card still uses the blob, as its original or as one of the named variants."""
+        query = [{"image_sha256": key}] + [{f"image_variants.{name}.sha256": key} for name in sorted(names)]
+        return await self.db.cards.count_documents({"$or": query}, limit=1) > 0
+
+    async def compact(self) -> dict:
+        """Recompress the next batch of original images; returns what it saved."""
+        query = {"image_compacted": {"$ne": True}}
+        if self._compact_after is not None:
+            created_at, card_id = self._compact_after
+            query["$or"] = [
+                {"created_at": {"$gt": created_at}},
+                {"created_at": created_at, "id": {"$gt": card_id}},
+            ]
+        cards = await self.db.cards.find(
+            query, {"_id": 0, "id": 1, "created_at": 1, "image_sha256": 1, "image_content_type": 1}
+        ).sort([("created_at", 1), ("id", 1)]).limit(self.compact_batch).to_list(length=None)
+
+        report = {"compacted": 0, "skipped": 0, "failed": 0, "bytes_reclaimed": 0}
+        # Cards are created in order, so the pass only ever needs to look past the last
+        # one it saw; a process taking over the compactor rescans once from the start
+        if cards:
+            self._compact_after = (cards[-1]["created_at"], cards[-1]["id"])
+        for card in cards:
+            try:
+                saved = await self._compact_card(card)
+            except Exception as e:
+                report["failed"] += 1
+                logger.error(f"Error compacting image of card {card['id']}: {str(e)}")
+                continue
+            if saved is None:
+                report["skipped"] += 1
+            else:
+                report["compacted"] += 1
+                report["bytes_reclaimed"] += saved
+
+        self.compacted_total += report["compacted"]
+        self.compaction_skipped_total += report["skipped"]
+        self.compaction_failures_total += report["failed"]
+        self.compacted_bytes_total += report["bytes_reclaimed"]
+        return report
+
+    async def _compact_card(self, card: dict) -> Optional[int]:
+        original = card.get("image_sha256")
+        if not original or card.get("image_content_type", "image/png") != "image/png":
+            await self.db.cards.update_one({"id": card["id"]}, {"$set": {"image_compacted": True}})
+            return None
+        try:
+            data = await self.image_store.get(original)
+        except FileNotFoundError:
+            return None
+        smaller = await self.derivatives.recompress(data)
+        if smaller is None:
+            await self.db.cards.update_many({"image_sha256": original}, {"$set": {"image_compacted": True}})
+            return None
+
+        key = await self.image_store.put(smaller)
+        # Every card with these bytes moves, so originals stay shared (see _release)
+        await self.db.cards.update_many(
+            {"image_sha256": original}, {"$set": {"image_sha256": key, "image_compacted": True}}
+        )
+        if await self.db.cards.count_documents({"image_sha256": original}, limit=1):
+            return 0
+        return await self.image_store.delete(original) - len(smaller)
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Storage sweep failed: {str(e)}")
+            await asyncio.sleep(self.sweep_interval)
+
+    async def _compact_loop(self):
+        while True:
+            try:
+                await self.compact()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Image compaction failed: {str(e)}")
+            await asyncio.sleep(self.compact_interval)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "retention_seconds": self.retention.total_seconds(),
+            "max_unserved": self.max_unserved,
+            "evicted_total": self.evicted_total,
+            "trimmed_total": self.trimmed_total,
+            "restored_total": self.restored_total,
+            "compacted_total": self.compacted_total,
+            "compaction_skipped_total": self.compaction_skipped_total,
+            "compaction_failures_total": self.compaction_failures_total,
+            "bytes_reclaimed_total": self.removed_bytes_total + self.compacted_bytes_total,
+            "removed_bytes_total": self.removed_bytes_total,
+            "compacted_bytes_total": self.compacted_bytes_total,
+            "last_sweep": self.last_sweep,
+            "running": any(not task.done() for task in self._tasks),
+        }
@@ -0,0 +1,302 @@
+"""Minimal in-process metrics with Prometheus text exposition.
+
+Metric updates are a dict lookup plus an addition under a lock (Mongo
+command events arrive on driver threads), so they are cheap enough for
+every request.
+"""
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *label_values: str, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, *label_values: str, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _StatsMetric(_Metric):
+    """Exports the numeric entries of a component's ``stats()`` dict.
+
+    Keys ending in ``_total`` become counters, other numbers gauges, and a
+    string ``state`` becomes a ``<prefix>_state{state="..."} 1`` series.
+    """
+
+    def __init__(self, prefix: str, documentation: str, stats: Callable[[], dict]):
+        super().__init__(prefix, documentation)
+        self.stats = stats
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, value in self.stats().items():
+            name = f"{self.name}_{key}"
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                kind = "counter" if key.endswith("_total") else "gauge"
+                lines += [f"# HELP {name} {self.documentation}", f"# TYPE {name} {kind}"]
+                lines.append(f"{name} {_format_value(value)}")
+            elif key == "state" and isinstance(value, str):
+                lines += [f"# HELP {name} {self.documentation}", f"# TYPE {name} gauge"]
+                lines.append(f"{name}{_format_labels(('state',), (value,))} 1")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def stats(self, prefix: str, documentation: str, stats: Callable[[], dict]):
+        return self.register(_StatsMetric(prefix, documentation, stats))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "HTTP responses by route and status code", ("method", "route", "status"))
+HTTP_RESPONSE_SIZE = REGISTRY.histogram(
+    "http_response_size_bytes", "HTTP response body size by route", ("method", "route"), SIZE_BUCKETS)
+IMAGE_GENERATION_DURATION = REGISTRY.histogram(
+    "image_generation_duration_seconds", "Image model call latency by outcome", ("outcome",))
+IMAGE_GENERATION_IMAGES = REGISTRY.counter(
+    "image_generation_images_total", "Images returned by the image model")
+MONGO_COMMAND_DURATION = REGISTRY.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency by collection and command",
+    ("collection", "command"))
+MONGO_COMMAND_FAILURES = REGISTRY.counter(
+    "mongo_command_failures_total", "Failed MongoDB commands by collection and command",
+    ("collection", "command"))
+INVENTORY_DEPTH = REGISTRY.gauge(
+    "card_inventory_depth", "Generated cards waiting to be served")
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and body size per route.
+
+    Routes are labelled by their path template (``/api/cards/{card_id}/image``)
+    so label cardinality stays bounded; unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths: Dict[Callable, str] = {}
+
+    def _route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = route.path
+                    break
+            else:
+                path = getattr(endpoint, "__name__", "unknown")
+            self._route_paths[endpoint] = path
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            method = scope["method"]
+            route = self._route_label(scope)
+            HTTP_REQUEST_DURATION.observe(method, route, value=time.perf_counter() - started)
+            HTTP_REQUESTS.inc(method, route, str(status))
+            HTTP_RESPONSE_SIZE.observe(method, route, value=size)
+
+
+class InstrumentedImageGenerator:
+    """Times every ``generate_images`` call on the wrapped generator."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    async def generate_images(self, prompt: str, model: str, number_of_images: int = 1):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            images = await self.inner.generate_images(
+                prompt=prompt, model=model, number_of_images=number_of_images
+            )
+            outcome = "ok"
+            IMAGE_GENERATION_IMAGES.inc(amount=len(images or []))
+            return images
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            IMAGE_GENERATION_DURATION.observe(outcome, value=time.perf_counter() - started)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Driver-level listener timing every MongoDB command.
+
+    Pass it to the client via ``event_listeners``; this sees every operation
+    (including cursor ``getMore`` batches) without wrapping collections.
+    """
+
+    # Commands whose first field is not a collection name
+    _NO_COLLECTION = {"ping", "hello", "ismaster", "isMaster", "endSessions", "buildInfo", "listCollections"}
+
+    def __init__(self):
+        self._pending: Dict[Tuple[object, int], Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        name = event.command_name
+        if name in self._NO_COLLECTION:
+            collection = "-"
+        elif name == "getMore":
+            collection = str(event.command.get("collection", "-"))
+        else:
+            collection = str(event.command.get(name, "-"))
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (collection, name)
+
+    def _finish(self, event):
+        with self._lock:
+            return self._pending.pop((event.connection_id, event.request_id), ("-", event.command_name))
+
+    def succeeded(self, event):
+        collection, name = self._finish(event)
+        MONGO_COMMAND_DURATION.observe(collection, name, value=event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection, name = self._finish(event)
+        MONGO_COMMAND_DURATION.observe(collection, name, value=event.duration_micros / 1e6)
+        MONGO_COMMAND_FAILURES.inc(collection, name)
@@ -0,0 +1,233 @@
+"""One-shot data migrations for the cards database.
+
+Run from the backend directory with the same environment as the server:
+
+    python migrations.py inline-images derivatives string-dates dedupe-collections dhash user-likes
+"""
+import argparse
+import asyncio
+import base64
+import logging
+import os
+from pathlib import Path
+
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from blobstore import BlobStore
+from counters import COLLECTION_SIZE, user_counter
+from dedup import dhash_bands
+from derivatives import DerivativePipeline
+
+ROOT_DIR = Path(__file__).parent
+logger = logging.getLogger(__name__)
+
+
+async def migrate_inline_images(db, image_store: BlobStore, batch_size: int = 100) -> int:
+    """Move ``image_base64`` strings out of card documents into the blob store.
+
+    Each card is rewritten in place with ``image_sha256`` and the inline field
+    removed. Safe to re-run: only documents that still carry ``image_base64``
+    are touched.
+    """
+    migrated = 0
+    while True:
+        cards = await db.cards.find(
+            {"image_base64": {"$exists": True}}, {"_id": 1, "image_base64": 1}
+        ).limit(batch_size).to_list(length=None)
+        if not cards:
+            return migrated
+
+        for card in cards:
+            key = await image_store.put(base64.b64decode(card["image_base64"]))
+            await db.cards.update_one(
+                {"_id": card["_id"]},
+                {
+                    "$set": {"image_sha256": key, "image_content_type": "image/png"},
+                    "$unset": {"image_base64": ""},
+                },
+            )
+        migrated += len(cards)
+        logger.info(f"Migrated {migrated} inline card images")
+
+
+async def migrate_derivatives(db, image_store: BlobStore, batch_size: int = 100) -> int:
+    """Render thumbnail and palette variants for cards that have none yet."""
+    pipeline = DerivativePipeline(
+        image_store,
+        sizes=[int(size) for size in os.environ.get('THUMBNAIL_SIZES', '64,128,256').split(',')],
+        max_workers=int(os.environ.get('IMAGE_WORKERS', '2')),
+    )
+    migrated = 0
+    try:
+        cursor = db.cards.find(
+            {"image_sha256": {"$exists": True}, "image_variants": {"$in": [None, {}]}},
+            {"_id": 1, "image_sha256": 1},
+            batch_size=batch_size,
+        )
+        async for card in cursor:
+            variants = await pipeline.build(await image_store.get(card["image_sha256"]))
+            await db.cards.update_one({"_id": card["_id"]}, {"$set": {"image_variants": variants}})
+            migrated += 1
+            if migrated % batch_size == 0:
+                logger.info(f"Rendered variants for {migrated} cards")
+    finally:
+        pipeline.shutdown()
+    return migrated
+
+
+async def migrate_string_dates(db, image_store: BlobStore, batch_size: int = 500) -> int:
+    """Convert ISO-string timestamps written by older servers to BSON dates."""
+    migrated = 0
+    for collection_name, field in (("cards", "created_at"), ("cards", "served_at"), ("collections", "liked_at")):
+        collection = db[collection_name]
+        while True:
+            docs = await collection.find(
+                {field: {"$type": "string"}}, {"_id": 1, field: 1}
+            ).limit(batch_size).to_list(length=None)
+            if not docs:
+                break
+
+            updates = []
+            for doc in docs:
+                value = datetime.fromisoformat(doc[field].replace('Z', '+00:00'))
+                if value.tzinfo is None:
+                    value = value.replace(tzinfo=timezone.utc)
+                updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {field: value}}))
+            await collection.bulk_write(updates, ordered=False)
+            migrated += len(updates)
+            logger.info(f"Converted {migrated} string dates")
+    return migrated
+
+
+async def dedupe_collections(db, image_store: BlobStore) -> int:
+    """Collapse duplicate collection rows so card_id can be indexed uniquely.
+
+    Keeps the earliest like of each card, drops the old non-unique index and
+    resets the collection size counter.
+    """
+    duplicates = db.collections.aggregate([
+        {"$sort": {"liked_at": 1}},
+        {"$group": {"_id": "$card_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+
+    removed = 0
+    async for group in duplicates:
+        result = await db.collections.delete_many({"_id": {"$in": group["ids"][1:]}})
+        removed += result.deleted_count
+
+    if "card_id" in await db.collections.index_information():
+        await db.collections.drop_index("card_id")
+    await db.counters.update_one(
+        {"_id": COLLECTION_SIZE},
+        {"$set": {"value": await db.collections.count_documents({})}},
+        upsert=True,
+    )
+    return removed
+
+
+async def migrate_dhash(db, image_store: BlobStore, batch_size: int = 100) -> int:
+    """Index perceptual hashes of cards stored before near-duplicate checks.
+
+    Existing near-duplicates are left alone; they only become visible to
+    the checks made for new images.
+    """
+    pipeline = DerivativePipeline(image_store, max_workers=int(os.environ.get('IMAGE_WORKERS', '2')))
+    migrated = 0
+    try:
+        cursor = db.cards.find(
+            {"image_sha256": {"$exists": True}, "image_dhash": None},
+            {"_id": 1, "image_sha256": 1},
+            batch_size=batch_size,
+        )
+        updates = []
+        async for card in cursor:
+            try:
+                dhash = await pipeline.fingerprint(await image_store.get(card["image_sha256"]))
+            except FileNotFoundError:
+                continue
+            updates.append(UpdateOne(
+                {"_id": card["_id"]},
+                {"$set": {"image_dhash": dhash, "image_dhash_bands": dhash_bands(dhash)}},
+            ))
+            if len(updates) == batch_size:
+                await db.cards.bulk_write(updates, ordered=False)
+                migrated += len(updates)
+                updates = []
+                logger.info(f"Hashed {migrated} card images")
+        if updates:
+            await db.cards.bulk_write(updates, ordered=False)
+            migrated += len(updates)
+    finally:
+        pipeline.shutdown()
+    return migrated
+
+
+async def migrate_user_likes(db, image_store: BlobStore, batch_size: int = 1000) -> int:
+    """Move the shared pre-session collection into ``likes`` under one user.
+
+    Rows go to ``LEGACY_USER_ID`` (default ``legacy``); a client adopts them
+    by sending that user's session token. The global ``is_liked`` flag is
+    dropped from cards, and liked cards are kept out of the unserved
+    inventory. Safe to re-run: likes upsert on ``(user_id, card_id)``.
+    """
+    user_id = os.environ.get('LEGACY_USER_ID', 'legacy')
+    migrated = 0
+    updates = []
+    async for row in db.collections.find({}, {"_id": 0, "id": 1, "card_id": 1, "liked_at": 1}, batch_size=batch_size):
+        updates.append(UpdateOne(
+            {"user_id": user_id, "card_id": row["card_id"]},
+            {"$setOnInsert": {"id": row["id"], "user_id": user_id, "card_id": row["card_id"], "liked_at": row["liked_at"]}},
+            upsert=True,
+        ))
+        if len(updates) == batch_size:
+            await db.likes.bulk_write(updates, ordered=False)
+            migrated += len(updates)
+            updates = []
+            logger.info(f"Moved {migrated} likes to user {user_id}")
+    if updates:
+        await db.likes.bulk_write(updates, ordered=False)
+        migrated += len(updates)
+
+    await db.cards.update_many({"is_liked": True}, {"$set": {"served": True}})
+    await db.cards.update_many({"is_liked": {"$exists": True}}, {"$unset": {"is_liked": ""}})
+    await db.counters.update_one(
+        {"_id": user_counter(COLLECTION_SIZE, user_id)},
+        {"$set": {"value": await db.likes.count_documents({"user_id": user_id})}},
+        upsert=True,
+    )
+    return migrated
+
+
+MIGRATIONS = {
+    "inline-images": migrate_inline_images,
+    "derivatives": migrate_derivatives,
+    "string-dates": migrate_string_dates,
+    "dedupe-collections": dedupe_collections,
+    "dhash": migrate_dhash,
+    "user-likes": migrate_user_likes,
+}
+
+
+async def main(names):
+    load_dotenv(ROOT_DIR / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    image_store = BlobStore(os.environ.get('IMAGE_STORE_DIR', ROOT_DIR / 'image_store'))
+    try:
+        for name in names:
+            count = await MIGRATIONS[name](db, image_store)
+            print(f"{name}: migrated {count} documents")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Run one-shot data migrations")
+    parser.add_argument("migrations", nargs="+", choices=sorted(MIGRATIONS))
+    asyncio.run(main(parser.parse_args().migrations))
@@ -0,0 +1,44 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(sort_value: Any, tie_breaker: str) -> str:
+    """Build an opaque cursor pointing just past the given sort key."""
+    if isinstance(sort_value, datetime):
+        payload = {"t": sort_value.isoformat(), "id": tie_breaker}
+    else:
+        payload = {"v": sort_value, "id": tie_breaker}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if "t" in payload:
+            value = datetime.fromisoformat(payload["t"])
+        else:
+            value = payload["v"]
+        tie = payload["id"]
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+    # Both go into a Mongo filter; anything else (e.g. an object) could inject operators
+    if isinstance(value, bool) or not isinstance(value, (str, int, float, datetime)) or not isinstance(tie, str):
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+    return value, tie
+
+
+def keyset_filter(field: str, tie_field: str, cursor: Optional[str], descending: bool = True) -> dict:
+    """Mongo filter selecting documents after ``cursor`` in (field, tie_field) order."""
+    if not cursor:
+        return {}
+    value, tie = decode_cursor(cursor)
+    op = "$lt" if descending else "$gt"
+    return {"$or": [{field: {op: value}}, {field: value, tie_field: {op: tie}}]}
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class GenerationUnavailable(Exception):
+    """The image model can't be used right now; callers should fall back."""
+
+
+class CircuitOpenError(GenerationUnavailable):
+    pass
+
+
+class GenerationTimeout(GenerationUnavailable):
+    pass
+
+
+class GenerationFailed(GenerationUnavailable):
+    """The wrapped generator raised; the original error is the ``__cause__``."""
+
+
+class ResilientImageGenerator:
+    """Wraps an image generator with adaptive concurrency and a circuit breaker.
+
+    Exposes the same ``generate_images`` coroutine as the wrapped client.
+
+    Concurrency follows AIMD: every call that succeeds within
+    ``latency_target`` seconds grows the limit by roughly one per window of
+    calls, while an error, a timeout or a slow call halves it (never below
+    ``min_limit`` nor above ``max_limit``). Every call also has a hard
+    ``deadline``.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    calls fail immediately with ``CircuitOpenError`` for ``reset_timeout``
+    seconds; then a single probe call is let through (half-open) and its
+    outcome closes or re-opens the circuit.
+    """
+
+    def __init__(
+        self,
+        inner,
+        min_limit: int = 1,
+        max_limit: int = 8,
+        initial_limit: int = 2,
+        latency_target: float = 60.0,
+        deadline: float = 90.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.inner = inner
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.deadline = deadline
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+
+        self.state = CLOSED
+        self.calls_total = 0
+        self.successes_total = 0
+        self.failures_total = 0
+        self.timeouts_total = 0
+        self.rejected_total = 0
+        self.opened_total = 0
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._in_flight = 0
+        self._slots = asyncio.Condition()
+
+    async def generate_images(self, prompt: str, model: str, number_of_images: int = 1) -> List[bytes]:
+        probe = self._admit()
+        try:
+            await self._acquire()
+        except BaseException:
+            if probe:
+                self._probe_in_flight = False
+            raise
+        self.calls_total += 1
+        started = self.clock()
+        try:
+            images = await asyncio.wait_for(
+                self.inner.generate_images(prompt=prompt, model=model, number_of_images=number_of_images),
+                timeout=self.deadline,
+            )
+        except asyncio.TimeoutError:
+            self.timeouts_total += 1
+            self._on_failure(probe)
+            raise GenerationTimeout(f"Image generation exceeded its {self.deadline}s deadline")
+        except asyncio.CancelledError:
+            if probe:
+                self._probe_in_flight = False
+            raise
+        except Exception as e:
+            self._on_failure(probe)
+            raise GenerationFailed(str(e) or type(e).__name__) from e
+        else:
+            self._on_success(probe, self.clock() - started)
+            return images
+        finally:
+            await self._release()
+
+    def _admit(self) -> bool:
+        """Apply the breaker; returns True when this call is the half-open probe."""
+        if self.state == OPEN:
+            if self.clock() - self._opened_at < self.reset_timeout:
+                self.rejected_total += 1
+                raise CircuitOpenError("Image generation is temporarily unavailable")
+            self.state = HALF_OPEN
+            logger.info("Image generation circuit half-open, sending a probe")
+
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected_total += 1
+                raise CircuitOpenError("Image generation is recovering, probe in flight")
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def _on_success(self, probe: bool, latency: float):
+        self.successes_total += 1
+        self._consecutive_failures = 0
+        if probe:
+            self._probe_in_flight = False
+            self.state = CLOSED
+            logger.info("Image generation circuit closed")
+
+        if latency <= self.latency_target:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        else:
+            self._decrease()
+
+    def _on_failure(self, probe: bool):
+        self.failures_total += 1
+        self._consecutive_failures += 1
+        self._decrease()
+        if probe:
+            self._probe_in_flight = False
+        if probe or (self.state == CLOSED and self._consecutive_failures >= self.failure_threshold):
+            self.state = OPEN
+            self._opened_at = self.clock()
+            self.opened_total += 1
+            logger.warning(
+                f"Image generation circuit opened after {self._consecutive_failures} consecutive failures"
+            )
+
+    def _decrease(self):
+        self.limit = max(float(self.min_limit), self.limit / 2)
+
+    async def _acquire(self):
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._in_flight < int(self.limit))
+            self._in_flight += 1
+
+    async def _release(self):
+        async with self._slots:
+            self._in_flight -= 1
+            self._slots.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "concurrency_limit": round(self.limit, 3),
+            "in_flight": self._in_flight,
+            "calls_total": self.calls_total,
+            "successes_total": self.successes_total,
+            "failures_total": self.failures_total,
+            "timeouts_total": self.timeouts_total,
+            "rejected_total": self.rejected_total,
+            "opened_total": self.opened_total,
+        }
@@ -0,0 +1,90 @@
+"""Process-wide clients that are created on first use.
+
+Importing the app must not open connections: gunicorn ``--preload`` and
+uvicorn ``--workers`` import it once and fork, image pool processes
+re-import it, and tools such as ``worker.py`` only need part of it. The
+Motor client is therefore built the first time a collection is used,
+inside the worker process and event loop that use it, and components are
+handed collection proxies that resolve to it at call time.
+"""
+import logging
+from typing import Callable, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+logger = logging.getLogger(__name__)
+
+
+class MongoConnection:
+    """One Motor client per process, with pool options applied once."""
+
+    def __init__(self, url: str, db_name: str, **options):
+        self.url = url
+        self.db_name = db_name
+        self.options = options
+        self._client: Optional[AsyncIOMotorClient] = None
+
+    @property
+    def client(self) -> AsyncIOMotorClient:
+        if self._client is None:
+            self._client = AsyncIOMotorClient(self.url, **self.options)
+            logger.info(f"Connected Mongo client (pool {self.options.get('maxPoolSize', 'default')})")
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    async def ping(self):
+        await self.db.command("ping")
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+class LazyCollection:
+    """Stands in for a Motor collection until the client exists."""
+
+    def __init__(self, connection: MongoConnection, name: str):
+        self._connection = connection
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._connection.db[self._name], attr)
+
+
+class LazyDatabase:
+    """Hands out collection proxies: ``db.cards`` and ``db["cards"]`` never connect by themselves.
+
+    Attribute access always means a collection; database commands the app
+    needs are forwarded explicitly.
+    """
+
+    def __init__(self, connection: MongoConnection):
+        self._connection = connection
+
+    def __getitem__(self, name: str) -> LazyCollection:
+        return LazyCollection(self._connection, name)
+
+    def __getattr__(self, name: str) -> LazyCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return LazyCollection(self._connection, name)
+
+    async def create_collection(self, name: str, **options):
+        return await self._connection.db.create_collection(name, **options)
+
+
+class LazyImageGenerator:
+    """Builds the model client from ``factory`` on the first ``generate_images`` call."""
+
+    def __init__(self, factory: Callable[[], object]):
+        self.factory = factory
+        self._client = None
+
+    async def generate_images(self, *args, **kwargs):
+        if self._client is None:
+            self._client = self.factory()
+        return await self._client.generate_images(*args, **kwargs)
@@ -0,0 +1,96 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Bounded LRU cache of serialized responses with a TTL.
+
+    Entries are grouped by namespace (e.g. ``cards``, ``collection``) and
+    the code paths that change the underlying data invalidate their
+    namespace. Each namespace has a generation number: a response computed
+    while an invalidation happened is not stored, so a slow request cannot
+    put stale bytes back after the write that made them stale.
+
+    ``record`` caches a streamed body as it passes through; bodies larger
+    than ``max_entry_bytes`` are streamed without being kept.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 30.0, enabled: bool = True,
+                 max_entry_bytes: int = 1024 * 1024, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max(1, max_entries)
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self.clock = clock
+
+        self.hits_total = 0
+        self.misses_total = 0
+        self.evictions_total = 0
+        self.invalidations_total = 0
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[float, bytes]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+
+    def generation(self, namespace: str) -> int:
+        """Token to pass to ``put`` for a response about to be computed."""
+        return self._generations.get(namespace, 0)
+
+    def get(self, namespace: str, key: Hashable) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        entry = self._entries.get((namespace, key))
+        if entry is None or entry[0] < self.clock():
+            if entry is not None:
+                del self._entries[(namespace, key)]
+            self.misses_total += 1
+            return None
+        self._entries.move_to_end((namespace, key))
+        self.hits_total += 1
+        return entry[1]
+
+    def put(self, namespace: str, key: Hashable, body: bytes, generation: int):
+        if not self.enabled or generation != self.generation(namespace):
+            return
+        self._entries[(namespace, key)] = (self.clock() + self.ttl, body)
+        self._entries.move_to_end((namespace, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions_total += 1
+
+    async def record(self, namespace: str, key: Hashable, generation: int,
+                     chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Pass a streamed body through, storing it once it completes."""
+        kept = [] if self.enabled else None
+        size = 0
+        async for chunk in chunks:
+            if kept is not None:
+                size += len(chunk)
+                if size > self.max_entry_bytes:
+                    kept = None
+                else:
+                    kept.append(chunk)
+            yield chunk
+        if kept is not None:
+            self.put(namespace, key, b"".join(kept), generation)
+
+    def invalidate(self, *namespaces: str):
+        namespaces = set(namespaces)
+        for namespace in namespaces:
+            self._generations[namespace] = self.generation(namespace) + 1
+        stale = [entry_key for entry_key in self._entries if entry_key[0] in namespaces]
+        for entry_key in stale:
+            del self._entries[entry_key]
+        self.invalidations_total += 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hits_total": self.hits_total,
+            "misses_total": self.misses_total,
+            "evictions_total": self.evictions_total,
+            "invalidations_total": self.invalidations_total,
+        }
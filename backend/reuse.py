@@ -0,0 +1,51 @@
+import logging
+from typing import List
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCache:
+    """Serves prior model outputs for a prompt instead of paying for new ones.
+
+    Every card stores the ``prompt`` and ``model`` it was generated with. An
+    original output may be handed out for remixing up to ``reuse_budget``
+    times (tracked in its ``reuse_count``), so at most ``reuse_budget`` of
+    every ``reuse_budget + 1`` cards for a prompt are remixes; a budget of 0,
+    the default, turns the cache off.
+    """
+
+    def __init__(self, collection, reuse_budget: int = 0):
+        self.collection = collection
+        self.reuse_budget = max(0, reuse_budget)
+
+        self.hits_total = 0
+        self.misses_total = 0
+
+    async def take(self, prompt: str, model: str, count: int = 1) -> List[dict]:
+        """Claim up to ``count`` prior outputs for the prompt, least reused first."""
+        sources = []
+        if self.reuse_budget:
+            for _ in range(count):
+                source = await self.collection.find_one_and_update(
+                    {"prompt": prompt, "model": model, "remix_of": None,
+                     "reuse_count": {"$lt": self.reuse_budget}},
+                    {"$inc": {"reuse_count": 1}},
+                    projection={"_id": 0, "id": 1, "image_sha256": 1},
+                    sort=[("reuse_count", 1)],
+                    return_document=ReturnDocument.AFTER,
+                )
+                if source is None:
+                    break
+                sources.append(source)
+        self.hits_total += len(sources)
+        self.misses_total += count - len(sources)
+        return sources
+
+    def stats(self) -> dict:
+        return {
+            "reuse_budget": self.reuse_budget,
+            "hits_total": self.hits_total,
+            "misses_total": self.misses_total,
+        }
@@ -1,16 +1,51 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 import uuid
-from datetime import datetime, timezone
-import base64
+from datetime import datetime, timedelta, timezone
 import asyncio
+import random
+import tempfile
+
+from archive import FORMATS, ArchiveImporter, InvalidArchive, export_archive
+from atlas import CollectionAtlas
+from batch import BatchGenerator, BatchResult
+from blobstore import BlobStore, parse_range
+from coalescing import GenerationCoalescer
+from compression import CompressionMiddleware
+from counters import (
+    CARDS_VERSION, COLLECTION_SIZE, COLLECTION_VERSION, get_counter_state, increment_counter, seed_counter, user_counter,
+)
+from dedup import DROP, NearDuplicateIndex, dhash_bands
+from derivatives import ORIGINAL, DerivativePipeline
+from events import EventBus, EventRelay
+from fastjson import JSON, NDJSON, encode_page, start_stream, wants_ndjson
+from httpcache import not_modified, validator_headers, version_etag
+from indexes import ensure_indexes
+from inventory import CardInventory
+from jobs import MAX_JOB_ITEMS, Job, JobNotFound, JobQueue
+from leader import LeaderElection
+from lifecycle import StorageLifecycle
+from metrics import (
+    INVENTORY_DEPTH, PROMETHEUS_CONTENT_TYPE, REGISTRY,
+    InstrumentedImageGenerator, MetricsMiddleware, MongoCommandMetrics,
+)
+from pagination import InvalidCursor, encode_cursor, keyset_filter
+from responsecache import ResponseCache
+from resilience import (
+    CircuitOpenError, GenerationFailed, GenerationTimeout, GenerationUnavailable, ResilientImageGenerator,
+)
+from resources import LazyDatabase, LazyImageGenerator, MongoConnection
+from reuse import GenerationCache
+from sessions import SESSION_COOKIE, SESSION_HEADER, SessionMiddleware, SessionTokens
+from swipes import SwipeBatch, SwipeEvent, SwipeWriter
 
 # Import image generation
 from emergentintegrations.llm.openai.image_generation import OpenAIImageGeneration
@@ -18,47 +53,191 @@ from emergentintegrations.llm.openai.image_generation import OpenAIImageGenerati
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection, opened on first use in each worker process. Every
+# worker has its own pool, so keep workers x MONGO_MAX_POOL_SIZE within the
+# server's connection limit.
+mongo = MongoConnection(
+    os.environ['MONGO_URL'],
+    os.environ['DB_NAME'],
+    tz_aware=True,
+    event_listeners=[MongoCommandMetrics()],
+    maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', '50')),
+    minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', '2')),
+    maxIdleTimeMS=int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '60000')),
+    # Fail requests fast when Mongo is unreachable instead of holding them for 30s
+    serverSelectionTimeoutMS=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+    connectTimeoutMS=int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+)
+db = LazyDatabase(mongo)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_background_tasks()
+    try:
+        yield
+    finally:
+        await stop_background_tasks()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Initialize image generator
-image_gen = OpenAIImageGeneration(api_key=os.environ.get('EMERGENT_LLM_KEY'))
+# Initialize image generator, behind adaptive concurrency and a circuit breaker
+image_model = InstrumentedImageGenerator(
+    LazyImageGenerator(lambda: OpenAIImageGeneration(api_key=os.environ.get('EMERGENT_LLM_KEY')))
+)
+image_gen = ResilientImageGenerator(
+    image_model,
+    max_limit=int(os.environ.get('GENERATION_MAX_IN_FLIGHT', '4')),
+    initial_limit=int(os.environ.get('GENERATION_INITIAL_IN_FLIGHT', '2')),
+    latency_target=float(os.environ.get('GENERATION_LATENCY_TARGET', '60')),
+    deadline=float(os.environ.get('GENERATION_DEADLINE', '90')),
+    failure_threshold=int(os.environ.get('GENERATION_FAILURE_THRESHOLD', '5')),
+    reset_timeout=float(os.environ.get('GENERATION_RESET_TIMEOUT', '30')),
+)
+
+# Card images live outside Mongo, keyed by the SHA-256 of their bytes
+image_store = BlobStore(os.environ.get('IMAGE_STORE_DIR', ROOT_DIR / 'image_store'))
+
+# Thumbnails and palette-quantized variants, rendered in a process pool
+derivatives = DerivativePipeline(
+    image_store,
+    sizes=[int(size) for size in os.environ.get('THUMBNAIL_SIZES', '64,128,256').split(',')],
+    max_workers=int(os.environ.get('IMAGE_WORKERS', '2')),
+)
+
+IMAGE_MODEL = "gpt-image-1"
+
+# Remix prior outputs of a prompt instead of paying for every card; off unless a budget is set
+generation_cache = GenerationCache(db.cards, reuse_budget=int(os.environ.get('GENERATION_REUSE_BUDGET', '0')))
+
+# Perceptual-hash check that drops (or links) near-identical new images
+near_duplicates = NearDuplicateIndex(
+    db.cards,
+    max_distance=int(os.environ.get('DEDUP_MAX_DISTANCE', '3')),
+    mode=os.environ.get('DEDUP_MODE', 'drop'),
+)
+
+# Never load inline images when reading card documents
+CARD_PROJECTION = {"_id": 0, "image_base64": 0}
 
 # Define Models
 class Card(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    image_base64: str
+    image_sha256: str
+    image_content_type: str = "image/png"
+    image_variants: Dict[str, dict] = {}
+    image_dhash: Optional[str] = None
+    image_dhash_bands: List[str] = []
     prompt: str
+    model: str = IMAGE_MODEL
+    reuse_count: int = 0
+    remix_of: Optional[str] = None
+    duplicate_of: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    is_liked: bool = False
+    served: bool = False
 
 class CardCreate(BaseModel):
     prompt: str
 
 class CardResponse(BaseModel):
     id: str
-    image_base64: str
-    prompt: str
-    created_at: datetime
+    image_url: Optional[str] = None
+    prompt: Optional[str] = None
+    created_at: Optional[datetime] = None
+    # Whether the requesting user liked the card
     is_liked: bool = False
+    liked_at: Optional[datetime] = None
+
+class CardPage(BaseModel):
+    cards: List[CardResponse]
+    next_cursor: Optional[str] = None
+
+class CollectionPage(CardPage):
+    total: int
+
+class CardFeed(BaseModel):
+    cards: List[CardResponse]
+
+class AtlasCard(CardResponse):
+    # Rectangle of the card's thumbnail in the sheet; absent if it could not be drawn
+    x: Optional[int] = None
+    y: Optional[int] = None
+    w: Optional[int] = None
+    h: Optional[int] = None
+
+class CollectionAtlasPage(BaseModel):
+    sheet_url: Optional[str] = None
+    width: int
+    height: int
+    size: int
+    page: int
+    pages: int
+    total: int
+    version: int
+    cards: List[AtlasCard]
+
+# Response fields that can be requested with fields=, and the stored fields behind them
+CARD_FIELDS = {
+    "id": "id",
+    "image_url": "id",
+    "prompt": "prompt",
+    "created_at": "created_at",
+}
+
+def card_to_item(card: dict, size: Optional[str] = None, fields: Optional[List[str]] = None) -> dict:
+    """Response fields of a stored card as a plain dict, ready for JSON encoding"""
+    image_url = f"/api/cards/{card['id']}/image"
+    if size and size != ORIGINAL:
+        image_url += f"?size={size}"
+    item = {"id": card['id'], "image_url": image_url}
+    for key in ("prompt", "created_at"):
+        if key in card:
+            item[key] = card[key]
+    if card.get('liked_at') is not None:
+        item['is_liked'] = True
+        item['liked_at'] = card['liked_at']
+    if fields:
+        item = {key: value for key, value in item.items() if key in fields or key == 'id'}
+    return item
+
+def card_to_response(card: dict, size: Optional[str] = None, fields: Optional[List[str]] = None) -> CardResponse:
+    return CardResponse(**card_to_item(card, size, fields))
+
+def parse_card_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in CARD_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown card fields: {', '.join(unknown)}; expected any of: {', '.join(CARD_FIELDS)}"
+        )
+    return requested
+
+def check_list_format(format: Optional[str]):
+    if format is not None and format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail=f"Unknown format '{format}', expected json or ndjson")
+
+def check_image_size(size: Optional[str]):
+    if size is not None and size not in derivatives.names:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown image size '{size}', expected one of: {', '.join(derivatives.names)}"
+        )
+
+class JobRequest(BaseModel):
+    count: int = 5
+    prompts: Optional[List[str]] = None
 
 class LikeCardRequest(BaseModel):
     card_id: str
     liked: bool
 
-class UserCollection(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    card_id: str
-    liked_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
 # Pixel art prompts for female feet with variety of poses
 PIXEL_ART_PROMPTS = [
     "Pixel art of elegant female feet in fantasy sandals, 16-bit style, cute anime aesthetic, soft colors",
@@ -88,151 +267,808 @@ PIXEL_ART_PROMPTS = [
     "Pixel art of female feet in running shoes, athletic pose, dynamic movement"
 ]
 
-@api_router.get("/")
-async def root():
-    return {"message": "Pixel Card Collection Game API"}
+async def build_card_document(image: bytes, prompt: str, **links) -> dict:
+    """Store an image with its variants and perceptual hash as a card document"""
+    try:
+        image_variants = await derivatives.build(image)
+    except Exception as e:
+        # Variants are an optimisation; the original is always served as a fallback
+        logging.error(f"Error rendering image derivatives: {str(e)}")
+        image_variants = {}
 
-@api_router.post("/generate-card", response_model=CardResponse)
-async def generate_card():
     try:
-        # Select a random prompt
-        import random
+        image_dhash = await derivatives.fingerprint(image)
+    except Exception as e:
+        logging.error(f"Error hashing card image: {str(e)}")
+        image_dhash = None
+
+    card = Card(
+        image_sha256=await image_store.put(image),
+        image_variants=image_variants,
+        image_dhash=image_dhash,
+        image_dhash_bands=dhash_bands(image_dhash) if image_dhash else [],
+        prompt=prompt,
+        **links
+    )
+    return card.dict()
+
+async def generate_card_documents(count: int = 1, prompt: Optional[str] = None) -> List[dict]:
+    """Generate card images with one model call and return database-ready documents"""
+    if prompt is None:
         prompt = random.choice(PIXEL_ART_PROMPTS)
-        
-        # Generate image
+
+    # Remixes of earlier outputs for this prompt cover part of the request for free
+    cards = []
+    for source in await generation_cache.take(prompt, IMAGE_MODEL, count):
+        try:
+            image = await image_store.get(source['image_sha256'])
+        except FileNotFoundError:
+            continue
+        remix = await derivatives.remix(image, seed=random.getrandbits(32))
+        cards.append(await build_card_document(remix, prompt, remix_of=source['id']))
+
+    if len(cards) < count:
         images = await image_gen.generate_images(
             prompt=prompt,
-            model="gpt-image-1",
-            number_of_images=1
+            model=IMAGE_MODEL,
+            number_of_images=count - len(cards)
         )
-        
+
         if not images or len(images) == 0:
-            raise HTTPException(status_code=500, detail="Failed to generate image")
-        
-        # Convert to base64
-        image_base64 = base64.b64encode(images[0]).decode('utf-8')
-        
-        # Create card object
-        card = Card(
-            image_base64=image_base64,
-            prompt=prompt
-        )
-        
-        # Save to database
-        card_dict = card.dict()
-        card_dict['created_at'] = card_dict['created_at'].isoformat()
-        await db.cards.insert_one(card_dict)
-        
-        return CardResponse(**card.dict())
+            raise RuntimeError("Failed to generate image")
+
+        for image in images:
+            card = await build_card_document(image, prompt)
+            if near_duplicates.enabled and card['image_dhash']:
+                duplicate_of = await near_duplicates.find(card['image_dhash'], pending=cards)
+                if duplicate_of is not None:
+                    logging.info(f"Generated image is a near-duplicate of card {duplicate_of}")
+                    if near_duplicates.mode == DROP:
+                        continue
+                    card['duplicate_of'] = duplicate_of
+            cards.append(card)
+
+    if not cards:
+        # Callers treat this like a failed model call: retry or serve a stored card
+        raise GenerationFailed("Every generated image was a near-duplicate of an existing card")
+    return cards
+
+async def generate_card_document(prompt: Optional[str] = None) -> dict:
+    """Generate one card image and return it as a database-ready document"""
+    cards = await generate_card_documents(1, prompt)
+    return cards[0]
+
+# Anonymous per-user sessions; without SESSION_SECRET a generated secret is shared through Mongo
+session_tokens = SessionTokens(os.environ.get('SESSION_SECRET'))
+
+def session_user(request: Request) -> Optional[str]:
+    """User id of the caller's session token (header, else cookie), if it is valid"""
+    return session_tokens.verify(request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE))
+
+def current_user(request: Request) -> str:
+    """User id of the caller, starting a new anonymous session when it has none"""
+    user_id = session_user(request)
+    if user_id is None:
+        user_id, request.state.session_token = session_tokens.issue()
+    return user_id
+
+def collection_namespace(user_id: str) -> str:
+    return f"collection:{user_id}"
+
+# Serialized /api/cards and /api/collection pages, dropped whenever cards or likes change
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', '512')),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL', '30')),
+    enabled=os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+)
+
+# Pushes new cards and committed swipes to /api/events subscribers
+event_bus = EventBus(
+    queue_size=int(os.environ.get('EVENT_QUEUE_SIZE', '100')),
+    history=int(os.environ.get('EVENT_HISTORY', '256')),
+)
+# Shares card and like events with every worker and host, so any of them can serve /api/events
+EVENT_RELAY = os.environ.get('EVENT_RELAY', 'true').lower() in ('1', 'true', 'yes')
+event_relay = EventRelay(
+    db,
+    event_bus,
+    size=int(os.environ.get('EVENT_RELAY_SIZE_MB', '16')) * 1024 * 1024,
+    max_events=int(os.environ.get('EVENT_RELAY_MAX_EVENTS', '10000')),
+)
+EVENT_KEEPALIVE = float(os.environ.get('EVENT_KEEPALIVE', '15'))
+EVENT_STREAM_MAX_AGE = float(os.environ.get('EVENT_STREAM_MAX_AGE', '300'))
+
+# Fire-and-forget work started from synchronous hooks, held so it is not garbage collected
+background_tasks = set()
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def bump_cards_version():
+    try:
+        await increment_counter(db, CARDS_VERSION)
+    except Exception as e:
+        logging.error(f"Error bumping cards version: {str(e)}")
+
+async def version_validators(
+    request: Request, counter: str, *variant, cache_control: str = "no-cache"
+) -> Tuple[int, dict, bool]:
+    """Version of a counted resource, its ETag/Last-Modified headers, and whether the client's copy is current"""
+    version, last_modified = await get_counter_state(db, counter)
+    headers = validator_headers(version_etag(version, *variant), last_modified, cache_control)
+    return version, headers, not_modified(request.headers, headers['ETag'], last_modified)
+
+def cards_stored(cards: List[dict]):
+    """New cards change the card list and are pushed to event subscribers"""
+    response_cache.invalidate("cards")
+    run_in_background(bump_cards_version())
+    thumbnail_size = str(max(derivatives.sizes)) if derivatives.sizes else None
+    for card in cards:
+        data = card_to_response(card).dict(include={'id', 'image_url', 'prompt', 'created_at'})
+        data['thumbnail_url'] = card_to_response(card, thumbnail_size).image_url
+        event_relay.publish("card", data)
+
+def cards_removed(card_ids: List[str]):
+    """Evicted cards leave the card list; liked cards are never evicted, so collections are unaffected"""
+    response_cache.invalidate("cards")
+    run_in_background(bump_cards_version())
+
+def swipes_applied(events: List[SwipeEvent]):
+    """Likes only change the swiping users' collections, and are only pushed to them"""
+    response_cache.invalidate(*{collection_namespace(event.user_id) for event in events})
+    for event in events:
+        event_relay.publish("like" if event.liked else "unlike", {"card_id": event.card_id}, audience=event.user_id)
+
+# Collection pages packed into one thumbnail sprite sheet each, for the gallery
+collection_atlas = CollectionAtlas(
+    db,
+    image_store,
+    derivatives,
+    per_page=int(os.environ.get('ATLAS_PAGE_SIZE', '48')),
+    columns=int(os.environ.get('ATLAS_COLUMNS', '8')),
+    max_age=timedelta(days=float(os.environ.get('ATLAS_MAX_AGE_DAYS', '7'))),
+)
+
+# Concurrent callers of generate-card share model calls when the inventory is empty
+coalescer = GenerationCoalescer(
+    db.cards,
+    generate_card_documents,
+    on_stored=cards_stored,
+    max_in_flight=int(os.environ.get('GENERATION_MAX_IN_FLIGHT', '4')),
+    max_images_per_call=int(os.environ.get('GENERATION_MAX_IMAGES_PER_CALL', '4')),
+)
+
+# Concurrent, retrying batch generation shared by pre-generation and the inventory
+batch_generator = BatchGenerator(
+    db.cards,
+    generate_card_document,
+    concurrency=int(os.environ.get('BATCH_CONCURRENCY', '4')),
+    item_timeout=float(os.environ.get('BATCH_ITEM_TIMEOUT', '120')),
+    max_retries=int(os.environ.get('BATCH_MAX_RETRIES', '2')),
+    backoff_base=float(os.environ.get('BATCH_BACKOFF_BASE', '1')),
+    on_stored=cards_stored,
+)
+
+# Durable bulk generation; items are leased so several worker processes can share jobs
+job_queue = JobQueue(
+    db,
+    generate_card_document,
+    concurrency=int(os.environ.get('JOB_CONCURRENCY', '2')),
+    item_timeout=float(os.environ.get('BATCH_ITEM_TIMEOUT', '120')),
+    max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', '3')),
+    poll_interval=float(os.environ.get('JOB_POLL_INTERVAL', '2')),
+    on_stored=cards_stored,
+)
+# Set to false when jobs are handled by separate `python -m worker` processes
+JOB_WORKERS_IN_PROCESS = os.environ.get('JOB_WORKERS_IN_PROCESS', 'true').lower() in ('1', 'true', 'yes')
+
+# Background stock of ready cards so generate-card rarely waits on the model
+inventory = CardInventory(
+    db.cards,
+    batch_generator,
+    low_watermark=int(os.environ.get('INVENTORY_LOW_WATERMARK', '5')),
+    high_watermark=int(os.environ.get('INVENTORY_HIGH_WATERMARK', '15')),
+    refill_concurrency=int(os.environ.get('INVENTORY_REFILL_CONCURRENCY', '2')),
+    poll_interval=float(os.environ.get('INVENTORY_POLL_INTERVAL', '30')),
+    # Claims on workers that are not the leader wake the leader's refill
+    on_kick=lambda: event_relay.signal("inventory_refill"),
+)
+event_relay.on_signal("inventory_refill", inventory.wake)
+
+# Retention of passed-on cards, a cap on unserved stock and lossless PNG recompression
+MAX_UNSERVED_CARDS = int(os.environ.get('MAX_UNSERVED_CARDS', '500'))
+storage_lifecycle = StorageLifecycle(
+    db,
+    image_store,
+    derivatives,
+    atlases=collection_atlas,
+    on_removed=cards_removed,
+    retention=timedelta(days=float(os.environ.get('CARD_RETENTION_DAYS', '7'))),
+    # Never trim below what the inventory refills to, or the two would fight
+    max_unserved=max(MAX_UNSERVED_CARDS, inventory.high_watermark) if MAX_UNSERVED_CARDS else 0,
+    sweep_interval=float(os.environ.get('STORAGE_SWEEP_INTERVAL', '3600')),
+    compact_batch=int(os.environ.get('COMPACT_BATCH', '20')),
+    compact_interval=float(os.environ.get('COMPACT_INTERVAL', '60')),
+)
+
+async def start_singleton_tasks():
+    inventory.start()
+    storage_lifecycle.start()
+
+async def stop_singleton_tasks():
+    await inventory.stop()
+    await storage_lifecycle.stop()
+
+# Inventory refills and storage sweeps run on one worker across all processes and hosts
+LEADER_ELECTION = os.environ.get('LEADER_ELECTION', 'true').lower() in ('1', 'true', 'yes')
+leader = LeaderElection(
+    db.leases,
+    on_elected=start_singleton_tasks,
+    on_deposed=stop_singleton_tasks,
+    ttl=float(os.environ.get('LEADER_LEASE_TTL', '30')),
+    renew_interval=float(os.environ.get('LEADER_RENEW_INTERVAL', '10')),
+)
+
+# Write-behind buffer that batches swipes into periodic bulk writes
+swipe_writer = SwipeWriter(
+    db,
+    max_delay=float(os.environ.get('SWIPE_FLUSH_INTERVAL', '0.25')),
+    max_batch=int(os.environ.get('SWIPE_FLUSH_BATCH', '500')),
+    on_applied=swipes_applied,
+)
+
+async def sample_unliked_card(user_id: str, candidates: int = 5) -> Optional[dict]:
+    """A random stored card the user has not liked"""
+    cards = await db.cards.aggregate([
+        {"$sample": {"size": candidates}},
+        {"$project": CARD_PROJECTION},
+    ]).to_list(length=None)
+    liked = set(await db.likes.distinct(
+        "card_id", {"user_id": user_id, "card_id": {"$in": [card['id'] for card in cards]}}
+    ))
+    return next((card for card in cards if card['id'] not in liked), None)
+
+@api_router.get("/")
+async def root():
+    return {"message": "Pixel Card Collection Game API"}
+
+READINESS_TIMEOUT = float(os.environ.get('READINESS_TIMEOUT', '2'))
+
+@api_router.get("/health/live")
+async def liveness():
+    """The process is up; restart it if this stops answering"""
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def readiness(response: Response):
+    """Whether this worker should get traffic: started, not shutting down, and Mongo answers a ping"""
+    checks = {"started": app.state.ready, "leader": leader.is_leader}
+    try:
+        await asyncio.wait_for(mongo.ping(), timeout=READINESS_TIMEOUT)
+        checks["mongo"] = "ok"
+    except Exception as e:
+        checks["mongo"] = f"error: {str(e) or type(e).__name__}"
+    ready = app.state.ready and checks["mongo"] == "ok"
+    if not ready:
+        response.status_code = 503
+    return {"status": "ready" if ready else "unavailable", **checks}
+
+@api_router.get("/session")
+async def get_session(request: Request, user_id: str = Depends(current_user)):
+    """The caller's anonymous identity; send the token back in the X-Session-Token header"""
+    token = session_tokens.token_for(user_id)
+    # Refresh the cookie too: atlas sheets are fetched by the browser without the header
+    request.state.session_token = token
+    return {"user_id": user_id, "token": token}
+
+@api_router.post("/generate-card", response_model=CardResponse)
+async def generate_card(size: Optional[str] = None, user_id: str = Depends(current_user)):
+    check_image_size(size)
+    try:
+        # Serve a pre-generated card when the inventory has one
+        card_dict = await inventory.claim()
+
+        if card_dict is None:
+            # Inventory is empty, share a live generation with other waiting callers
+            card_dict = await coalescer.get()
+
+        return card_to_response(card_dict, size)
         
+    except GenerationUnavailable as e:
+        # The model failed or is unhealthy: re-serve a stored card rather than fail
+        logging.error(f"Error generating card: {str(e)}")
+        card_dict = await sample_unliked_card(user_id)
+        if card_dict is not None:
+            return card_to_response(card_dict, size)
+        status_code = 503 if isinstance(e, CircuitOpenError) else 504 if isinstance(e, GenerationTimeout) else 502
+        headers = {"Retry-After": str(int(image_gen.reset_timeout))} if isinstance(e, CircuitOpenError) else None
+        raise HTTPException(status_code=status_code, detail=str(e), headers=headers)
     except Exception as e:
         logging.error(f"Error generating card: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating card: {str(e)}")
 
-@api_router.get("/cards", response_model=List[CardResponse])
-async def get_cards(limit: int = 20):
+@api_router.get("/cards", response_model=CardPage, response_model_exclude_unset=True)
+async def get_cards(
+    request: Request,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    size: Optional[str] = None,
+    format: Optional[str] = None,
+):
+    """Newest cards first, paginated with the opaque next_cursor; streamed as JSON or NDJSON"""
+    check_image_size(size)
+    check_list_format(format)
+    requested_fields = parse_card_fields(fields)
+    limit = max(1, min(limit, 100))
+    try:
+        query = keyset_filter("created_at", "id", cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # The sort key is always loaded so the next cursor can be built
+    if requested_fields:
+        projection = {CARD_FIELDS[field]: 1 for field in requested_fields}
+        projection.update({"_id": 0, "id": 1, "created_at": 1})
+    else:
+        projection = CARD_PROJECTION
+
+    ndjson = wants_ndjson(request.headers.get('accept'), format)
+    media_type = NDJSON if ndjson else JSON
+
     try:
-        cards = await db.cards.find().sort("created_at", -1).limit(limit).to_list(length=None)
-        result = []
-        for card in cards:
-            if isinstance(card.get('created_at'), str):
-                card['created_at'] = datetime.fromisoformat(card['created_at'])
-            result.append(CardResponse(**card))
-        return result
+        # An unchanged card list is answered from one counter read
+        version, headers, current = await version_validators(request, CARDS_VERSION, ndjson)
+        if current:
+            return Response(status_code=304, headers=headers)
+        # Keyed by version too: writes in other processes never reach this process's invalidation,
+        # and a body cached at an older version must not go out under the current ETag
+        cache_key = (version, limit, cursor, tuple(requested_fields or ()), size, ndjson)
+        cached = response_cache.get("cards", cache_key)
+        if cached is not None:
+            return Response(cached, media_type=media_type, headers=headers)
+        generation = response_cache.generation("cards")
+
+        rows = db.cards.find(query, projection).sort(
+            [("created_at", -1), ("id", -1)]
+        ).limit(limit).batch_size(limit)
+        page = encode_page(
+            rows,
+            lambda card: card_to_item(card, size, requested_fields),
+            limit,
+            lambda card: encode_cursor(card['created_at'], card['id']),
+            ndjson=ndjson,
+        )
+        body = await start_stream(response_cache.record("cards", cache_key, generation, page))
+        return StreamingResponse(body, media_type=media_type, headers=headers)
     except Exception as e:
         logging.error(f"Error fetching cards: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching cards: {str(e)}")
 
+@api_router.get("/feed", response_model=CardFeed)
+async def get_feed(n: int = 5, size: Optional[str] = None):
+    """Claim up to n cards this client has not seen; the inventory refills behind it"""
+    check_image_size(size)
+    n = max(1, min(n, 50))
+    try:
+        cards = await inventory.claim_many(n, CARD_PROJECTION)
+        return CardFeed(cards=[card_to_response(card, size) for card in cards])
+    except Exception as e:
+        logging.error(f"Error fetching feed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching feed: {str(e)}")
+
+async def serve_blob(
+    key: str, content_type: str, request: Request, not_found: str, visibility: str = "public"
+) -> Response:
+    """Stream an immutable blob with ETag, conditional GET and single byte-range support"""
+    headers = {
+        "ETag": f'"{key}"',
+        "Cache-Control": f"{visibility}, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+    }
+
+    # Content-addressed, so a matching ETag means the bytes are unchanged
+    if_none_match = request.headers.get('if-none-match', '')
+    if key in if_none_match or if_none_match.strip() == '*':
+        return Response(status_code=304, headers=headers)
+
+    length = await image_store.size(key)
+    if length is None:
+        raise HTTPException(status_code=404, detail=not_found)
+
+    try:
+        byte_range = parse_range(request.headers.get('range'), length)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{length}"})
+
+    if byte_range is None:
+        headers["Content-Length"] = str(length)
+        return StreamingResponse(image_store.stream(key), media_type=content_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        image_store.stream(key, byte_range), status_code=206, media_type=content_type, headers=headers
+    )
+
+@api_router.get("/cards/{card_id}/image")
+async def get_card_image(card_id: str, request: Request, size: str = ORIGINAL):
+    check_image_size(size)
+    card = await db.cards.find_one(
+        {"id": card_id}, {"_id": 0, "image_sha256": 1, "image_content_type": 1, "image_variants": 1}
+    )
+    if card is None or not card.get('image_sha256'):
+        raise HTTPException(status_code=404, detail="Card image not found")
+
+    # Cards rendered before a variant existed fall back to the original
+    variant = card.get('image_variants', {}).get(size)
+    if variant:
+        key, content_type = variant['sha256'], variant['content_type']
+    else:
+        key, content_type = card['image_sha256'], card.get('image_content_type', 'image/png')
+    return await serve_blob(key, content_type, request, "Card image not found")
+
 @api_router.post("/like-card")
-async def like_card(request: LikeCardRequest):
+async def like_card(request: LikeCardRequest, user_id: str = Depends(current_user)):
     try:
-        # Update card's like status
-        await db.cards.update_one(
-            {"id": request.card_id},
-            {"$set": {"is_liked": request.liked}}
-        )
-        
-        if request.liked:
-            # Add to user collection
-            collection_item = UserCollection(card_id=request.card_id)
-            collection_dict = collection_item.dict()
-            collection_dict['liked_at'] = collection_dict['liked_at'].isoformat()
-            await db.collections.insert_one(collection_dict)
-        else:
-            # Remove from user collection
-            await db.collections.delete_many({"card_id": request.card_id})
-        
+        await swipe_writer.apply([SwipeEvent(card_id=request.card_id, liked=request.liked, user_id=user_id)])
         return {"message": "Card updated successfully"}
         
     except Exception as e:
         logging.error(f"Error updating card: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error updating card: {str(e)}")
 
-@api_router.get("/collection", response_model=List[CardResponse])
-async def get_user_collection():
+@api_router.post("/swipes", status_code=202)
+async def record_swipes(batch: SwipeBatch, wait: bool = False, user_id: str = Depends(current_user)):
+    """Accept a batch of the caller's like/pass events; duplicates by event_id are ignored"""
+    for event in batch.events:
+        event.user_id = user_id
     try:
-        # Get all liked cards from collection
-        collection_items = await db.collections.find().sort("liked_at", -1).to_list(length=None)
-        card_ids = [item["card_id"] for item in collection_items]
+        if wait:
+            applied = await swipe_writer.apply(batch.events)
+            return {"accepted": len(batch.events), "applied": applied}
         
-        if not card_ids:
-            return []
+        swipe_writer.submit(batch.events)
+        return {"accepted": len(batch.events)}
         
-        # Fetch the actual cards
-        cards = await db.cards.find({"id": {"$in": card_ids}, "is_liked": True}).to_list(length=None)
-        result = []
-        for card in cards:
-            if isinstance(card.get('created_at'), str):
-                card['created_at'] = datetime.fromisoformat(card['created_at'])
-            result.append(CardResponse(**card))
-        return result
+    except Exception as e:
+        logging.error(f"Error recording swipes: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error recording swipes: {str(e)}")
+
+@api_router.get("/collection", response_model=CollectionPage)
+async def get_user_collection(
+    request: Request,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    size: Optional[str] = None,
+    format: Optional[str] = None,
+    user_id: str = Depends(current_user),
+):
+    """The caller's liked cards, most recently liked first, in one aggregation per page; streamed as JSON or NDJSON"""
+    check_image_size(size)
+    check_list_format(format)
+    limit = max(1, min(limit, 200))
+    try:
+        match = {"user_id": user_id, **keyset_filter("liked_at", "id", cursor)}
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    ndjson = wants_ndjson(request.headers.get('accept'), format)
+    media_type = NDJSON if ndjson else JSON
+    namespace = collection_namespace(user_id)
+
+    # Rows whose card is gone still advance the cursor, they just aren't returned
+    def row_to_item(row: dict) -> Optional[dict]:
+        card = row.get('card')
+        if not card:
+            return None
+        card['liked_at'] = row['liked_at']
+        return card_to_item(card, size)
+
+    try:
+        version, headers, current = await version_validators(
+            request, user_counter(COLLECTION_VERSION, user_id), user_id, ndjson, cache_control="private, no-cache"
+        )
+        if current:
+            return Response(status_code=304, headers=headers)
+        # Versioned like the card list, since likes may be applied by another process's swipe writer
+        cache_key = (version, limit, cursor, size, ndjson)
+        cached = response_cache.get(namespace, cache_key)
+        if cached is not None:
+            return Response(cached, media_type=media_type, headers=headers)
+        generation = response_cache.generation(namespace)
+
+        total = await seed_counter(
+            db, user_counter(COLLECTION_SIZE, user_id), lambda: db.likes.count_documents({"user_id": user_id})
+        )
+        rows = db.likes.aggregate([
+            {"$match": match},
+            {"$sort": {"liked_at": -1, "id": -1}},
+            {"$limit": limit},
+            {"$lookup": {"from": "cards", "localField": "card_id", "foreignField": "id", "as": "card"}},
+            {"$unwind": {"path": "$card", "preserveNullAndEmptyArrays": True}},
+            {"$project": {"_id": 0, "id": 1, "liked_at": 1, "card": 1}},
+            {"$project": {"card._id": 0, "card.image_base64": 0}},
+        ], batchSize=limit)
+        page = encode_page(
+            rows,
+            row_to_item,
+            limit,
+            lambda row: encode_cursor(row['liked_at'], row['id']),
+            extra={"total": total},
+            ndjson=ndjson,
+        )
+        body = await start_stream(response_cache.record(namespace, cache_key, generation, page))
+        return StreamingResponse(body, media_type=media_type, headers=headers)
         
     except Exception as e:
         logging.error(f"Error fetching collection: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching collection: {str(e)}")
 
+@api_router.get("/collection/atlas", response_model=CollectionAtlasPage, response_model_exclude_unset=True)
+async def get_collection_atlas(
+    request: Request,
+    response: Response,
+    page: int = 0,
+    size: Optional[int] = None,
+    user_id: str = Depends(current_user),
+):
+    """One page of the caller's collection as a thumbnail sprite sheet plus the coordinates of each card"""
+    if size is None:
+        size = 128 if 128 in derivatives.sizes else max(derivatives.sizes)
+    if size not in derivatives.sizes:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown atlas size {size}, expected one of: {', '.join(map(str, derivatives.sizes))}"
+        )
+    if page < 0:
+        raise HTTPException(status_code=400, detail="page must not be negative")
+
+    try:
+        version, headers, current = await version_validators(
+            request, user_counter(COLLECTION_VERSION, user_id), user_id, cache_control="private, no-cache"
+        )
+        if current:
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        total = await seed_counter(
+            db, user_counter(COLLECTION_SIZE, user_id), lambda: db.likes.count_documents({"user_id": user_id})
+        )
+        atlas = await collection_atlas.get(user_id, version, page, size)
+        return CollectionAtlasPage(
+            sheet_url=f"/api/collection/atlas/{atlas['sheet_sha256']}.png" if atlas['sheet_sha256'] else None,
+            width=atlas['width'],
+            height=atlas['height'],
+            size=size,
+            page=page,
+            pages=-(-total // collection_atlas.per_page),
+            total=total,
+            version=version,
+            cards=[AtlasCard(**card_to_item(card), **{k: card[k] for k in ('x', 'y', 'w', 'h') if k in card})
+                   for card in atlas['cards']],
+        )
+    except Exception as e:
+        logging.error(f"Error building collection atlas: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error building collection atlas: {str(e)}")
+
+@api_router.get("/collection/atlas/{key}.png")
+async def get_collection_atlas_sheet(key: str, request: Request):
+    """Sprite sheet bytes of one of the caller's atlases; content-addressed, so cached forever"""
+    # Sheets load as CSS backgrounds, which only carry the session cookie
+    user_id = session_user(request)
+    try:
+        image_store.path(key)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Atlas sheet not found")
+    try:
+        atlas = user_id and await db.atlases.find_one({"user_id": user_id, "sheet_sha256": key}, {"_id": 1})
+    except Exception as e:
+        logging.error(f"Error fetching atlas sheet: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching atlas sheet: {str(e)}")
+    if not atlas:
+        raise HTTPException(status_code=404, detail="Atlas sheet not found")
+    return await serve_blob(key, "image/png", request, "Atlas sheet not found", visibility="private")
+
+def pre_generate_prompts(count: int) -> List[str]:
+    return [PIXEL_ART_PROMPTS[i % len(PIXEL_ART_PROMPTS)] for i in range(count)]
+
+async def submit_job(prompts: List[Optional[str]]) -> Job:
+    if not 1 <= len(prompts) <= MAX_JOB_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A job needs between 1 and {MAX_JOB_ITEMS} cards")
+    try:
+        return await job_queue.submit(prompts)
+    except Exception as e:
+        logging.error(f"Error submitting job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error submitting job: {str(e)}")
+
+# Archives are spooled to disk before import; larger uploads are refused
+IMPORT_MAX_BYTES = int(os.environ.get('IMPORT_MAX_BYTES', str(2 * 1024 ** 3)))
+
+@api_router.get("/collection/export")
+async def export_collection(format: str = "tar", user_id: str = Depends(current_user)):
+    """Stream the caller's collection as a tar or zip of images plus NDJSON manifests"""
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown archive format '{format}', expected tar or zip")
+    return StreamingResponse(
+        export_archive(db, image_store, user_id, format),
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="collection.{format}"'},
+    )
+
+@api_router.post("/collection/import")
+async def import_collection(request: Request, user_id: str = Depends(current_user)):
+    """Add the cards of an exported archive (the request body) that are still stored to the caller's collection"""
+    importer = ArchiveImporter(db, image_store, user_id, insert_cards=False)
+    with tempfile.TemporaryDirectory(prefix="import-") as spool:
+        path = Path(spool) / "archive"
+        received = 0
+        with open(path, "wb") as f:
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > IMPORT_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Archive is larger than {IMPORT_MAX_BYTES} bytes")
+                await asyncio.to_thread(f.write, chunk)
+
+        try:
+            return await importer.run(path)
+        except InvalidArchive as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logging.error(f"Error importing collection: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error importing collection: {str(e)}")
+        finally:
+            # Batches committed before a failure stay imported
+            if importer.report["liked"]:
+                response_cache.invalidate(collection_namespace(user_id))
+
 @api_router.post("/pre-generate-cards")
-async def pre_generate_cards(count: int = 5):
-    """Pre-generate a batch of cards"""
-    try:
-        generated_cards = []
-        for i in range(count):
-            prompt = PIXEL_ART_PROMPTS[i % len(PIXEL_ART_PROMPTS)]
-            
-            # Generate image
-            images = await image_gen.generate_images(
-                prompt=prompt,
-                model="gpt-image-1",
-                number_of_images=1
-            )
-            
-            if images and len(images) > 0:
-                image_base64 = base64.b64encode(images[0]).decode('utf-8')
-                card = Card(image_base64=image_base64, prompt=prompt)
-                
-                # Save to database
-                card_dict = card.dict()
-                card_dict['created_at'] = card_dict['created_at'].isoformat()
-                await db.cards.insert_one(card_dict)
-                generated_cards.append(card.id)
+async def pre_generate_cards(
+    response: Response, count: int = 5, concurrency: Optional[int] = None, background: bool = False
+):
+    """Pre-generate a batch of cards, or queue them as a job with background=true"""
+    if background:
+        job = await submit_job(pre_generate_prompts(count))
+        response.status_code = 202
+        return {"message": f"Queued {job.requested} cards", "job_id": job.id}
+
+    try:
+        prompts = pre_generate_prompts(count)
+        result: BatchResult = await batch_generator.run(prompts, concurrency=concurrency)
         
-        return {"message": f"Generated {len(generated_cards)} cards", "card_ids": generated_cards}
+        return {
+            "message": f"Generated {len(result.card_ids)} of {result.requested} cards",
+            "card_ids": result.card_ids,
+            "failures": [failure.dict() for failure in result.failures],
+        }
         
     except Exception as e:
         logging.error(f"Error pre-generating cards: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error pre-generating cards: {str(e)}")
 
+@api_router.post("/jobs", response_model=Job, status_code=202)
+async def create_job(request: JobRequest):
+    """Queue a bulk generation job; poll GET /api/jobs/{id} for progress"""
+    return await submit_job(request.prompts or pre_generate_prompts(request.count))
+
+@api_router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str):
+    try:
+        return await job_queue.get(job_id)
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail="Job not found")
+    except Exception as e:
+        logging.error(f"Error fetching job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching job: {str(e)}")
+
+@api_router.post("/jobs/{job_id}/cancel", response_model=Job)
+async def cancel_job(job_id: str):
+    """Stop a job from starting more cards; cards already generating still finish"""
+    try:
+        return await job_queue.cancel(job_id)
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail="Job not found")
+    except Exception as e:
+        logging.error(f"Error cancelling job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error cancelling job: {str(e)}")
+
+@api_router.get("/inventory")
+async def get_inventory_stats():
+    """Report ready-card inventory depth, refill rate and live generation load"""
+    try:
+        return {
+            **await inventory.stats(),
+            "generation": coalescer.stats(),
+            "model": image_gen.stats(),
+            "cache": generation_cache.stats(),
+            "dedup": near_duplicates.stats(),
+        }
+    except Exception as e:
+        logging.error(f"Error fetching inventory stats: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching inventory stats: {str(e)}")
+
+@api_router.get("/storage")
+async def get_storage_stats():
+    """Report cards evicted and trimmed, images recompressed and bytes reclaimed"""
+    return storage_lifecycle.stats()
+
+@api_router.post("/storage/sweep")
+async def run_storage_sweep():
+    """Apply the retention and unserved-inventory policies now and report what was reclaimed"""
+    try:
+        return await storage_lifecycle.sweep()
+    except Exception as e:
+        logging.error(f"Error sweeping storage: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error sweeping storage: {str(e)}")
+
+@api_router.get("/events")
+async def stream_events(request: Request):
+    """Server-Sent Events: `card` when a card is stored, `like`/`unlike` when one of the caller's swipes commits"""
+    return StreamingResponse(
+        event_bus.stream(
+            request.headers.get('last-event-id'), keepalive=EVENT_KEEPALIVE, max_age=EVENT_STREAM_MAX_AGE, user_id=session_user(request)
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of request, model, Mongo and inventory metrics"""
+    try:
+        INVENTORY_DEPTH.set(value=await inventory.depth())
+    except Exception as e:
+        logging.error(f"Error measuring inventory depth: {str(e)}")
+    return Response(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Innermost, so the metrics see the bytes actually sent
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')),
+    offload_size=int(os.environ.get('COMPRESSION_OFFLOAD_SIZE', '65536')),
+    gzip_level=int(os.environ.get('GZIP_LEVEL', '6')),
+    brotli_quality=int(os.environ.get('BROTLI_QUALITY', '4')),
+)
+
+app.add_middleware(MetricsMiddleware)
+
+app.add_middleware(SessionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[SESSION_HEADER],
 )
 
+# Component counters exported on /api/metrics
+REGISTRY.stats("card_inventory", "Card inventory refill counters", lambda: {
+    "generated_total": inventory.generated_total,
+    "served_total": inventory.served_total,
+    "misses_total": inventory.misses_total,
+    "failures_total": inventory.failures_total,
+    "refill_rate_per_minute": inventory.refill_rate(),
+})
+REGISTRY.stats("generation_coalescer", "Live generation coalescing counters", coalescer.stats)
+REGISTRY.stats("image_model", "Image model concurrency and circuit breaker", image_gen.stats)
+REGISTRY.stats("swipe_writer", "Swipe write-behind counters", swipe_writer.stats)
+REGISTRY.stats("job_queue", "Durable bulk generation workers", job_queue.stats)
+REGISTRY.stats("event_bus", "Live event stream fan-out", event_bus.stats)
+REGISTRY.stats("event_relay", "Events shared between processes through Mongo", event_relay.stats)
+REGISTRY.stats("response_cache", "Serialized card and collection pages", response_cache.stats)
+REGISTRY.stats("generation_cache", "Prompt-keyed reuse of prior outputs", generation_cache.stats)
+REGISTRY.stats("collection_atlas", "Collection sprite sheet builds", collection_atlas.stats)
+REGISTRY.stats("near_duplicates", "Perceptual-hash near-duplicate checks", near_duplicates.stats)
+REGISTRY.stats("storage", "Card retention, eviction and image recompression", storage_lifecycle.stats)
+REGISTRY.stats("leader_election", "Singleton background task lease", leader.stats)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -240,6 +1076,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def start_background_tasks():
+    await ensure_indexes(db)
+    await session_tokens.load_shared_secret(db.settings)
+    swipe_writer.start()
+    if EVENT_RELAY:
+        event_relay.start()
+    if JOB_WORKERS_IN_PROCESS:
+        job_queue.start()
+    if LEADER_ELECTION:
+        leader.start()
+    else:
+        await start_singleton_tasks()
+    app.state.ready = True
+
+async def stop_background_tasks():
+    # Fail readiness first so load balancers stop sending new requests
+    app.state.ready = False
+    event_bus.close()
+    if LEADER_ELECTION:
+        await leader.stop()
+    else:
+        await stop_singleton_tasks()
+    await job_queue.stop()
+    await swipe_writer.stop()
+    await event_relay.stop()
+    if background_tasks:
+        await asyncio.wait(set(background_tasks), timeout=5)
+    derivatives.shutdown()
+    mongo.close()
\ No newline at end of file
@@ -0,0 +1,102 @@
+import base64
+import hashlib
+import hmac
+import logging
+import secrets
+import uuid
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+SESSION_HEADER = "X-Session-Token"
+SESSION_COOKIE = "session"
+SESSION_MAX_AGE = 365 * 24 * 3600
+
+
+class SessionTokens:
+    """Anonymous identities as signed tokens: ``<user id>.<HMAC of the id>``.
+
+    Verifying a token is one HMAC, so requests never look a session up in
+    Mongo and a user exists from the moment their first token is issued.
+    Tokens stay valid for as long as ``secret`` does. Without one, every
+    worker must call ``load_shared_secret`` before serving requests: a random
+    secret is generated once and kept in Mongo, so tokens match across
+    workers and restarts.
+    """
+
+    def __init__(self, secret: Optional[str] = None):
+        self._key = secret.encode() if secret else None
+
+    async def load_shared_secret(self, collection, name: str = "session_secret"):
+        """Use the secret stored under ``name``, generating it on first use; no-op with a configured secret."""
+        if self._key is not None:
+            return
+        try:
+            document = await collection.find_one_and_update(
+                {"_id": name},
+                {"$setOnInsert": {"value": secrets.token_hex(32), "created_at": datetime.now(timezone.utc)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Another worker generated it at the same moment
+            document = await collection.find_one({"_id": name})
+        logger.warning("SESSION_SECRET is not set; signing sessions with the secret generated in Mongo")
+        self._key = document["value"].encode()
+
+    def _sign(self, user_id: str) -> str:
+        if self._key is None:
+            raise RuntimeError("Session secret not loaded; set SESSION_SECRET or call load_shared_secret")
+        digest = hmac.new(self._key, user_id.encode(), hashlib.sha256).digest()[:16]
+        return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+    def token_for(self, user_id: str) -> str:
+        return f"{user_id}.{self._sign(user_id)}"
+
+    def issue(self) -> Tuple[str, str]:
+        """Start a new anonymous session; returns ``(user_id, token)``."""
+        user_id = str(uuid.uuid4())
+        return user_id, self.token_for(user_id)
+
+    def verify(self, token: Optional[str]) -> Optional[str]:
+        """User id of a valid token, or None."""
+        if not token:
+            return None
+        user_id, _, signature = token.rpartition(".")
+        if not user_id or not hmac.compare_digest(signature, self._sign(user_id)):
+            return None
+        return user_id
+
+
+class SessionMiddleware:
+    """ASGI middleware handing out tokens of sessions started during a request.
+
+    An endpoint that needs a user and finds no valid token issues one and
+    leaves it in ``request.state.session_token``; it is returned in the
+    ``X-Session-Token`` header and a cookie, whatever kind of response the
+    endpoint produced (including streamed ones).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            token = scope.get("state", {}).get("session_token")
+            if message["type"] == "http.response.start" and token:
+                cookie = f"{SESSION_COOKIE}={token}; Max-Age={SESSION_MAX_AGE}; Path=/; HttpOnly; SameSite=Lax"
+                message["headers"] = list(message.get("headers", [])) + [
+                    (SESSION_HEADER.lower().encode(), token.encode()),
+                    (b"set-cookie", cookie.encode()),
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
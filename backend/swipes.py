@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+
+from pydantic import BaseModel, Field
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from counters import COLLECTION_SIZE, COLLECTION_VERSION, increment_counters, user_counter
+from tasks import cancel_and_wait
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+class SwipeEvent(BaseModel):
+    event_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    card_id: str
+    liked: bool
+    # Set by the server from the caller's session
+    user_id: Optional[str] = None
+
+
+class SwipeBatch(BaseModel):
+    events: List[SwipeEvent]
+
+
+def event_key(event: SwipeEvent) -> dict:
+    # Event ids come from clients, so they are only unique per user
+    return {"user_id": event.user_id, "event_id": event.event_id}
+
+
+class SwipeWriter:
+    """Applies like/pass swipes to the per-user ``likes`` collection.
+
+    Applied events are recorded in ``swipe_events`` under their user and
+    client event id, so retried or double-tapped events are dropped; one
+    client can't suppress another's swipes by reusing its event ids. The surviving events
+    are coalesced to the last swipe per user and card and applied with one
+    ``bulk_write``; likes upsert on the unique ``(user_id, card_id)`` index,
+    so replays can never duplicate a collection row. Card documents are
+    never written, so popular cards are not a write hotspot.
+
+    ``submit`` is write-behind: events are buffered and flushed at most
+    ``max_delay`` seconds after the first one arrives, or as soon as
+    ``max_batch`` events are waiting. Once a batch is committed,
+    ``on_applied`` is called with the last swipe of each user on each card.
+    """
+
+    def __init__(
+        self,
+        db,
+        max_delay: float = 0.25,
+        max_batch: int = 500,
+        on_applied: Optional[Callable[[List[SwipeEvent]], None]] = None,
+    ):
+        self.db = db
+        self.max_delay = max_delay
+        self.max_batch = max(1, max_batch)
+        self.on_applied = on_applied
+
+        self.flushes_total = 0
+        self.applied_total = 0
+        self.duplicates_total = 0
+        self._pending: List[SwipeEvent] = []
+        self._has_pending = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        await cancel_and_wait(self._task)
+        self._task = None
+        # Don't lose swipes that were acknowledged but not yet written
+        await self.flush()
+
+    def submit(self, events: List[SwipeEvent]):
+        self._pending.extend(events)
+        self._has_pending.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+
+    async def flush(self):
+        events, self._pending = self._pending, []
+        self._has_pending.clear()
+        self._full.clear()
+        if not events:
+            return
+        try:
+            await self.apply(events)
+        except Exception:
+            # Put the events back in front of anything that arrived meanwhile
+            self._pending[:0] = events
+            self._has_pending.set()
+            raise
+
+    async def apply(self, events: List[SwipeEvent]) -> int:
+        """Write events now; returns how many were new (not replays)."""
+        events = await self._drop_replayed(events)
+        if not events:
+            return 0
+
+        # Only each user's last swipe on each card matters
+        latest = {}
+        for event in events:
+            latest[(event.user_id, event.card_id)] = event
+        likes = [event for event in latest.values() if event.liked]
+        passes = [event for event in latest.values() if not event.liked]
+
+        now = datetime.now(timezone.utc)
+        ops = [
+            UpdateOne(
+                {"user_id": event.user_id, "card_id": event.card_id},
+                {"$setOnInsert": {"id": str(uuid.uuid4()), "user_id": event.user_id,
+                                  "card_id": event.card_id, "liked_at": now}},
+                upsert=True,
+            )
+            for event in likes
+        ]
+        # Most swipes are passes of cards never liked; only delete likes that
+        # exist, which also tells whose collection shrank
+        unliked = []
+        if passes:
+            unliked = await self.db.likes.find(
+                {"$or": [{"user_id": event.user_id, "card_id": event.card_id} for event in passes]},
+                {"_id": 0, "user_id": 1, "card_id": 1},
+            ).to_list(length=None)
+            ops += [DeleteOne(row) for row in unliked]
+
+        if ops:
+            result = await self.db.likes.bulk_write(ops, ordered=False)
+            deltas = defaultdict(int)
+            for index in result.upserted_ids:
+                deltas[user_counter(COLLECTION_SIZE, likes[index].user_id)] += 1
+            for row in unliked:
+                deltas[user_counter(COLLECTION_SIZE, row["user_id"])] -= 1
+            changed = {likes[index].user_id for index in result.upserted_ids} | {row["user_id"] for row in unliked}
+            if result.deleted_count != len(unliked):
+                # A concurrent writer removed some of these likes first
+                recount = {row["user_id"] for row in unliked}
+                await self._recount(recount)
+                for user_id in recount:
+                    deltas.pop(user_counter(COLLECTION_SIZE, user_id), None)
+            for user_id in changed:
+                deltas[user_counter(COLLECTION_VERSION, user_id)] += 1
+            await increment_counters(self.db, deltas)
+
+        # Event ids are recorded last, so a failed write can be retried in full
+        await self._record(events)
+        self.flushes_total += 1
+        self.applied_total += len(events)
+        if self.on_applied:
+            self.on_applied(list(latest.values()))
+        return len(events)
+
+    async def _recount(self, user_ids):
+        for user_id in user_ids:
+            size = await self.db.likes.count_documents({"user_id": user_id})
+            await self.db.counters.update_one(
+                {"_id": user_counter(COLLECTION_SIZE, user_id)}, {"$set": {"value": size}}, upsert=True
+            )
+
+    async def _drop_replayed(self, events: List[SwipeEvent]) -> List[SwipeEvent]:
+        unique = list({(event.user_id, event.event_id): event for event in events}.values())
+        seen = await self.db.swipe_events.distinct(
+            "_id", {"_id": {"$in": [event_key(event) for event in unique]}}
+        )
+        seen = {(key["user_id"], key["event_id"]) for key in seen}
+        fresh = [event for event in unique if (event.user_id, event.event_id) not in seen]
+        self.duplicates_total += len(events) - len(fresh)
+        return fresh
+
+    async def _record(self, events: List[SwipeEvent]):
+        now = datetime.now(timezone.utc)
+        docs = [
+            {"_id": event_key(event), "user_id": event.user_id, "card_id": event.card_id,
+             "liked": event.liked, "received_at": now}
+            for event in events
+        ]
+        try:
+            await self.db.swipe_events.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Another worker recorded the same event concurrently; the writes
+            # above are idempotent, so only unexpected errors matter.
+            if any(error["code"] != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                raise
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "flushes_total": self.flushes_total,
+            "applied_total": self.applied_total,
+            "duplicates_total": self.duplicates_total,
+        }
+
+    async def _run(self):
+        while True:
+            await self._has_pending.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error flushing swipes: {str(e)}")
+                await asyncio.sleep(self.max_delay)
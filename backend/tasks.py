@@ -0,0 +1,17 @@
+import asyncio
+from typing import Optional
+
+
+async def cancel_and_wait(*tasks: Optional[asyncio.Task], interval: float = 0.1):
+    """Cancel ``tasks`` and return once every one of them is done.
+
+    ``asyncio.wait_for`` can swallow a cancellation that races with the call
+    it wraps finishing, so a single ``cancel()`` may leave a background loop
+    running; tasks are cancelled again every ``interval`` seconds until they
+    finish. ``None`` entries are skipped, for tasks that were never started.
+    """
+    pending = {task for task in tasks if task is not None}
+    while pending:
+        for task in pending:
+            task.cancel()
+        _, pending = await asyncio.wait(pending, timeout=interval)
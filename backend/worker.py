@@ -0,0 +1,46 @@
+"""Standalone job worker for bulk card generation.
+
+Run from the backend directory with the same environment as the server:
+
+    python -m worker
+
+Start as many as needed, on any host that can reach MongoDB and the image
+store; they share jobs through leases in the job_items collection. Set
+JOB_WORKERS_IN_PROCESS=false on the API servers to leave all jobs to them.
+"""
+import asyncio
+import logging
+import signal
+
+from indexes import ensure_indexes
+
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    # Imported here so image pool processes, which re-import this module, skip the app
+    from server import EVENT_RELAY, db, derivatives, event_relay, job_queue, mongo
+
+    await ensure_indexes(db)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    if EVENT_RELAY:
+        # Cards generated here reach the API servers' event streams
+        event_relay.start(receive=False)
+    job_queue.start()
+    logger.info(f"Job worker {job_queue.worker_id} running {job_queue.concurrency} slots")
+    try:
+        await stopping.wait()
+    finally:
+        logger.info("Job worker stopping")
+        await job_queue.stop()
+        await event_relay.stop()
+        derivatives.shutdown()
+        mongo.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
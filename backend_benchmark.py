@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Offline Load Benchmark for Pixel Card Collection Game
+Boots the FastAPI app in-process against a fake image model and an in-memory
+Mongo stand-in, drives concurrent load at the main endpoints and reports
+throughput and latency percentiles, optionally against a saved baseline.
+
+    python backend_benchmark.py --duration 10 --concurrency 32
+    python backend_benchmark.py --save-baseline
+    python backend_benchmark.py --baseline benchmark_baseline.json
+
+Pass --mongo-url to run against a real MongoDB instead of the stand-in.
+Load is spread over --users anonymous sessions, each seeded with
+--likes-per-user likes; the full-scale run is
+
+    python backend_benchmark.py --users 100000 --likes-per-user 100 --mongo-url mongodb://localhost
+
+The stand-in scans collections linearly, so keep it to a few hundred
+thousand likes there.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+from PIL import Image
+
+ROOT_DIR = Path(__file__).parent
+BACKEND_DIR = ROOT_DIR / "backend"
+DEFAULT_BASELINE = ROOT_DIR / "benchmark_baseline.json"
+SCENARIOS = ["generate", "cards", "feed", "like", "collection"]
+
+
+class FakeImageGeneration:
+    """Stands in for OpenAIImageGeneration with tunable latency and failures"""
+
+    def __init__(self, latency=0.05, jitter=0.5, failure_rate=0.0, size=256):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.size = size
+        self.calls = 0
+
+    async def generate_images(self, prompt, model, number_of_images=1):
+        self.calls += 1
+        await asyncio.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+        if random.random() < self.failure_rate:
+            raise RuntimeError("Fake image model failure")
+        return [self._render() for _ in range(number_of_images)]
+
+    def _render(self):
+        # A few random blocks so images (and their hashes) differ
+        image = Image.new("RGB", (self.size, self.size), tuple(random.randrange(256) for _ in range(3)))
+        block = self.size // 8
+        for _ in range(8):
+            x, y = random.randrange(8) * block, random.randrange(8) * block
+            image.paste(tuple(random.randrange(256) for _ in range(3)), (x, y, x + block, y + block))
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG")
+        return buffer.getvalue()
+
+
+def load_server(args, image_store_dir):
+    """Import backend/server.py configured for an offline run"""
+    os.environ.setdefault("DB_NAME", "pixel_card_benchmark")
+    os.environ["IMAGE_STORE_DIR"] = str(image_store_dir)
+    os.environ.setdefault("INVENTORY_LOW_WATERMARK", str(args.inventory_low))
+    os.environ.setdefault("INVENTORY_HIGH_WATERMARK", str(args.inventory_high))
+    os.environ.setdefault("INVENTORY_POLL_INTERVAL", "1")
+    os.environ.setdefault("BATCH_BACKOFF_BASE", "0.05")
+    # One process has no peers to relay events to; mongomock can't tail a capped collection anyway
+    os.environ.setdefault("EVENT_RELAY", "false")
+
+    if args.mongo_url:
+        os.environ["MONGO_URL"] = args.mongo_url
+    else:
+        # The stand-in has to be swapped in before server.py creates its client
+        import motor.motor_asyncio
+        from mongomock_motor import AsyncMongoMockClient
+        motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+        os.environ["MONGO_URL"] = "mongodb://benchmark"
+
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    server.image_model.inner = FakeImageGeneration(
+        latency=args.gen_latency, failure_rate=args.gen_failure_rate
+    )
+    return server
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class LoadRunner:
+    def __init__(self, client, concurrency, duration):
+        self.client = client
+        self.concurrency = concurrency
+        self.duration = duration
+        self.card_ids = []
+        self.sessions = []
+
+    async def seed(self, server, count):
+        """Store cards and likes so read endpoints have data to return"""
+        prompts = [None] * count
+        result = await server.batch_generator.run(prompts)
+        self.card_ids = list(result.card_ids)
+
+    async def seed_users(self, server, users, likes_per_user, chunk=10000):
+        """Insert likes straight into Mongo; far faster than swiping them in"""
+        from counters import COLLECTION_SIZE, user_counter
+        likes_per_user = min(likes_per_user, len(self.card_ids))
+        self.sessions = [server.session_tokens.token_for(f"benchmark-{i}") for i in range(users)]
+        now = time.time()
+        likes, counters = [], []
+        for i in range(users):
+            user_id = f"benchmark-{i}"
+            for card_id in random.sample(self.card_ids, likes_per_user):
+                likes.append({
+                    "id": str(uuid.uuid4()), "user_id": user_id, "card_id": card_id,
+                    "liked_at": datetime.fromtimestamp(now - random.uniform(0, 86400), timezone.utc),
+                })
+            counters.append({"_id": user_counter(COLLECTION_SIZE, user_id), "value": likes_per_user})
+            if len(likes) >= chunk:
+                await server.db.likes.insert_many(likes, ordered=False)
+                likes = []
+        if likes:
+            await server.db.likes.insert_many(likes, ordered=False)
+        for start in range(0, len(counters), chunk):
+            await server.db.counters.insert_many(counters[start:start + chunk], ordered=False)
+
+    def session_headers(self):
+        return {"X-Session-Token": random.choice(self.sessions)} if self.sessions else None
+
+    def request_for(self, scenario):
+        headers = self.session_headers()
+        if scenario == "generate":
+            return self.client.post("/api/generate-card", headers=headers)
+        if scenario == "cards":
+            return self.client.get("/api/cards", params={"limit": 20})
+        if scenario == "feed":
+            return self.client.get("/api/feed", params={"n": 5})
+        if scenario == "like":
+            event = {"event_id": str(uuid.uuid4()), "card_id": random.choice(self.card_ids),
+                     "liked": random.random() < 0.5}
+            return self.client.post("/api/swipes?wait=true", json={"events": [event]}, headers=headers)
+        if scenario == "collection":
+            return self.client.get("/api/collection", params={"limit": 50}, headers=headers)
+        raise ValueError(f"Unknown scenario {scenario}")
+
+    async def run(self, scenario):
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + self.duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await self.request_for(scenario)
+                    ok = response.status_code < 400
+                except Exception:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                if not ok:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        }
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of human-readable regressions against the baseline"""
+    regressions = []
+    for scenario, current in results.items():
+        previous = baseline.get(scenario)
+        if not previous:
+            continue
+        if current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{scenario}: throughput {current['rps']} rps < baseline {previous['rps']} rps")
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{scenario}: p95 {current['p95_ms']} ms > baseline {previous['p95_ms']} ms")
+        previous_error_rate = previous["errors"] / max(1, previous["requests"])
+        if current["errors"] / max(1, current["requests"]) > previous_error_rate + tolerance / 10:
+            regressions.append(f"{scenario}: error rate rose to {current['errors']}/{current['requests']}")
+    return regressions
+
+
+def print_report(results):
+    print(f"{'scenario':<12}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    print("-" * 70)
+    for scenario, r in results.items():
+        print(f"{scenario:<12}{r['requests']:>10}{r['errors']:>8}{r['rps']:>10}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory(prefix="pixel-card-bench-") as image_store_dir:
+        server = load_server(args, image_store_dir)
+        transport = httpx.ASGITransport(app=server.app)
+        async with server.app.router.lifespan_context(server.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=120) as client:
+                runner = LoadRunner(client, args.concurrency, args.duration)
+                print(f"🌱 Seeding {args.seed_cards} cards...")
+                await runner.seed(server, args.seed_cards)
+                print(f"👥 Seeding {args.users} users with {args.likes_per_user} likes each...")
+                await runner.seed_users(server, args.users, args.likes_per_user)
+
+                results = {}
+                for scenario in args.scenarios:
+                    print(f"🚀 {scenario}: {args.concurrency} workers for {args.duration}s")
+                    results[scenario] = await runner.run(scenario)
+
+    print()
+    print_report(results)
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"\n💾 Saved baseline to {args.baseline}")
+        return 0
+
+    if args.baseline.exists():
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        if regressions:
+            print("\n❌ Regressions against baseline:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print(f"\n✅ No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline load benchmark for the card API")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed-cards", type=int, default=200)
+    parser.add_argument("--users", type=int, default=100, help="sessions the load is spread over")
+    parser.add_argument("--likes-per-user", type=int, default=20)
+    parser.add_argument("--gen-latency", type=float, default=0.05, help="fake model latency in seconds")
+    parser.add_argument("--gen-failure-rate", type=float, default=0.0)
+    parser.add_argument("--inventory-low", type=int, default=5)
+    parser.add_argument("--inventory-high", type=int, default=15)
+    parser.add_argument("--mongo-url", help="use a real MongoDB instead of the in-memory stand-in")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    exit(asyncio.run(main(parse_args())))
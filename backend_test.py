@@ -7,7 +7,8 @@ Tests all backend endpoints and functionality
 import requests
 import json
 import time
-import base64
+import io
+import tarfile
 from datetime import datetime
 import uuid
 
@@ -41,6 +42,55 @@ class PixelCardAPITester:
             print(f"❌ Root endpoint error: {str(e)}")
             return False
     
+    def check_card_image(self, image_url):
+        """Fetch a card image and check caching and range headers"""
+        image_endpoint = self.base_url[:-len("/api")] + image_url
+        response = self.session.get(image_endpoint, timeout=30)
+        if response.status_code != 200 or not response.content.startswith(b"\x89PNG"):
+            print(f"❌ Card image fetch failed with status {response.status_code}")
+            return False
+        
+        etag = response.headers.get("ETag")
+        if not etag or "immutable" not in response.headers.get("Cache-Control", ""):
+            print("❌ Card image missing ETag or immutable Cache-Control")
+            return False
+        
+        cached = self.session.get(image_endpoint, headers={"If-None-Match": etag}, timeout=30)
+        if cached.status_code != 304:
+            print(f"❌ Conditional image fetch returned {cached.status_code}, expected 304")
+            return False
+        
+        partial = self.session.get(image_endpoint, headers={"Range": "bytes=0-7"}, timeout=30)
+        if partial.status_code != 206 or partial.content != response.content[:8]:
+            print(f"❌ Range image fetch returned {partial.status_code}, expected 206")
+            return False
+        
+        print("✅ Card image endpoint valid (ETag, 304, Range)")
+        return True
+    
+    def test_health(self):
+        """Test the liveness and Mongo-backed readiness probes"""
+        print("❤️ Testing health endpoints...")
+        
+        try:
+            live = self.session.get(f"{self.base_url}/health/live", timeout=30)
+            if live.status_code != 200:
+                print(f"❌ Liveness failed with status {live.status_code}")
+                return False
+            
+            ready = self.session.get(f"{self.base_url}/health/ready", timeout=30)
+            data = ready.json()
+            if ready.status_code != 200 or data.get('mongo') != 'ok':
+                print(f"❌ Not ready (status {ready.status_code}): {data}")
+                return False
+            
+            print(f"✅ Ready; this worker {'leads' if data.get('leader') else 'does not lead'} background tasks")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Health error: {str(e)}")
+            return False
+    
     def test_image_generation(self):
         """Test the image generation endpoint"""
         print("🎨 Testing image generation endpoint...")
@@ -54,7 +104,7 @@ class PixelCardAPITester:
             
             if response.status_code == 200:
                 data = response.json()
-                required_fields = ['id', 'image_base64', 'prompt', 'created_at']
+                required_fields = ['id', 'image_url', 'prompt', 'created_at']
                 
                 # Check all required fields exist
                 missing_fields = [field for field in required_fields if field not in data]
@@ -62,12 +112,8 @@ class PixelCardAPITester:
                     print(f"❌ Missing fields in response: {missing_fields}")
                     return False
                 
-                # Validate image_base64
-                try:
-                    base64.b64decode(data['image_base64'])
-                    print("✅ Base64 image encoding valid")
-                except Exception:
-                    print("❌ Invalid base64 image encoding")
+                # Validate the image is served from its own endpoint
+                if not self.check_card_image(data['image_url']):
                     return False
                 
                 # Check if prompt is from predefined list
@@ -110,15 +156,16 @@ class PixelCardAPITester:
             response = self.session.get(f"{self.base_url}/cards", timeout=30)
             
             if response.status_code == 200:
-                data = response.json()
+                page = response.json()
+                data = page.get('cards')
                 
-                if isinstance(data, list):
+                if isinstance(data, list) and 'next_cursor' in page:
                     print(f"✅ Retrieved {len(data)} cards")
                     
                     # If we have cards, validate structure
                     if len(data) > 0:
                         card = data[0]
-                        required_fields = ['id', 'image_base64', 'prompt', 'created_at']
+                        required_fields = ['id', 'image_url', 'prompt', 'created_at']
                         missing_fields = [field for field in required_fields if field not in card]
                         
                         if missing_fields:
@@ -129,7 +176,7 @@ class PixelCardAPITester:
                     
                     return True
                 else:
-                    print("❌ Response is not a list")
+                    print("❌ Response is not a page of cards")
                     return False
                     
             else:
@@ -194,6 +241,37 @@ class PixelCardAPITester:
             print(f"❌ Like card error: {str(e)}")
             return False
     
+    def test_swipes(self):
+        """Test batched, idempotent swipe ingestion"""
+        print("👆 Testing swipes endpoint...")
+        
+        if not self.generated_card_ids:
+            print("⚠️ No generated cards available, skipping swipes test")
+            return True
+        
+        card_id = self.generated_card_ids[0]
+        events = {"events": [{"event_id": str(uuid.uuid4()), "card_id": card_id, "liked": True}]}
+        
+        try:
+            response = self.session.post(f"{self.base_url}/swipes?wait=true", json=events, timeout=30)
+            if response.status_code != 202 or response.json().get("accepted") != 1:
+                print(f"❌ Swipes failed with status {response.status_code}")
+                print(f"Response: {response.text}")
+                return False
+            
+            # Replaying the same event id must be a no-op
+            replay = self.session.post(f"{self.base_url}/swipes?wait=true", json=events, timeout=30)
+            if replay.status_code != 202 or replay.json().get("applied") != 0:
+                print(f"❌ Replayed swipe was applied again: {replay.text}")
+                return False
+            
+            print("✅ Swipes recorded and replays ignored")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Swipes error: {str(e)}")
+            return False
+    
     def test_collection(self):
         """Test user collection endpoint"""
         print("🗂️ Testing collection endpoint...")
@@ -209,15 +287,16 @@ class PixelCardAPITester:
             response = self.session.get(f"{self.base_url}/collection", timeout=30)
             
             if response.status_code == 200:
-                data = response.json()
+                page = response.json()
+                data = page.get('cards')
                 
-                if isinstance(data, list):
-                    print(f"✅ Retrieved collection with {len(data)} cards")
+                if isinstance(data, list) and isinstance(page.get('total'), int):
+                    print(f"✅ Retrieved collection page with {len(data)} of {page['total']} cards")
                     
                     # Validate structure if collection has items
                     if len(data) > 0:
                         card = data[0]
-                        required_fields = ['id', 'image_base64', 'prompt', 'created_at']
+                        required_fields = ['id', 'image_url', 'prompt', 'created_at']
                         missing_fields = [field for field in required_fields if field not in card]
                         
                         if missing_fields:
@@ -232,7 +311,7 @@ class PixelCardAPITester:
                     
                     return True
                 else:
-                    print("❌ Collection response is not a list")
+                    print("❌ Collection response is not a page of cards")
                     return False
                     
             else:
@@ -244,6 +323,324 @@ class PixelCardAPITester:
             print(f"❌ Collection error: {str(e)}")
             return False
     
+    def test_sessions(self):
+        """Test that collections are private to each anonymous session"""
+        print("👤 Testing per-user collections...")
+        
+        if not self.generated_card_ids:
+            print("⚠️ No generated cards available, skipping sessions test")
+            return True
+        
+        card_id = self.generated_card_ids[0]
+        
+        try:
+            session = self.session.get(f"{self.base_url}/session", timeout=30).json()
+            self.session.post(f"{self.base_url}/like-card", json={"card_id": card_id, "liked": True}, timeout=30)
+            
+            # A client without a token gets a new, empty collection and its token
+            other = requests.get(f"{self.base_url}/collection", timeout=30)
+            if not other.headers.get("X-Session-Token"):
+                print("❌ New client was not issued a session token")
+                return False
+            if any(card['id'] == card_id for card in other.json()['cards']):
+                print("❌ Another user's like leaked into a new collection")
+                return False
+            
+            # The token works without the cookie
+            mine = requests.get(
+                f"{self.base_url}/collection", headers={"X-Session-Token": session['token']}, timeout=30
+            ).json()
+            if not any(card['id'] == card_id for card in mine['cards']):
+                print("❌ Liked card missing from the session's own collection")
+                return False
+            
+            print(f"✅ Collection of user {session['user_id'][:8]} is private")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Sessions error: {str(e)}")
+            return False
+    
+    def test_collection_atlas(self):
+        """Test the sprite-sheet atlas of the collection"""
+        print("🧩 Testing collection atlas...")
+        
+        try:
+            response = self.session.get(f"{self.base_url}/collection/atlas?page=0&size=128", timeout=TIMEOUT)
+            if response.status_code != 200:
+                print(f"❌ Atlas failed with status {response.status_code}")
+                print(f"Response: {response.text}")
+                return False
+            
+            atlas = response.json()
+            if not atlas['cards']:
+                print("⚠️ Collection is empty, nothing to pack")
+                return True
+            
+            sheet = self.session.get(f"{self.base_url.rsplit('/api', 1)[0]}{atlas['sheet_url']}", timeout=30)
+            if sheet.status_code != 200 or sheet.headers.get('content-type') != 'image/png':
+                print(f"❌ Atlas sheet failed with status {sheet.status_code}")
+                return False
+            
+            card = atlas['cards'][0]
+            if not all(key in card for key in ('x', 'y', 'w', 'h')):
+                print(f"❌ Atlas card missing coordinates: {card}")
+                return False
+            
+            print(f"✅ Atlas packed {len(atlas['cards'])} cards into a {atlas['width']}x{atlas['height']} sheet")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Atlas error: {str(e)}")
+            return False
+    
+    def test_collection_export(self):
+        """Test streaming a collection archive out and importing it back"""
+        print("📦 Testing collection export and import...")
+        
+        try:
+            response = self.session.get(f"{self.base_url}/collection/export?format=tar", timeout=TIMEOUT)
+            if response.status_code != 200:
+                print(f"❌ Export failed with status {response.status_code}")
+                return False
+            
+            with tarfile.open(fileobj=io.BytesIO(response.content)) as archive:
+                names = archive.getnames()
+            if 'archive.json' not in names:
+                print(f"❌ Export is missing archive.json: {names[:5]}")
+                return False
+            print(f"✅ Exported {len(names)} archive members")
+            
+            imported = self.session.post(f"{self.base_url}/collection/import", data=response.content, timeout=TIMEOUT)
+            if imported.status_code != 200:
+                print(f"❌ Import failed with status {imported.status_code}")
+                print(f"Response: {imported.text}")
+                return False
+            
+            report = imported.json()
+            # Re-importing our own export links the stored cards and never creates new ones
+            if report['imported'] != 0 or report['images_stored'] != 0 or report['duplicates'] != report['cards']:
+                print(f"❌ Re-import created cards: {report}")
+                return False
+            
+            print(f"✅ Re-import linked {report['duplicates']} stored cards")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Export error: {str(e)}")
+            return False
+    
+    def test_conditional_get(self):
+        """Test version ETags, 304 responses and compression of list endpoints"""
+        print("🏷️ Testing conditional GETs...")
+        
+        try:
+            response = self.session.get(f"{self.base_url}/cards?limit=50", timeout=TIMEOUT)
+            etag = response.headers.get('ETag')
+            if response.status_code != 200 or not etag:
+                print(f"❌ Cards response has no ETag (status {response.status_code})")
+                return False
+            
+            cached = self.session.get(f"{self.base_url}/cards?limit=50", headers={'If-None-Match': etag}, timeout=TIMEOUT)
+            if cached.status_code != 304 or cached.content:
+                print(f"❌ Expected empty 304 for current ETag, got {cached.status_code}")
+                return False
+            print(f"✅ Cards ETag {etag} answered with 304")
+            
+            if len(response.content) >= 1024:
+                encoding = response.headers.get('Content-Encoding')
+                if encoding not in ('gzip', 'br'):
+                    print(f"❌ Large card page was not compressed (Content-Encoding: {encoding})")
+                    return False
+                print(f"✅ Card page served with {encoding}")
+            
+            collection = self.session.get(f"{self.base_url}/collection", timeout=TIMEOUT)
+            etag = collection.headers.get('ETag')
+            cached = self.session.get(f"{self.base_url}/collection", headers={'If-None-Match': etag}, timeout=TIMEOUT)
+            if cached.status_code != 304 or 'private' not in cached.headers.get('Cache-Control', ''):
+                print(f"❌ Expected private 304 for collection, got {cached.status_code}")
+                return False
+            
+            print("✅ Collection ETag answered with private 304")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Conditional GET error: {str(e)}")
+            return False
+    
+    def test_feed(self):
+        """Test the unseen-card feed hands out distinct cards"""
+        print("🃏 Testing feed endpoint...")
+        
+        try:
+            first = self.session.get(f"{self.base_url}/feed?n=2", timeout=30)
+            second = self.session.get(f"{self.base_url}/feed?n=2", timeout=30)
+            
+            if first.status_code != 200 or second.status_code != 200:
+                print(f"❌ Feed failed with status {first.status_code}/{second.status_code}")
+                return False
+            
+            first_ids = {card['id'] for card in first.json()['cards']}
+            second_ids = {card['id'] for card in second.json()['cards']}
+            if first_ids & second_ids:
+                print("❌ Feed served the same card twice")
+                return False
+            
+            print(f"✅ Feed served {len(first_ids) + len(second_ids)} distinct cards")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Feed error: {str(e)}")
+            return False
+    
+    def test_inventory(self):
+        """Test the ready-card inventory stats endpoint"""
+        print("📦 Testing inventory endpoint...")
+        
+        try:
+            response = self.session.get(f"{self.base_url}/inventory", timeout=30)
+            
+            if response.status_code == 200:
+                data = response.json()
+                required_fields = ['depth', 'low_watermark', 'high_watermark', 'refill_rate_per_minute']
+                missing_fields = [field for field in required_fields if field not in data]
+                
+                if missing_fields:
+                    print(f"❌ Inventory stats missing fields: {missing_fields}")
+                    return False
+                
+                print(f"✅ Inventory depth {data['depth']} (low {data['low_watermark']}, high {data['high_watermark']})")
+                return True
+            else:
+                print(f"❌ Inventory failed with status {response.status_code}")
+                print(f"Response: {response.text}")
+                return False
+                
+        except Exception as e:
+            print(f"❌ Inventory error: {str(e)}")
+            return False
+    
+    def test_storage(self):
+        """Test the storage lifecycle sweep and its reclaimed-bytes report"""
+        print("🧹 Testing storage lifecycle...")
+        
+        try:
+            response = self.session.post(f"{self.base_url}/storage/sweep", timeout=TIMEOUT)
+            if response.status_code != 200:
+                print(f"❌ Storage sweep failed with status {response.status_code}")
+                print(f"Response: {response.text}")
+                return False
+            
+            report = response.json()
+            missing_fields = [field for field in ('evicted', 'trimmed', 'bytes_reclaimed') if field not in report]
+            if missing_fields:
+                print(f"❌ Sweep report missing fields: {missing_fields}")
+                return False
+            
+            stats = self.session.get(f"{self.base_url}/storage", timeout=30).json()
+            if stats.get('last_sweep') is None or 'bytes_reclaimed_total' not in stats:
+                print(f"❌ Storage stats incomplete: {stats}")
+                return False
+            
+            print(f"✅ Sweep evicted {report['evicted']}, trimmed {report['trimmed']}; "
+                  f"{stats['bytes_reclaimed_total']} bytes reclaimed in total")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Storage error: {str(e)}")
+            return False
+    
+    def test_jobs(self):
+        """Test queuing a background generation job and polling its progress"""
+        print("🧵 Testing generation jobs...")
+        
+        try:
+            response = self.session.post(f"{self.base_url}/jobs", json={"count": 1}, timeout=30)
+            if response.status_code != 202:
+                print(f"❌ Job submission failed with status {response.status_code}")
+                print(f"Response: {response.text}")
+                return False
+            
+            job = response.json()
+            deadline = time.time() + TIMEOUT
+            while job['status'] in ('queued', 'running') and time.time() < deadline:
+                time.sleep(2)
+                job = self.session.get(f"{self.base_url}/jobs/{job['id']}", timeout=30).json()
+            
+            if job['status'] != 'completed' or len(job['card_ids']) != 1:
+                print(f"❌ Job ended as {job['status']} with {job['completed']}/{job['requested']} cards")
+                return False
+            
+            missing = self.session.get(f"{self.base_url}/jobs/not-a-job", timeout=30)
+            if missing.status_code != 404:
+                print(f"❌ Unknown job returned {missing.status_code}, expected 404")
+                return False
+            
+            print(f"✅ Job {job['id']} generated card {job['card_ids'][0]}")
+            return True
+                
+        except Exception as e:
+            print(f"❌ Jobs error: {str(e)}")
+            return False
+    
+    def test_events(self):
+        """Test the Server-Sent Events stream"""
+        print("📡 Testing events stream...")
+        
+        try:
+            with self.session.get(f"{self.base_url}/events", stream=True, timeout=30) as response:
+                if response.status_code != 200:
+                    print(f"❌ Events failed with status {response.status_code}")
+                    return False
+                
+                content_type = response.headers.get('content-type', '')
+                if not content_type.startswith('text/event-stream'):
+                    print(f"❌ Unexpected events content type: {content_type}")
+                    return False
+                
+                # The stream opens with a retry hint before any event arrives
+                first_line = next(response.iter_lines(decode_unicode=True), '')
+                if not first_line.startswith('retry:'):
+                    print(f"❌ Unexpected first events frame: {first_line}")
+                    return False
+                
+            print("✅ Events stream opened")
+            return True
+                
+        except Exception as e:
+            print(f"❌ Events error: {str(e)}")
+            return False
+    
+    def test_metrics(self):
+        """Test the Prometheus metrics endpoint"""
+        print("📈 Testing metrics endpoint...")
+        
+        try:
+            response = self.session.get(f"{self.base_url}/metrics", timeout=30)
+            
+            if response.status_code == 200:
+                expected_metrics = ['http_request_duration_seconds_bucket', 'http_requests_total', 'card_inventory_depth']
+                missing_metrics = [name for name in expected_metrics if name not in response.text]
+                
+                if missing_metrics:
+                    print(f"❌ Metrics missing series: {missing_metrics}")
+                    return False
+                
+                if not response.headers.get('content-type', '').startswith('text/plain'):
+                    print(f"❌ Unexpected metrics content type: {response.headers.get('content-type')}")
+                    return False
+                
+                print(f"✅ Metrics returned {len(response.text.splitlines())} lines")
+                return True
+            else:
+                print(f"❌ Metrics failed with status {response.status_code}")
+                print(f"Response: {response.text}")
+                return False
+                
+        except Exception as e:
+            print(f"❌ Metrics error: {str(e)}")
+            return False
+    
     def test_database_operations(self):
         """Test database persistence and UUID handling"""
         print("🗄️ Testing database operations...")
@@ -272,7 +669,7 @@ class PixelCardAPITester:
                 print("❌ Cannot retrieve cards to verify persistence")
                 return False
             
-            cards = cards_response.json()
+            cards = cards_response.json()['cards']
             found_card = next((card for card in cards if card['id'] == card_id), None)
             
             if found_card:
@@ -305,10 +702,22 @@ class PixelCardAPITester:
         # Test each endpoint
         tests = [
             ("Root Endpoint", self.test_root_endpoint),
+            ("Health", self.test_health),
             ("Image Generation", self.test_image_generation),
             ("Get Cards", self.test_get_cards),
             ("Like Card", self.test_like_card),
+            ("Swipes", self.test_swipes),
             ("Collection", self.test_collection),
+            ("Sessions", self.test_sessions),
+            ("Collection Atlas", self.test_collection_atlas),
+            ("Collection Export", self.test_collection_export),
+            ("Conditional GET", self.test_conditional_get),
+            ("Feed", self.test_feed),
+            ("Inventory", self.test_inventory),
+            ("Storage", self.test_storage),
+            ("Jobs", self.test_jobs),
+            ("Events", self.test_events),
+            ("Metrics", self.test_metrics),
             ("Database Operations", self.test_database_operations)
         ]
         
@@ -0,0 +1,1273 @@
+#!/usr/bin/env python3
+"""
+Offline Backend Tests for Pixel Card Collection Game
+Tests backend modules directly, with fake generators and injected clocks,
+so they need no server, database or image model
+"""
+
+import asyncio
+import base64
+import json
+import os
+import random
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from batch import BatchGenerator
+from blobstore import BlobStore
+from coalescing import GenerationCoalescer
+from dedup import LINK, NearDuplicateIndex, dhash_bands, hamming_distance
+from events import EventBus, EventRelay
+from events import RESYNC
+from fastjson import CHUNK_SIZE, encode_page, start_stream, wants_ndjson
+from inventory import CardInventory
+from jobs import CANCELLED, COMPLETED, JobQueue
+from leader import LeaderElection
+from lifecycle import StorageLifecycle
+from pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_filter
+from resilience import (
+    CLOSED, HALF_OPEN, OPEN,
+    CircuitOpenError, GenerationFailed, GenerationTimeout, GenerationUnavailable, ResilientImageGenerator,
+)
+from responsecache import ResponseCache
+from reuse import GenerationCache
+from sessions import SessionTokens
+from swipes import SwipeEvent, SwipeWriter
+from tasks import cancel_and_wait
+
+
+class FakeClock:
+    """Monotonic clock that only moves when told to"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeImageModel:
+    """Image model that returns or raises the queued outcomes, one per call"""
+    def __init__(self, outcomes=None, clock=None, latency=0.0, delay=0.0):
+        self.outcomes = list(outcomes or [])
+        self.clock = clock
+        self.latency = latency
+        self.delay = delay
+        self.calls = 0
+        self.release = None
+
+    async def generate_images(self, prompt, model, number_of_images=1):
+        self.calls += 1
+        if self.release is not None:
+            await self.release.wait()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.clock is not None:
+            self.clock.advance(self.latency)
+        outcome = self.outcomes.pop(0) if self.outcomes else None
+        if isinstance(outcome, Exception):
+            raise outcome
+        return [f"{prompt}:{self.calls}:{i}".encode() for i in range(number_of_images)]
+
+
+class FakeCollection:
+    """Just enough of a Motor collection to record writes and claim documents"""
+    def __init__(self):
+        self.documents = []
+        self.updates = []
+
+    async def insert_many(self, documents, ordered=True):
+        await asyncio.sleep(0)
+        self.documents.extend(documents)
+
+    async def update_many(self, query, update):
+        self.updates.append((query, update))
+
+    async def find_one_and_update(self, query, update, projection=None, sort=None, return_document=None):
+        # Equality and $lt filters, one sort key and $inc: what the generation cache uses
+        def matches(document):
+            return all(
+                document.get(key) < value["$lt"] if isinstance(value, dict) else document.get(key) == value
+                for key, value in query.items()
+            )
+        candidates = [document for document in self.documents if matches(document)]
+        if not candidates:
+            return None
+        if sort:
+            key, direction = sort[0]
+            candidates.sort(key=lambda document: document[key], reverse=direction < 0)
+        document = candidates[0]
+        for key, amount in update.get("$inc", {}).items():
+            document[key] = document.get(key, 0) + amount
+        return {key: document[key] for key, included in (projection or {}).items() if included and key in document}
+
+
+def flip_bits(dhash, bits):
+    """The 64-bit hex hash with the given bit positions inverted"""
+    value = int(dhash, 16)
+    for bit in bits:
+        value ^= 1 << bit
+    return f"{value:016x}"
+
+
+class ProjectingCollection:
+    """A mongomock collection whose find_one_and_update can project out _id
+
+    mongomock re-reads the updated document by _id, so excluding it from the
+    projection makes it return None; project after the update instead.
+    """
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def find_one_and_update(self, query, update, projection=None, **kwargs):
+        document = await self._collection.find_one_and_update(query, update, **kwargs)
+        for key, included in (projection or {}).items():
+            if document is not None and not included:
+                document.pop(key, None)
+        return document
+
+
+class FakeBatch:
+    """Batch generator that stores unserved cards straight away"""
+    def __init__(self, collection):
+        self.collection = collection
+        self.runs = []
+
+    async def run(self, prompts, concurrency=None):
+        self.runs.append(len(prompts))
+        cards = [{"id": str(uuid.uuid4()), "served": False, "created_at": datetime.now(timezone.utc)}
+                 for _ in prompts]
+        await self.collection.insert_many(cards)
+        return SimpleNamespace(card_ids=[card["id"] for card in cards], failures=[])
+
+
+def stored_card(card_id, original, variants=None, served=True, age_days=30, **fields):
+    """Card document served (or created) ``age_days`` ago, with variant blob keys by name"""
+    at = datetime.now(timezone.utc) - timedelta(days=age_days)
+    return {
+        "id": card_id, "served": served, "served_at": at if served else None, "created_at": at,
+        "image_sha256": original, "image_content_type": "image/png",
+        "image_variants": {name: {"sha256": key, "content_type": "image/png"} for name, key in (variants or {}).items()},
+        **fields,
+    }
+
+
+def job_database():
+    """In-memory database for job queues, whose job updates project out _id"""
+    db = AsyncMongoMockClient()["unit"]
+    return SimpleNamespace(jobs=ProjectingCollection(db.jobs), job_items=db.job_items, cards=db.cards)
+
+
+class FakeRecompressor:
+    """Derivative pipeline whose recompression never finds smaller bytes"""
+    def __init__(self):
+        self.seen = []
+
+    async def recompress(self, data):
+        self.seen.append(data)
+        return None
+
+
+class RacingLifecycle(StorageLifecycle):
+    """Storage lifecycle where a like commits right after the first liked-check"""
+    raced = False
+
+    async def _liked(self, card_ids):
+        liked = await super()._liked(card_ids)
+        if not self.raced:
+            self.raced = True
+            await self.db.likes.insert_one({"user_id": "u1", "card_id": card_ids[0]})
+        return liked
+
+
+class BackendUnitTester:
+    def test_resilience_aimd(self):
+        """Test additive increase on fast calls and halving on errors and slow calls"""
+        print("📈 Testing adaptive concurrency...")
+
+        async def scenario():
+            clock = FakeClock()
+            model = FakeImageModel(clock=clock)
+            generator = ResilientImageGenerator(
+                model, min_limit=1, max_limit=4, initial_limit=2, latency_target=10.0, clock=clock
+            )
+            await generator.generate_images("p", "m")
+            if abs(generator.limit - 2.5) > 1e-9:
+                print(f"❌ One fast call should grow the limit by 1/limit, got {generator.limit}")
+                return False
+            for _ in range(50):
+                await generator.generate_images("p", "m")
+            if generator.limit != 4:
+                print(f"❌ Limit should stop at max_limit, got {generator.limit}")
+                return False
+
+            model.outcomes = [RuntimeError("boom")]
+            try:
+                await generator.generate_images("p", "m")
+            except GenerationFailed:
+                pass
+            if generator.limit != 2:
+                print(f"❌ An error should halve the limit, got {generator.limit}")
+                return False
+
+            model.latency = 11.0
+            await generator.generate_images("p", "m")
+            await generator.generate_images("p", "m")
+            if generator.limit != 1:
+                print(f"❌ Slow calls should halve the limit down to min_limit, got {generator.limit}")
+                return False
+            print("✅ Limit grew to 4, halved on an error and on slow calls, floored at 1")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_resilience_limit_enforced(self):
+        """Test that no more calls run at once than the concurrency limit"""
+        print("🚦 Testing concurrency limit...")
+
+        async def scenario():
+            model = FakeImageModel()
+            model.release = asyncio.Event()
+            generator = ResilientImageGenerator(model, min_limit=1, max_limit=8, initial_limit=2)
+            calls = [asyncio.create_task(generator.generate_images("p", "m")) for _ in range(5)]
+            await asyncio.sleep(0.05)
+            if model.calls != 2 or generator.stats()["in_flight"] != 2:
+                print(f"❌ Expected 2 calls in flight, got {model.calls}")
+                return False
+            model.release.set()
+            await asyncio.gather(*calls)
+            if model.calls != 5:
+                print(f"❌ Queued calls did not all run: {model.calls}")
+                return False
+            print("✅ Calls beyond the limit waited for a slot")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_resilience_breaker(self):
+        """Test the closed -> open -> half-open -> closed cycle and a failed probe"""
+        print("🔌 Testing circuit breaker...")
+
+        async def scenario():
+            clock = FakeClock()
+            model = FakeImageModel(outcomes=[RuntimeError("down")] * 3, clock=clock)
+            generator = ResilientImageGenerator(model, failure_threshold=3, reset_timeout=30.0, clock=clock)
+            for _ in range(3):
+                try:
+                    await generator.generate_images("p", "m")
+                except GenerationFailed:
+                    pass
+            if generator.state != OPEN:
+                print(f"❌ Breaker should open after 3 failures, state {generator.state}")
+                return False
+
+            try:
+                await generator.generate_images("p", "m")
+                print("❌ Open breaker let a call through")
+                return False
+            except CircuitOpenError:
+                pass
+            if model.calls != 3:
+                print("❌ Open breaker called the model")
+                return False
+
+            # After reset_timeout exactly one probe is let through
+            clock.advance(30.0)
+            model.release = asyncio.Event()
+            probe = asyncio.create_task(generator.generate_images("p", "m"))
+            await asyncio.sleep(0.01)
+            if generator.state != HALF_OPEN:
+                print(f"❌ Breaker should be half-open during the probe, state {generator.state}")
+                return False
+            try:
+                await generator.generate_images("p", "m")
+                print("❌ Second call ran while the probe was in flight")
+                return False
+            except CircuitOpenError:
+                pass
+            model.release.set()
+            await probe
+            if generator.state != CLOSED:
+                print(f"❌ A successful probe should close the breaker, state {generator.state}")
+                return False
+
+            # A failed probe re-opens the breaker straight away
+            model.release = None
+            model.outcomes = [RuntimeError("down")] * 3 + [RuntimeError("still down")]
+            for _ in range(3):
+                try:
+                    await generator.generate_images("p", "m")
+                except GenerationFailed:
+                    pass
+            clock.advance(30.0)
+            try:
+                await generator.generate_images("p", "m")
+            except GenerationFailed:
+                pass
+            if generator.state != OPEN or generator.opened_total != 3:
+                print(f"❌ A failed probe should re-open the breaker: {generator.stats()}")
+                return False
+            print(f"✅ Breaker cycled through open, half-open and closed: {generator.stats()['opened_total']} openings")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_resilience_errors(self):
+        """Test that every failure surfaces as GenerationUnavailable for the fallback path"""
+        print("🧯 Testing generation errors...")
+
+        async def scenario():
+            generator = ResilientImageGenerator(FakeImageModel(delay=1.0), deadline=0.05, failure_threshold=1,
+                                                reset_timeout=30.0)
+            try:
+                await generator.generate_images("p", "m")
+                print("❌ Call over the deadline did not time out")
+                return False
+            except GenerationTimeout as e:
+                if not isinstance(e, GenerationUnavailable):
+                    print("❌ GenerationTimeout is not a GenerationUnavailable")
+                    return False
+            try:
+                await generator.generate_images("p", "m")
+                print("❌ Breaker did not open after the timeout")
+                return False
+            except CircuitOpenError as e:
+                # /api/generate-card answers this with 503 and Retry-After: reset_timeout
+                if not isinstance(e, GenerationUnavailable):
+                    print("❌ CircuitOpenError is not a GenerationUnavailable")
+                    return False
+
+            cause = ValueError("bad prompt")
+            generator = ResilientImageGenerator(FakeImageModel(outcomes=[cause]))
+            try:
+                await generator.generate_images("p", "m")
+                print("❌ Model error was swallowed")
+                return False
+            except GenerationFailed as e:
+                if e.__cause__ is not cause or not isinstance(e, GenerationUnavailable):
+                    print("❌ GenerationFailed lost the model error")
+                    return False
+            print("✅ Timeouts, open circuits and model errors are all GenerationUnavailable")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_coalescing(self):
+        """Test that concurrent callers share model calls and each get their own card"""
+        print("🧲 Testing generation coalescing...")
+
+        async def scenario():
+            requested = []
+
+            async def generate_many(count):
+                requested.append(count)
+                await asyncio.sleep(0.05)
+                return [{"id": str(uuid.uuid4())} for _ in range(count)]
+
+            stored = []
+            coalescer = GenerationCoalescer(
+                FakeCollection(), generate_many, max_in_flight=2, max_images_per_call=4, on_stored=stored.extend
+            )
+            cards = await asyncio.gather(*(coalescer.get() for _ in range(10)))
+            ids = {card["id"] for card in cards}
+            if len(ids) != 10:
+                print(f"❌ Callers shared cards: {len(ids)} distinct of 10")
+                return False
+            if len(requested) >= 10 or sum(requested) != 10:
+                print(f"❌ Expected fewer model calls than callers for exactly 10 images, got {requested}")
+                return False
+            if not all(card["served"] for card in cards) or len(stored) != 10:
+                print("❌ Delivered cards were not stored as served")
+                return False
+            print(f"✅ 10 callers got distinct cards from {len(requested)} model calls {requested}")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_coalescing_abandoned(self):
+        """Test that a card whose caller went away is kept as unserved inventory"""
+        print("🧲 Testing abandoned coalesced generations...")
+
+        async def scenario():
+            async def generate_many(count):
+                return [{"id": str(uuid.uuid4())} for _ in range(count)]
+
+            collection = FakeCollection()
+            stored = asyncio.Event()
+            insert_many = collection.insert_many
+
+            async def slow_insert_many(documents, ordered=True):
+                await stored.wait()
+                await insert_many(documents, ordered)
+            collection.insert_many = slow_insert_many
+
+            coalescer = GenerationCoalescer(collection, generate_many, max_in_flight=1, max_images_per_call=4)
+            waiting = [asyncio.create_task(coalescer.get()) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            # The first caller leaves while its card is being stored
+            waiting[0].cancel()
+            stored.set()
+            cards = await asyncio.gather(*waiting[1:])
+            abandoned = [card_id for query, _ in collection.updates for card_id in query["id"]["$in"]]
+            if len(cards) != 2 or len(collection.documents) != 3 or len(abandoned) != 1:
+                print(f"❌ Expected 2 delivered and 1 unserved card, updates {collection.updates}")
+                return False
+            if abandoned[0] in {card["id"] for card in cards} or coalescer.stats()["surplus_total"] != 1:
+                print(f"❌ Unexpected coalescer stats: {coalescer.stats()}")
+                return False
+            print("✅ The abandoned caller's card was stored as unserved inventory")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_dedup_bands(self):
+        """Test that hashes within the indexed distance always share a band"""
+        print("🧬 Testing perceptual hash bands...")
+        rng = random.Random(14)
+        for _ in range(500):
+            dhash = f"{rng.getrandbits(64):016x}"
+            near = flip_bits(dhash, rng.sample(range(64), rng.randint(0, 3)))
+            if not set(dhash_bands(dhash)) & set(dhash_bands(near)):
+                print(f"❌ {dhash} and {near} are {hamming_distance(dhash, near)} bits apart but share no band")
+                return False
+        # One bit off in every band: 4 bits apart, and rightly never a candidate
+        far = flip_bits("0123456789abcdef", [0, 16, 32, 48])
+        if set(dhash_bands("0123456789abcdef")) & set(dhash_bands(far)):
+            print("❌ Hashes differing in every band share one")
+            return False
+        print("✅ Every hash up to 3 bits away shared a band")
+        return True
+
+    def test_dedup_lookup(self):
+        """Test near-duplicate lookups against stored and pending cards"""
+        print("🧬 Testing near-duplicate lookups...")
+
+        async def scenario():
+            cards = AsyncMongoMockClient()["unit"]["cards"]
+            original = "f0e1d2c3b4a59687"
+            # Far-off cards stored earlier crowd the one band the lookups below share with the original
+            decoy = flip_bits(original, range(0, 48, 3))
+            await cards.insert_many([
+                {"id": f"decoy-{i}", "image_dhash": decoy, "image_dhash_bands": dhash_bands(decoy)}
+                for i in range(120)
+            ])
+            await cards.insert_many([
+                {"id": "original", "image_dhash": original, "image_dhash_bands": dhash_bands(original)},
+                {"id": "unrelated", "image_dhash": "0000000000000000",
+                 "image_dhash_bands": dhash_bands("0000000000000000")},
+            ])
+            index = NearDuplicateIndex(cards, max_distance=3)
+            if await index.find(flip_bits(original, [1, 20, 40])) != "original":
+                print("❌ A hash 3 bits away was not found")
+                return False
+            if await index.find(flip_bits(original, [1, 20, 40, 60])) is not None:
+                print("❌ A hash 4 bits away matched")
+                return False
+            pending = [{"id": "pending", "image_dhash": "aaaaaaaaaaaaaaaa"}]
+            if await index.find(flip_bits("aaaaaaaaaaaaaaaa", [5]), pending) != "pending":
+                print("❌ A card from the same batch, not yet stored, was not found")
+                return False
+            if index.stats() != {"checks_total": 3, "duplicates_total": 2}:
+                print(f"❌ Unexpected dedup stats: {index.stats()}")
+                return False
+
+            strict = NearDuplicateIndex(cards, max_distance=10, mode=LINK)
+            if strict.max_distance != 3:
+                print("❌ max_distance was not capped at what the bands can find")
+                return False
+            try:
+                NearDuplicateIndex(cards, mode="merge")
+                print("❌ Unknown dedup mode was accepted")
+                return False
+            except ValueError:
+                pass
+            print("✅ Near-duplicates found up to 3 bits away, in storage and in the batch")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_generation_reuse(self):
+        """Test that prior outputs are reused at most reuse_budget times, least reused first"""
+        print("♻️ Testing budgeted generation reuse...")
+
+        async def scenario():
+            cards = FakeCollection()
+            await cards.insert_many([
+                {"id": "a", "prompt": "p", "model": "m", "remix_of": None, "reuse_count": 1, "image_sha256": "1"},
+                {"id": "b", "prompt": "p", "model": "m", "remix_of": None, "reuse_count": 0, "image_sha256": "2"},
+                {"id": "remix", "prompt": "p", "model": "m", "remix_of": "b", "reuse_count": 0, "image_sha256": "3"},
+                {"id": "other", "prompt": "p", "model": "other", "remix_of": None, "reuse_count": 0,
+                 "image_sha256": "4"},
+            ])
+            cache = GenerationCache(cards, reuse_budget=2)
+            first = await cache.take("p", "m")
+            if [source["id"] for source in first] != ["b"]:
+                print(f"❌ The least reused original should go first, got {first}")
+                return False
+            sources = await cache.take("p", "m", count=5)
+            if sorted(source["id"] for source in sources) != ["a", "b"]:
+                print(f"❌ Expected the remaining budget of a and b, got {sources}")
+                return False
+            counts = {card["id"]: card["reuse_count"] for card in cards.documents}
+            if counts != {"a": 2, "b": 2, "remix": 0, "other": 0}:
+                print(f"❌ Reuse went over budget or touched remixes and other models: {counts}")
+                return False
+            if cache.stats()["hits_total"] != 3 or cache.stats()["misses_total"] != 3:
+                print(f"❌ Unexpected reuse stats: {cache.stats()}")
+                return False
+
+            disabled = GenerationCache(cards, reuse_budget=0)
+            if await disabled.take("p", "other") or disabled.stats()["misses_total"] != 1:
+                print("❌ A budget of 0 still reused outputs")
+                return False
+            print("✅ Each original was reused twice at most, never remixes or other models")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_response_cache_generations(self):
+        """Test that a response computed across an invalidation is never cached"""
+        print("🗃️ Testing response cache invalidation...")
+        cache = ResponseCache()
+        generation = cache.generation("cards")
+        cache.put("cards", "page", b"fresh", generation)
+        if cache.get("cards", "page") != b"fresh":
+            print("❌ Stored page was not served")
+            return False
+
+        # A slow request started before a write must not put its stale page back
+        slow = cache.generation("cards")
+        cache.invalidate("cards")
+        if cache.get("cards", "page") is not None:
+            print("❌ Invalidation left the page cached")
+            return False
+        cache.put("cards", "page", b"stale", slow)
+        if cache.get("cards", "page") is not None:
+            print("❌ A page computed before the invalidation was cached")
+            return False
+
+        cache.put("collection:u1", "page", b"mine", cache.generation("collection:u1"))
+        cache.invalidate("collection:u2")
+        if cache.get("collection:u1", "page") != b"mine":
+            print("❌ Invalidating one namespace dropped another")
+            return False
+        print("✅ Stale pages were dropped and never stored again")
+        return True
+
+    def test_response_cache_bounds(self):
+        """Test TTL expiry, LRU eviction and streamed bodies"""
+        print("🗃️ Testing response cache bounds...")
+        clock = FakeClock()
+        cache = ResponseCache(max_entries=2, ttl=30.0, max_entry_bytes=8, clock=clock)
+        for key in ("a", "b"):
+            cache.put("cards", key, key.encode(), cache.generation("cards"))
+        cache.get("cards", "a")
+        cache.put("cards", "c", b"c", cache.generation("cards"))
+        if cache.get("cards", "b") is not None or cache.get("cards", "a") != b"a":
+            print("❌ The least recently used entry was not the one evicted")
+            return False
+        clock.advance(31.0)
+        if cache.get("cards", "a") is not None:
+            print("❌ Entry outlived its TTL")
+            return False
+
+        async def stream(chunks):
+            for chunk in chunks:
+                yield chunk
+
+        async def scenario():
+            body = b"".join([chunk async for chunk in cache.record(
+                "cards", "small", cache.generation("cards"), stream([b"ab", b"cd"]))])
+            large = b"".join([chunk async for chunk in cache.record(
+                "cards", "large", cache.generation("cards"), stream([b"abcdef", b"ghijkl"]))])
+            return body, large
+
+        body, large = asyncio.run(scenario())
+        if body != b"abcd" or cache.get("cards", "small") != b"abcd":
+            print("❌ A streamed body was not passed through and cached")
+            return False
+        if large != b"abcdefghijkl" or cache.get("cards", "large") is not None:
+            print("❌ A body over max_entry_bytes was cached or cut short")
+            return False
+
+        disabled = ResponseCache(enabled=False)
+        disabled.put("cards", "page", b"x", disabled.generation("cards"))
+        if disabled.get("cards", "page") is not None:
+            print("❌ A disabled cache stored a page")
+            return False
+        print(f"✅ Cache bounded by entries, TTL and body size: {cache.stats()}")
+        return True
+
+    def encode_page_chunks(self, rows, limit, ndjson=False, extra=None):
+        """Chunks of one page encoded by fastjson from plain rows"""
+        async def cursor():
+            for row in rows:
+                yield row
+
+        async def scenario():
+            chunks = encode_page(
+                cursor(),
+                lambda row: None if row.get("hidden") else {"id": row["id"], "created_at": row["created_at"]},
+                limit,
+                lambda row: f"cursor-{row['id']}",
+                extra,
+                ndjson,
+            )
+            return [chunk async for chunk in await start_stream(chunks)]
+
+        return asyncio.run(scenario())
+
+    def test_fastjson_pages(self):
+        """Test streamed JSON pages: skipped rows, cursors, chunking and dates"""
+        print("⚡ Testing streamed JSON pages...")
+        created_at = datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        rows = [{"id": str(i), "created_at": created_at, "hidden": i == 1} for i in range(3)]
+        page = json.loads(b"".join(self.encode_page_chunks(rows, limit=3, extra={"total": 2})))
+        if [card["id"] for card in page["cards"]] != ["0", "2"]:
+            print(f"❌ Skipped rows were encoded: {page}")
+            return False
+        # A skipped row still counts towards the limit, so a full page has a cursor
+        if page["next_cursor"] != "cursor-2" or page["total"] != 2:
+            print(f"❌ Full page metadata wrong: {page}")
+            return False
+        if page["cards"][0]["created_at"] != "2026-01-02T03:04:05Z":
+            print(f"❌ Dates not encoded as UTC with Z: {page['cards'][0]['created_at']}")
+            return False
+        if json.loads(b"".join(self.encode_page_chunks(rows, limit=5)))["next_cursor"] is not None:
+            print("❌ A short page has a next_cursor")
+            return False
+        if json.loads(b"".join(self.encode_page_chunks([], limit=5))) != {"cards": [], "next_cursor": None}:
+            print("❌ Empty page is not valid")
+            return False
+
+        many = [{"id": f"{i:06d}", "created_at": created_at} for i in range(2000)]
+        chunks = self.encode_page_chunks(many, limit=2000)
+        page = json.loads(b"".join(chunks))
+        if len(chunks) < 2 or len(page["cards"]) != 2000:
+            print(f"❌ Large page not streamed in chunks: {len(chunks)} chunks")
+            return False
+        if any(len(chunk) > 2 * CHUNK_SIZE for chunk in chunks):
+            print("❌ A chunk grew far past CHUNK_SIZE")
+            return False
+        print(f"✅ Pages valid; 2000 cards streamed in {len(chunks)} chunks")
+        return True
+
+    def test_fastjson_ndjson(self):
+        """Test NDJSON pages and format negotiation"""
+        print("⚡ Testing NDJSON pages...")
+        created_at = datetime(2026, 1, 2, tzinfo=timezone.utc)
+        rows = [{"id": str(i), "created_at": created_at} for i in range(2)]
+        chunks = self.encode_page_chunks(rows, limit=2, ndjson=True, extra={"total": 2})
+        lines = [json.loads(line) for line in b"".join(chunks).splitlines()]
+        if [line.get("id") for line in lines[:-1]] != ["0", "1"] or len(chunks) != 3:
+            print(f"❌ Expected one card per line and chunk: {lines}")
+            return False
+        if lines[-1] != {"next_cursor": "cursor-1", "total": 2}:
+            print(f"❌ Last line is not the page metadata: {lines[-1]}")
+            return False
+
+        checks = [
+            wants_ndjson("application/x-ndjson"),
+            not wants_ndjson("application/json"),
+            not wants_ndjson(None),
+            wants_ndjson("application/json", "ndjson"),
+            not wants_ndjson("application/x-ndjson", "json"),
+        ]
+        if not all(checks):
+            print(f"❌ Format negotiation wrong: {checks}")
+            return False
+
+        async def failing():
+            raise RuntimeError("cursor died")
+            yield b""
+
+        async def scenario():
+            try:
+                await start_stream(failing())
+                return False
+            except RuntimeError:
+                return True
+
+        if not asyncio.run(scenario()):
+            print("❌ A query error did not surface before the response started")
+            return False
+        print("✅ NDJSON lines and page metadata valid; errors surface before headers")
+        return True
+
+    def test_inventory_follower_kick(self):
+        """Test that a claim on a worker that is not the leader wakes the leader's refill"""
+        print("📦 Testing cross-process inventory refill...")
+
+        async def scenario():
+            db = AsyncMongoMockClient()["unit"]
+            await db.cards.insert_many([
+                {"id": f"card-{i}", "served": False, "created_at": datetime.now(timezone.utc)} for i in range(3)
+            ])
+            relays, inventories = [], []
+            batch = FakeBatch(db.cards)
+            for _ in range(2):
+                relay = EventRelay(db, EventBus(), retry_interval=0.05)
+                inventory = CardInventory(db.cards, batch, low_watermark=3, high_watermark=4, poll_interval=60.0,
+                                          on_kick=lambda relay=relay: relay.signal("inventory_refill"))
+                relay.on_signal("inventory_refill", inventory.wake)
+                relay.start()
+                relays.append(relay)
+                inventories.append(inventory)
+            leader, follower = inventories
+            leader.start()
+            await asyncio.sleep(0.2)
+            if batch.runs:
+                print(f"❌ Inventory at the low watermark was refilled: {batch.runs}")
+                return False
+
+            card = await follower.claim()
+            for _ in range(40):
+                if batch.runs:
+                    break
+                await asyncio.sleep(0.05)
+            await leader.stop()
+            for relay in relays:
+                await relay.stop()
+            if card is None or batch.runs != [2]:
+                print(f"❌ The follower's claim did not refill through the leader: {batch.runs}")
+                return False
+            if await db.cards.count_documents({"served": False}) != 4:
+                print("❌ Inventory was not topped up to the high watermark")
+                return False
+            print("✅ A claim on a follower woke the leader, which refilled 2 cards")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_batch_partial_insert(self):
+        """Test that a wave with some failed inserts still reports and hands on the stored cards"""
+        print("🌊 Testing partially stored batch waves...")
+
+        async def scenario():
+            cards = AsyncMongoMockClient()["unit"]["cards"]
+            await cards.create_index("id", unique=True)
+            await cards.insert_one({"id": "taken"})
+
+            async def generate(prompt):
+                return {"id": prompt, "prompt": prompt}
+
+            stored = []
+            batch = BatchGenerator(cards, generate, concurrency=3, on_stored=stored.extend)
+            result = await batch.run(["first", "taken", "third"])
+            if sorted(result.card_ids) != ["first", "third"]:
+                print(f"❌ Inserted cards were not reported: {result.card_ids}")
+                return False
+            if [(failure.index, failure.prompt) for failure in result.failures] != [(1, "taken")]:
+                print(f"❌ Expected only the duplicate to fail: {result.failures}")
+                return False
+            if sorted(card["id"] for card in stored) != ["first", "third"]:
+                print(f"❌ on_stored missed inserted cards: {stored}")
+                return False
+            print("✅ Only the failed insert was reported; the rest reached on_stored")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_storage_shared_variants(self):
+        """Test that variant blobs still used by a compacted card survive an eviction"""
+        print("🧹 Testing variant blobs shared with compacted cards...")
+
+        async def scenario():
+            with tempfile.TemporaryDirectory() as root:
+                db = AsyncMongoMockClient()["unit"]
+                store = BlobStore(Path(root))
+                original = await store.put(b"original")
+                compacted = await store.put(b"compacted")
+                thumbnail = await store.put(b"thumbnail")
+                await db.cards.insert_many([
+                    stored_card("evicted", original, {"64": thumbnail}),
+                    # Compaction rewrote this card's original but kept its variants
+                    stored_card("kept", compacted, {"64": thumbnail}, served=False),
+                ])
+                lifecycle = StorageLifecycle(db, store, None, retention=timedelta(days=7), max_unserved=0)
+                report = await lifecycle.sweep()
+                if report["evicted"] != 1:
+                    print(f"❌ Expected the expired card evicted: {report}")
+                    return False
+                if await store.exists(original) or not await store.exists(thumbnail):
+                    print("❌ Eviction deleted a variant another card uses, or kept the unused original")
+                    return False
+            print("✅ The unused original was deleted and the shared thumbnail kept")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_storage_retention(self):
+        """Test that retention evicts expired cards but keeps liked ones and shared originals"""
+        print("🧹 Testing card retention...")
+
+        async def scenario():
+            with tempfile.TemporaryDirectory() as root:
+                db = AsyncMongoMockClient()["unit"]
+                store = BlobStore(Path(root))
+                shared = await store.put(b"shared")
+                liked = await store.put(b"liked")
+                await db.cards.insert_many([
+                    stored_card("expired", shared),
+                    stored_card("recent", shared, age_days=1),
+                    stored_card("liked", liked),
+                ])
+                await db.likes.insert_one({"user_id": "u1", "card_id": "liked"})
+                removed = []
+                lifecycle = StorageLifecycle(db, store, None, on_removed=removed.extend,
+                                             retention=timedelta(days=7), max_unserved=0)
+                report = await lifecycle.sweep()
+                remaining = set(await db.cards.distinct("id"))
+                if report["evicted"] != 1 or remaining != {"recent", "liked"} or removed != ["expired"]:
+                    print(f"❌ Expected only the unliked expired card evicted: {report}, {remaining}")
+                    return False
+                if not await store.exists(shared) or not await store.exists(liked):
+                    print("❌ An original still used by another card was deleted")
+                    return False
+
+                await db.cards.update_one({"id": "recent"}, {"$set": stored_card("recent", shared)})
+                await lifecycle.sweep()
+                if await store.exists(shared):
+                    print("❌ The shared original outlived the last card using it")
+                    return False
+            print("✅ Liked cards survived retention; the shared original went with its last card")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_storage_like_race(self):
+        """Test that a card liked between selection and deletion is put back"""
+        print("🧹 Testing cards liked during eviction...")
+
+        async def scenario():
+            with tempfile.TemporaryDirectory() as root:
+                db = AsyncMongoMockClient()["unit"]
+                store = BlobStore(Path(root))
+                original = await store.put(b"original")
+                await db.cards.insert_one(stored_card("racing", original))
+                removed = []
+                lifecycle = RacingLifecycle(db, store, None, on_removed=removed.extend,
+                                            retention=timedelta(days=7), max_unserved=0)
+                report = await lifecycle.sweep()
+                if report["restored"] != 1 or report["evicted"] != 0 or removed:
+                    print(f"❌ Expected the liked card restored: {report}")
+                    return False
+                card = await db.cards.find_one({"id": "racing"}, {"_id": 0})
+                if card is None or card["image_sha256"] != original or not await store.exists(original):
+                    print("❌ Restored card or its image is missing")
+                    return False
+            print("✅ The card liked mid-eviction was restored with its image")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_storage_trim_order(self):
+        """Test that unserved stock above the cap is trimmed newest first"""
+        print("🧹 Testing unserved inventory trim...")
+
+        async def scenario():
+            with tempfile.TemporaryDirectory() as root:
+                db = AsyncMongoMockClient()["unit"]
+                store = BlobStore(Path(root))
+                await db.cards.insert_many([
+                    stored_card(f"age-{age}", await store.put(f"image-{age}".encode()), served=False, age_days=age)
+                    for age in (4, 3, 2, 1)
+                ])
+                lifecycle = StorageLifecycle(db, store, None, retention=timedelta(0), max_unserved=2)
+                report = await lifecycle.sweep()
+                remaining = set(await db.cards.distinct("id"))
+                if report["trimmed"] != 2 or remaining != {"age-4", "age-3"}:
+                    print(f"❌ Expected the 2 newest cards trimmed, kept {remaining}")
+                    return False
+            print("✅ The newest unserved cards were trimmed; claims keep the oldest")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_storage_compaction_resume(self):
+        """Test that the compactor resumes after its last card and only picks up newer ones"""
+        print("🧹 Testing compaction keyset resume...")
+
+        async def scenario():
+            with tempfile.TemporaryDirectory() as root:
+                db = AsyncMongoMockClient()["unit"]
+                store = BlobStore(Path(root))
+                for age in (3, 2, 1):
+                    await db.cards.insert_one(stored_card(f"age-{age}", await store.put(f"image-{age}".encode()),
+                                                          age_days=age))
+                recompressor = FakeRecompressor()
+                lifecycle = StorageLifecycle(db, store, recompressor, compact_batch=2)
+                batches = [await lifecycle.compact(), await lifecycle.compact(), await lifecycle.compact()]
+                if [batch["skipped"] for batch in batches] != [2, 1, 0]:
+                    print(f"❌ Expected batches of 2, 1 and 0 cards: {batches}")
+                    return False
+                if recompressor.seen != [b"image-3", b"image-2", b"image-1"]:
+                    print(f"❌ Cards were not compacted oldest first, once each: {recompressor.seen}")
+                    return False
+
+                # Only cards past the high-water mark are read, not a rescan from the start
+                await db.cards.update_many({}, {"$unset": {"image_compacted": ""}})
+                await db.cards.insert_one(stored_card("new", await store.put(b"image-new"), age_days=0))
+                batch = await lifecycle.compact()
+                if batch["skipped"] != 1 or recompressor.seen[-1] != b"image-new":
+                    print(f"❌ Compactor did not resume after its last card: {recompressor.seen}")
+                    return False
+            print("✅ Compaction resumed from its high-water mark")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_session_shared_secret(self):
+        """Test that workers without SESSION_SECRET accept each other's tokens"""
+        print("🔑 Testing shared session secrets...")
+
+        async def scenario():
+            settings = AsyncMongoMockClient()["unit"]["settings"]
+            first, second = SessionTokens(), SessionTokens()
+            await asyncio.gather(first.load_shared_secret(settings), second.load_shared_secret(settings))
+            user_id, token = first.issue()
+            if second.verify(token) != user_id:
+                print("❌ A token from one worker was rejected by another")
+                return False
+            restarted = SessionTokens()
+            await restarted.load_shared_secret(settings)
+            if restarted.verify(token) != user_id:
+                print("❌ A token did not survive a restart")
+                return False
+
+            configured = SessionTokens("configured")
+            await configured.load_shared_secret(settings)
+            if configured.verify(token) is not None or configured.verify(configured.token_for(user_id)) != user_id:
+                print("❌ A configured secret was replaced by the stored one")
+                return False
+            if second.verify(f"{user_id}.forged") is not None:
+                print("❌ A forged token was accepted")
+                return False
+            print("✅ Workers and restarts shared one generated secret")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_swipe_event_ids_per_user(self):
+        """Test that replayed swipes are dropped per user, not across users"""
+        print("👆 Testing swipe event deduplication...")
+
+        async def scenario():
+            db = AsyncMongoMockClient()["unit"]
+            writer = SwipeWriter(db)
+            event_id = str(uuid.uuid4())
+            applied = await writer.apply([
+                SwipeEvent(event_id=event_id, card_id="card-a", liked=True, user_id="alice"),
+                SwipeEvent(event_id=event_id, card_id="card-b", liked=True, user_id="bob"),
+            ])
+            if applied != 2:
+                print(f"❌ A shared event id suppressed another user's swipe ({applied} applied)")
+                return False
+            replayed = await writer.apply([SwipeEvent(event_id=event_id, card_id="card-a", liked=False, user_id="alice")])
+            if replayed != 0 or await db.likes.count_documents({}) != 2:
+                print("❌ A replayed swipe was applied again")
+                return False
+            print("✅ Event ids deduplicated per user")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_job_lease_expiry(self):
+        """Test that an item whose lease expired is re-claimed and counted once"""
+        print("⏳ Testing job lease expiry...")
+
+        async def generate(prompt):
+            return {"id": str(uuid.uuid4()), "prompt": prompt}
+
+        async def scenario():
+            db = job_database()
+            first = JobQueue(db, generate, item_timeout=0.05, lease_margin=0, worker_id="first")
+            second = JobQueue(db, generate, item_timeout=0.05, lease_margin=0, worker_id="second")
+            job = await first.submit(["dragon"])
+            stale = await first.claim()
+            if await second.claim() is not None:
+                print("❌ A leased item was claimed twice")
+                return False
+            await asyncio.sleep(0.1)
+            item = await second.claim()
+            if item is None or item["attempts"] != 2:
+                print("❌ An item with an expired lease was not re-claimed")
+                return False
+            await second.process(item)
+            # The first worker finishes late; its outcome must not count
+            await first.process(stale)
+            job = await first.get(job.id)
+            if job.status != COMPLETED or job.completed != 1 or len(job.card_ids) != 1:
+                print(f"❌ Job finished as {job.status} with {job.completed} completed")
+                return False
+            if await db.job_items.count_documents({}) != 0:
+                print("❌ A finished job kept its items")
+                return False
+            print("✅ Expired lease re-claimed and counted once")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_job_cancel_running(self):
+        """Test that cancelling a running job cancels its claimed and pending items"""
+        print("🛑 Testing running job cancellation...")
+        generated = []
+
+        async def generate(prompt):
+            generated.append(prompt)
+            return {"id": str(uuid.uuid4()), "prompt": prompt}
+
+        async def scenario():
+            db = job_database()
+            queue = JobQueue(db, generate, worker_id="worker")
+            job = await queue.submit(["a", "b", "c"])
+            item = await queue.claim()
+            if (await queue.get(job.id)).status != "running":
+                print("❌ Claiming an item did not start the job")
+                return False
+            job = await queue.cancel(job.id)
+            if job.status != CANCELLED or job.cancelled != 2 or await queue.claim() is not None:
+                print("❌ Pending items stayed claimable after cancelling")
+                return False
+            await queue.process(item)
+            job = await queue.get(job.id)
+            if generated or job.cancelled != 3 or job.completed != 0:
+                print(f"❌ A claimed item of a cancelled job ran ({job.cancelled} cancelled)")
+                return False
+            if await db.job_items.count_documents({}) != 0:
+                print("❌ A cancelled job kept its items")
+                return False
+            print("✅ Running job cancelled without generating")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_leader_election(self):
+        """Test acquiring, renewing and stepping down from the leader lease"""
+        print("👑 Testing leader election...")
+        events = []
+
+        async def scenario():
+            leases = AsyncMongoMockClient()["unit"]["leases"]
+
+            def candidate(name):
+                async def elected():
+                    events.append((name, "elected"))
+
+                async def deposed():
+                    events.append((name, "deposed"))
+
+                return LeaderElection(leases, elected, deposed, ttl=0.3, renew_interval=0.1, candidate_id=name)
+
+            first, second = candidate("first"), candidate("second")
+            if not await first.try_acquire() or await second.try_acquire() or not await first.try_acquire():
+                print("❌ The lease was not exclusive while renewed")
+                return False
+            await asyncio.sleep(0.4)
+            if not await second.try_acquire():
+                print("❌ An expired lease was not taken over")
+                return False
+            # The stale holder's conditional upsert must lose to the new owner
+            if await first.try_acquire():
+                print("❌ A stale holder took the lease back")
+                return False
+
+            await leases.delete_many({})
+            first.start()
+            await asyncio.sleep(0.05)
+            if not first.is_leader or events != [("first", "elected")]:
+                print(f"❌ The running candidate was not elected: {events}")
+                return False
+            # Another candidate owns the lease, e.g. after this one was paused past the ttl
+            await leases.update_one({"_id": first.name}, {"$set": {"owner": "second"}})
+            await asyncio.sleep(0.15)
+            if first.is_leader or events[-1] != ("first", "deposed"):
+                print("❌ A leader that lost its lease did not step down")
+                return False
+
+            await leases.delete_many({})
+            await asyncio.sleep(0.15)
+            await first.stop()
+            if first.is_leader or events[-1] != ("first", "deposed") or not await second.try_acquire():
+                print("❌ Stopping did not release the lease")
+                return False
+            if events.count(("first", "elected")) != 2:
+                print(f"❌ Unexpected elections: {events}")
+                return False
+            print("✅ Lease acquired, renewed, lost and released")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_event_ids_per_process(self):
+        """Test that a Last-Event-ID from another process gets a resync, not a replay"""
+        print("📡 Testing event ids across processes...")
+
+        async def scenario():
+            first, second = EventBus(), EventBus()
+            for bus in (first, second):
+                for n in range(3):
+                    bus.publish("card", {"n": n})
+            frame = first.publish("card", {"n": 3}).encode(first.epoch)
+            last_event_id = frame.split("\n")[0][len("id: "):]
+
+            resumed = first.subscribe(f"{first.epoch}-2")
+            replayed = [resumed.queue.get_nowait().data["n"] for _ in range(resumed.queue.qsize())]
+            if replayed != [2, 3]:
+                print(f"❌ Resuming on the same process replayed {replayed}")
+                return False
+            foreign = second.subscribe(last_event_id)
+            events = [foreign.queue.get_nowait() for _ in range(foreign.queue.qsize())]
+            if [event.type for event in events] != [RESYNC]:
+                print(f"❌ A foreign Last-Event-ID replayed {[event.data for event in events]}")
+                return False
+            if [second.subscribe(bad).queue.get_nowait().type for bad in ("4", "junk")] != [RESYNC, RESYNC]:
+                print("❌ A malformed Last-Event-ID was not resynced")
+                return False
+            print("✅ Foreign Last-Event-IDs resync, local ones resume")
+            return True
+
+        return asyncio.run(scenario())
+
+    def test_cursor_values(self):
+        """Test that cursors round-trip sort values and reject Mongo operators"""
+        print("🔖 Testing pagination cursors...")
+        now = datetime.now(timezone.utc)
+        for value in (now, "b", 3, 2.5):
+            if decode_cursor(encode_cursor(value, "card")) != (value, "card"):
+                print(f"❌ Cursor for {value!r} did not round-trip")
+                return False
+
+        forged = [
+            {"v": {"$ne": None}, "id": ""},
+            {"v": 1, "id": {"$gt": ""}},
+            {"v": [1], "id": "card"},
+            {"v": True, "id": "card"},
+            {"t": 5, "id": "card"},
+            ["v", "id"],
+        ]
+        for payload in forged:
+            cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            try:
+                keyset_filter("created_at", "id", cursor)
+            except InvalidCursor:
+                continue
+            print(f"❌ Forged cursor {payload} was accepted")
+            return False
+        print("✅ Cursors round-trip and forged values are rejected")
+        return True
+
+    def test_cancel_and_wait(self):
+        """Test that background tasks stop even when one swallows a cancellation"""
+        print("⏹️ Testing task cancellation...")
+
+        async def stubborn():
+            # Like asyncio.wait_for when the wrapped call finishes as it is cancelled
+            try:
+                await asyncio.sleep(3600)
+            except asyncio.CancelledError:
+                pass
+            while True:
+                await asyncio.sleep(3600)
+
+        async def scenario():
+            tasks = [asyncio.create_task(stubborn()), asyncio.create_task(asyncio.sleep(3600))]
+            await asyncio.sleep(0)
+            await asyncio.wait_for(cancel_and_wait(*tasks, None, interval=0.01), timeout=1)
+            if not all(task.done() for task in tasks):
+                print("❌ A task was still running")
+                return False
+            print("✅ Every task stopped")
+            return True
+
+        return asyncio.run(scenario())
+
+    def run_all_tests(self):
+        """Run all offline backend tests"""
+        print("🚀 Starting Offline Backend Tests for Pixel Card Collection Game")
+        print("=" * 60)
+
+        test_results = {}
+
+        tests = [
+            ("Resilience AIMD", self.test_resilience_aimd),
+            ("Resilience Limit", self.test_resilience_limit_enforced),
+            ("Resilience Breaker", self.test_resilience_breaker),
+            ("Resilience Errors", self.test_resilience_errors),
+            ("Coalescing", self.test_coalescing),
+            ("Coalescing Abandoned", self.test_coalescing_abandoned),
+            ("Dedup Bands", self.test_dedup_bands),
+            ("Dedup Lookup", self.test_dedup_lookup),
+            ("Generation Reuse", self.test_generation_reuse),
+            ("Response Cache Invalidation", self.test_response_cache_generations),
+            ("Response Cache Bounds", self.test_response_cache_bounds),
+            ("Fast JSON Pages", self.test_fastjson_pages),
+            ("Fast JSON NDJSON", self.test_fastjson_ndjson),
+            ("Inventory Follower Kick", self.test_inventory_follower_kick),
+            ("Batch Partial Insert", self.test_batch_partial_insert),
+            ("Storage Shared Variants", self.test_storage_shared_variants),
+            ("Storage Retention", self.test_storage_retention),
+            ("Storage Like Race", self.test_storage_like_race),
+            ("Storage Trim Order", self.test_storage_trim_order),
+            ("Storage Compaction Resume", self.test_storage_compaction_resume),
+            ("Session Shared Secret", self.test_session_shared_secret),
+            ("Swipe Event Ids Per User", self.test_swipe_event_ids_per_user),
+            ("Job Lease Expiry", self.test_job_lease_expiry),
+            ("Job Cancel Running", self.test_job_cancel_running),
+            ("Leader Election", self.test_leader_election),
+            ("Event Ids Per Process", self.test_event_ids_per_process),
+            ("Cursor Values", self.test_cursor_values),
+            ("Cancel And Wait", self.test_cancel_and_wait),
+        ]
+
+        for test_name, test_func in tests:
+            print(f"\n--- {test_name} ---")
+            try:
+                result = test_func()
+                test_results[test_name] = result
+                if result:
+                    print(f"✅ {test_name} PASSED")
+                else:
+                    print(f"❌ {test_name} FAILED")
+            except Exception as e:
+                print(f"❌ {test_name} ERROR: {str(e)}")
+                test_results[test_name] = False
+
+        print("\n" + "=" * 60)
+        print("📊 TEST SUMMARY")
+        print("=" * 60)
+
+        passed = sum(1 for result in test_results.values() if result)
+        total = len(test_results)
+
+        for test_name, result in test_results.items():
+            status = "✅ PASS" if result else "❌ FAIL"
+            print(f"{test_name}: {status}")
+
+        print(f"\nOverall: {passed}/{total} tests passed")
+
+        if passed == total:
+            print("🎉 All offline backend tests PASSED!")
+            return True
+        else:
+            print("⚠️ Some offline backend tests FAILED!")
+            return False
+
+
+if __name__ == "__main__":
+    tester = BackendUnitTester()
+    success = tester.run_all_tests()
+    exit(0 if success else 1)
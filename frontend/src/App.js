@@ -1,9 +1,34 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import "./App.css";
 import axios from "axios";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const SESSION_KEY = "pixelCardSession";
+
+// Anonymous session: the token identifies this browser's own collection
+const ensureSession = async () => {
+  const stored = localStorage.getItem(SESSION_KEY);
+  // The server returns the stored token if it is still valid, or starts a new session
+  const response = await axios.get(`${API}/session`, stored ? { headers: { "X-Session-Token": stored } } : {});
+  localStorage.setItem(SESSION_KEY, response.data.token);
+  axios.defaults.headers.common["X-Session-Token"] = response.data.token;
+};
+
+// crypto.randomUUID only exists in secure contexts (HTTPS or localhost)
+const newEventId = () => {
+  if (window.crypto && window.crypto.randomUUID) return window.crypto.randomUUID();
+  const bytes = new Uint8Array(16);
+  if (window.crypto && window.crypto.getRandomValues) {
+    window.crypto.getRandomValues(bytes);
+  } else {
+    for (let i = 0; i < bytes.length; i++) bytes[i] = Math.floor(Math.random() * 256);
+  }
+  bytes[6] = (bytes[6] & 0x0f) | 0x40;
+  bytes[8] = (bytes[8] & 0x3f) | 0x80;
+  const hex = Array.from(bytes, b => b.toString(16).padStart(2, "0")).join("");
+  return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+};
 
 // MapleStory-inspired components
 const PixelButton = ({ children, onClick, variant = "primary", disabled = false }) => {
@@ -37,7 +62,7 @@ const PixelCard = ({ card, onLike, onDislike, isVisible = true }) => {
       
       <div className="card-image-container bg-white border-2 border-gray-400 p-2 mb-4">
         <img 
-          src={`data:image/png;base64,${card.image_base64}`}
+          src={`${BACKEND_URL}${card.image_url}`}
           alt="Pixel Art"
           className="w-full h-48 object-contain pixel-art"
         />
@@ -55,7 +80,35 @@ const PixelCard = ({ card, onLike, onDislike, isVisible = true }) => {
   );
 };
 
-const CollectionGallery = ({ collection, onBack }) => {
+// One card cut out of its collection page's sprite sheet; a plain thumbnail if it has no place in one
+const AtlasSprite = ({ card }) => {
+  if (!card.sheet_url || card.x === undefined) {
+    return (
+      <img 
+        src={`${BACKEND_URL}${card.image_url}?size=128`}
+        alt="Pixel Art"
+        className="w-full h-32 object-contain pixel-art"
+      />
+    );
+  }
+  return (
+    <div className="w-full h-32 flex items-center justify-center">
+      <div
+        role="img"
+        aria-label="Pixel Art"
+        className="pixel-art"
+        style={{
+          width: card.w,
+          height: card.h,
+          backgroundImage: `url(${BACKEND_URL}${card.sheet_url})`,
+          backgroundPosition: `-${card.x}px -${card.y}px`,
+        }}
+      />
+    </div>
+  );
+};
+
+const CollectionGallery = ({ collection, total, hasMore, onLoadMore, onBack }) => {
   const [zoomedCard, setZoomedCard] = useState(null);
 
   const handleCardClick = (card) => {
@@ -70,7 +123,7 @@ const CollectionGallery = ({ collection, onBack }) => {
     <div className="collection-view min-h-screen bg-gradient-to-b from-purple-900 via-blue-900 to-indigo-900 p-4">
       <div className="max-w-6xl mx-auto">
         <div className="flex items-center justify-between mb-6">
-          <h1 className="text-4xl font-bold text-white pixel-text">My Collection</h1>
+          <h1 className="text-4xl font-bold text-white pixel-text">My Collection ({total})</h1>
           <PixelButton variant="secondary" onClick={onBack}>
             🏠 Back to Cards
           </PixelButton>
@@ -93,11 +146,7 @@ const CollectionGallery = ({ collection, onBack }) => {
                   Collected #{index + 1}
                 </div>
                 <div className="card-image-container bg-white border-2 border-gray-400 p-2">
-                  <img 
-                    src={`data:image/png;base64,${card.image_base64}`}
-                    alt="Pixel Art"
-                    className="w-full h-32 object-contain pixel-art"
-                  />
+                  <AtlasSprite card={card} />
                 </div>
                 <div className="mt-2 text-center">
                   <span className="text-pink-800 text-sm font-semibold">💖 Liked</span>
@@ -109,6 +158,14 @@ const CollectionGallery = ({ collection, onBack }) => {
             ))}
           </div>
         )}
+
+        {hasMore && (
+          <div className="mt-6 text-center">
+            <PixelButton variant="primary" onClick={onLoadMore}>
+              ⬇️ Load More
+            </PixelButton>
+          </div>
+        )}
       </div>
 
       {/* Zoom Modal */}
@@ -131,7 +188,7 @@ const CollectionGallery = ({ collection, onBack }) => {
             
             <div className="card-image-container bg-white border-2 border-gray-400 p-4 rounded">
               <img 
-                src={`data:image/png;base64,${zoomedCard.image_base64}`}
+                src={`${BACKEND_URL}${zoomedCard.image_url}`}
                 alt="Pixel Art Zoomed"
                 className="w-full max-w-2xl h-auto object-contain pixel-art mx-auto"
               />
@@ -156,16 +213,20 @@ const GameUI = () => {
   const [currentCard, setCurrentCard] = useState(null);
   const [nextCard, setNextCard] = useState(null);
   const [collection, setCollection] = useState([]);
+  const [collectionTotal, setCollectionTotal] = useState(0);
+  const [collectionNextPage, setCollectionNextPage] = useState(null);
   const [isLoading, setIsLoading] = useState(true); // Start with loading true
   const [showCollection, setShowCollection] = useState(false);
   const [cardQueue, setCardQueue] = useState([]);
   const [stats, setStats] = useState({ total: 0, liked: 0 });
+  // One event id per card and choice, so double taps and retries of a swipe are deduplicated
+  const swipeIds = useRef({});
 
-  // Fetch existing cards first, then generate new ones
-  const fetchCards = async () => {
+  // Claim unseen cards from the server-side feed, then generate new ones
+  const fetchCards = async (n = 5) => {
     try {
-      const response = await axios.get(`${API}/cards`);
-      return response.data;
+      const response = await axios.get(`${API}/feed`, { params: { n } });
+      return response.data.cards;
     } catch (error) {
       console.error('Error fetching cards:', error);
       return [];
@@ -189,13 +250,9 @@ const GameUI = () => {
     try {
       console.log('Starting to load initial cards...');
       
-      // First try to get existing cards
-      let cards = await fetchCards();
-      console.log('Fetched cards:', cards.length);
-      
-      // Filter out already liked cards
-      const availableCards = cards.filter(card => !card.is_liked);
-      console.log('Available cards (not liked):', availableCards.length);
+      // First try to get unseen cards; the feed never returns liked or served ones
+      const availableCards = await fetchCards();
+      console.log('Available cards from feed:', availableCards.length);
       
       if (availableCards.length === 0) {
         // If no available cards, generate a new one
@@ -241,11 +298,15 @@ const GameUI = () => {
     }
   };
 
-  // Load user collection
-  const loadCollection = async () => {
+  // Load a page of the user's collection: one coordinate map plus one sprite sheet
+  const loadCollection = async (page = 0) => {
     try {
-      const response = await axios.get(`${API}/collection`);
-      setCollection(response.data);
+      const response = await axios.get(`${API}/collection/atlas`, { params: { page, size: 128 } });
+      const { sheet_url, cards, pages, total } = response.data;
+      const pageCards = cards.map(card => ({ ...card, sheet_url }));
+      setCollection(prev => page > 0 ? [...prev, ...pageCards] : pageCards);
+      setCollectionNextPage(page + 1 < pages ? page + 1 : null);
+      setCollectionTotal(total);
     } catch (error) {
       console.error('Error loading collection:', error);
     }
@@ -255,10 +316,14 @@ const GameUI = () => {
   const handleCardAction = async (liked) => {
     if (!currentCard) return;
     
+    const cardId = currentCard.id;
+    const intent = `${cardId}:${liked}`;
+    swipeIds.current[intent] = swipeIds.current[intent] || newEventId();
+    
     try {
-      await axios.post(`${API}/like-card`, {
-        card_id: currentCard.id,
-        liked: liked
+      // The event id lets the server drop retried or double-tapped swipes
+      await axios.post(`${API}/swipes`, {
+        events: [{ event_id: swipeIds.current[intent], card_id: cardId, liked: liked }]
       });
       
       // Update stats
@@ -278,15 +343,16 @@ const GameUI = () => {
       
       // Prepare next card
       if (cardQueue.length <= 1) {
-        const newCard = await generateNewCard();
-        setNextCard(newCard);
+        const [feedCard] = await fetchCards(1);
+        setNextCard(feedCard || await generateNewCard());
       } else {
         setNextCard(cardQueue[1]);
       }
       
-      // Reload collection if card was liked
+      // Swipes are written in the background, so add the card locally
       if (liked) {
-        await loadCollection();
+        setCollection(prev => [{ ...currentCard, is_liked: true }, ...prev]);
+        setCollectionTotal(prev => prev + 1);
       }
       
     } catch (error) {
@@ -296,8 +362,13 @@ const GameUI = () => {
 
   // Initialize app
   useEffect(() => {
-    loadInitialCards();
-    loadCollection();
+    // Start the session first, so parallel requests don't each start their own
+    ensureSession()
+      .catch(error => console.error('Error starting session:', error))
+      .finally(() => {
+        loadInitialCards();
+        loadCollection();
+      });
     
     // Add a fallback timeout to prevent infinite loading
     const loadingTimeout = setTimeout(() => {
@@ -310,8 +381,36 @@ const GameUI = () => {
     return () => clearTimeout(loadingTimeout);
   }, []);
 
+  // Out of cards: wait for the server to push the next generated one, re-checking
+  // every 30 seconds in case the event never arrives (e.g. a dropped stream)
+  useEffect(() => {
+    if (isLoading || currentCard) return;
+    const events = new EventSource(`${API}/events`);
+    const retry = () => {
+      events.close();
+      clearTimeout(fallback);
+      loadInitialCards();
+    };
+    const fallback = setTimeout(retry, 30000);
+    events.addEventListener('card', retry);
+    // Events were missed, e.g. after reconnecting to another server process
+    events.addEventListener('resync', retry);
+    return () => {
+      events.close();
+      clearTimeout(fallback);
+    };
+  }, [isLoading, currentCard]);
+
   if (showCollection) {
-    return <CollectionGallery collection={collection} onBack={() => setShowCollection(false)} />;
+    return (
+      <CollectionGallery
+        collection={collection}
+        total={collectionTotal}
+        hasMore={collectionNextPage !== null}
+        onLoadMore={() => loadCollection(collectionNextPage)}
+        onBack={() => setShowCollection(false)}
+      />
+    );
   }
 
   return (
@@ -331,8 +430,8 @@ const GameUI = () => {
                 </div>
               </div>
               <div className="flex space-x-2">
-                <PixelButton variant="secondary" onClick={() => setShowCollection(true)}>
-                  📚 Collection ({collection.length})
+                <PixelButton variant="secondary" onClick={() => { loadCollection(); setShowCollection(true); }}>
+                  📚 Collection ({collectionTotal})
                 </PixelButton>
               </div>
             </div>